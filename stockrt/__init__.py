@@ -1,12 +1,20 @@
 __version__ = '1.0.6'
 __author__ = 'JumuFENG'
 
-from .sources.rtbase import set_array_format, get_fullcode, to_int_kltype, logger
-from .wrapper import quotes, quotes5, klines, tlines, qklines, fklines, stock_list, transactions
-from .wrapper import rtsource, set_default_sources
+from .sources.rtbase import set_array_format, set_quote_format, get_fullcode, get_fullcodes, to_int_kltype, logger, LazyQuotes
+from .sources.rtbase import set_cache_dir, get_cache_dir
+from .sources.records import Quote, Bar, MISSING
+from .sources.secmaster import SecurityMaster, get_security_master
+from .sources.tlinetracker import TlineTracker
+from .sources.livebars import LiveBars
+from .sources.tickbars import TickBars
+from .wrapper import quotes, quotes5, klines, tlines, tline_matrix, qklines, resample_klines, fklines, stock_list, transactions
+from .wrapper import rtsource, set_default_sources, set_rate_limits
 
 __all__ = [
-    'rtsource', 'quotes', 'quotes5', 'klines', 'tlines', 'qklines', 'fklines', 'stock_list', 'transactions'
-    'logger', 'set_array_format', 'get_fullcode', 'to_int_kltype', 'set_default_sources'
+    'rtsource', 'quotes', 'quotes5', 'klines', 'tlines', 'tline_matrix', 'qklines', 'resample_klines', 'fklines', 'stock_list', 'transactions',
+    'logger', 'set_array_format', 'get_fullcode', 'get_fullcodes', 'to_int_kltype', 'set_default_sources', 'LazyQuotes',
+    'set_quote_format', 'Quote', 'Bar', 'MISSING', 'SecurityMaster', 'get_security_master',
+    'set_cache_dir', 'get_cache_dir', 'set_rate_limits', 'TlineTracker', 'LiveBars', 'TickBars'
 ]
 
@@ -4,6 +4,7 @@ import time
 import json
 import hashlib
 from .rtbase import requestbase
+from .secmaster import get_security_master
 
 """
 reference: https://www.cls.cn/quotation
@@ -27,6 +28,7 @@ type:
 https://x-quote.cls.cn/quote/stock/tline?app=CailianpressWeb&fields=date,minute,last_px,business_balance,business_amount,open_px,preclose_px,av_px&os=web&secu_code=sh601011&sv=8.4.6&sign=f4040f9e8baac1916153cdda5ea28e94
 https://x-quote.cls.cn/quote/stock/tline_history?app=CailianpressWeb&os=web&secu_code=sh601011&sv=8.4.6&sign=36e01d1a347ffe8e65bf81f6e97dfbe3
 https://x-quote.cls.cn/quote/index/tlines?app=CailianpressWeb&os=web&secu_codes=sz000001,sh601011&sv=8.4.6&sign=9ea9e14dfc9a42ffde4591784cf23044
+批量分时接口同样可以用 fields 指定字段, business_amount 为每分钟的成交量(股), 不是累计值
 
 股票列表-涨幅榜
 https://www.cls.cn/allStocks
@@ -40,15 +42,61 @@ start=1表示从第一笔开始取, end表示取到第几笔结束, 拿不到竞
 """
 
 
+def _cls_secucode(fcode):
+    if fcode.startswith('sh') or fcode.startswith('sz'):
+        return fcode
+    if fcode.startswith('bj'):
+        return fcode[-6:] + '.BJ'
+    raise ValueError(f"Unsupported stock code format: {fcode}")
+
+def _cls_fullcode(secu):
+    if secu.startswith('sh') or secu.startswith('sz'):
+        return secu
+    if secu.endswith('.BJ'):
+        secu = secu.replace('.BJ', '')
+        return secu if secu.startswith('bj') else 'bj' + secu
+    raise ValueError(f"Unsupported security code format: {secu}")
+
+get_security_master().register_source('cls', _cls_secucode, _cls_fullcode)
+
+
 class CailianShe(requestbase):
     clsbase_param = 'app=CailianpressWeb&os=web&sv=8.4.6'
     stocklist_page_size = 30
+    # 分时矩阵每次请求的股票数, 全天的分时数据较大, 比行情分组小
+    tline_max_num = 200
+    # 批量分时接口请求的字段, 不指定时不一定返回 business_amount
+    tline_fields = 'minute,last_px,change,business_amount'
+
+    # 字段名: (财联社字段, 转换函数), date/time 为本地时间不需要请求
+    quote_fields = {
+        'name': ('secu_name', None),
+        'open': ('open_px', None),
+        'lclose': ('preclose_px', None),
+        'price': ('last_px', None),
+        'high': ('high_px', None),
+        'low': ('low_px', None),
+        'volume': ('business_amount', int),
+        'amount': ('business_balance', float),
+        'change': ('change', float),
+        'change_px': ('change_px', float),
+        'bottom_price': ('down_price', float),
+        'top_price': ('up_price', float),
+        'cmc': ('cmc', lambda v: 0 if v is None else float(v)),
+        'avg_price': ('av_px', None),
+        'trade_status': ('trade_status', None),
+        'secu_type': ('secu_type', None),
+        'PE': ('pe', None),
+        'TTM_PE': ('ttm_pe', None),
+        'PB': ('pb', None),
+    }
+
+    def _quote_field_names(self, fields):
+        return [k for k in self.quote_fields if fields is None or k in fields]
     @property
     def qtapi(self):
         return (
-            "https://x-quote.cls.cn/quote/stocks/basic?%s&fields=open_px,av_px,high_px,low_px,change,change_px,"
-            "down_price,cmc,business_amount,business_balance,secu_name,secu_code,trade_status,secu_type,preclose_px,"
-            "up_price,last_px,pe,ttm_pe,pb&secu_codes=%s"
+            "https://x-quote.cls.cn/quote/stocks/basic?%s&fields=%s&secu_codes=%s"
         )
 
     @property
@@ -57,7 +105,7 @@ class CailianShe(requestbase):
 
     @property
     def tlineapi(self):
-        return "https://x-quote.cls.cn/quote/index/tlines?%s&secu_codes=%s"
+        return "https://x-quote.cls.cn/quote/index/tlines?%s&fields=%s&secu_codes=%s"
 
     @property
     def mklineapi(self):
@@ -74,20 +122,10 @@ class CailianShe(requestbase):
         )
 
     def get_secucode(self, stock):
-        fcode = self.get_fullcode(stock)
-        if fcode.startswith('sh') or fcode.startswith('sz'):
-            return fcode
-        if fcode.startswith('bj'):
-            return fcode[-6:] + '.BJ'
-        raise ValueError(f"Unsupported stock code format: {stock}")
+        return get_security_master().source_code('cls', stock)
 
     def secu_to_fullcode(self, secu):
-        if secu.startswith('sh') or secu.startswith('sz'):
-            return secu
-        if secu.endswith('.BJ'):
-            secu = secu.replace('.BJ', '')
-            return secu if secu.startswith('bj') else 'bj' + secu
-        raise ValueError(f"Unsupported security code format: {secu}")
+        return get_security_master().from_source_code('cls', secu)
 
     def _get_headers(self):
         headers = super()._get_headers()
@@ -96,26 +134,41 @@ class CailianShe(requestbase):
             'Host': 'x-quote.cls.cn',
         }
 
-    def get_quote_url(self, stocks):
-        url = self.qtapi % (self.clsbase_param, ','.join([self.get_secucode(s) for s in stocks]))
+    def get_quote_url(self, stocks, fields=None):
+        cfields = ','.join(['secu_code'] + [self.quote_fields[k][0] for k in self._quote_field_names(fields)])
+        url = self.qtapi % (self.clsbase_param, cfields, ','.join([self.get_secucode(s) for s in stocks]))
         return url, self._get_headers()
 
     def get_quote5_url(self, stock):
         url = self.qt5api % (self.clsbase_param, self.get_secucode(stock))
         return url, self._get_headers()
 
-    def quotes5(self, stocks):
-        return self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response)
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+        return self.format_quotes(self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response), fields, fmt)
 
     def get_tline_url(self, stocks):
-        url = self.tlineapi % (self.clsbase_param, ','.join([self.get_secucode(s) for s in stocks]))
+        url = self.tlineapi % (self.clsbase_param, self.tline_fields, ','.join([self.get_secucode(s) for s in stocks]))
         return url, self._get_headers()
 
-    def tlines(self, stocks):
+    def tlines(self, stocks, fmt=None):
         stocks = self._stock_groups(stocks)
-        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_response)
+        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_response, fmt_kwargs={'fmt': fmt})
+
+    def tline_updates(self, stocks, known):
+        return self._fetch_concurrently(self._stock_groups(stocks), self.get_tline_url, self.format_tline_updates, fmt_kwargs={'known': known})
+
+    def tline_points(self, stocks, known):
+        '''
+        分时矩阵使用的增量数据, 已有 known[code] 个分时点时从最后一个已有的点开始
+
+        :return: {code: (接口返回的分时点数, [[minute(HHMM), price, volume], ...])}, volume 为该分钟的成交量, 没有成交量字段时为 nan
+        '''
+        if not isinstance(stocks, (list, tuple)):
+            stocks = [stocks]
+        groups = [stocks[i:i + self.tline_max_num] for i in range(0, len(stocks), self.tline_max_num)]
+        return self._fetch_concurrently(groups, self.get_tline_url, self.format_tline_points, fmt_kwargs={'known': known})
 
-    def get_dkline_url(self, stock, kltype='1', length=320, fq=1):
+    def get_dkline_url(self, stock, kltype='1', length=320, fq=1, fields=None):
         fq_map = {0: '', 1: 'f', 2: 'b'}
         kltype_map = {101: 'd1', 102: 'w', 103: 'm', 106: 'y'}
         kltype = self.to_int_kltype(kltype)
@@ -126,43 +179,28 @@ class CailianShe(requestbase):
         )
         return url, self._get_headers()
 
-    def get_mkline_url(self, stock, kltype='1', length=320, fq=1):
+    def get_mkline_url(self, stock, kltype='1', length=320, fq=1, fields=None):
         pass  # 财联社不支持分钟线数据
 
-    def mklines(self, stocks, kltype='1', length=320, fq=1):
+    def mklines(self, stocks, kltype='1', length=320, fq=1, withqt=False, fields=None, fmt=None):
         return None
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, fields=None, **kwargs):
         result = {}
         date = time.strftime('%Y-%m-%d', time.localtime())
         time_str = time.strftime('%H:%M:%S', time.localtime())
+        convs = [(k, *self.quote_fields[k]) for k in self._quote_field_names(fields)]
+        stamps = {k: v for k, v in (('date', date), ('time', time_str)) if fields is None or k in fields}
         for codes, rsp in rep_data:
             data = json.loads(rsp)['data']
             for stock in data:
                 fcode = self.secu_to_fullcode(stock)
                 code = fcode if fcode in codes else fcode[-6:] if fcode[-6:] in codes else fcode
+                sdata = data[stock]
                 result[code] = {
-                    'name': data[stock]['secu_name'],
-                    'open': data[stock]['open_px'],
-                    'lclose': data[stock]['preclose_px'],
-                    'price': data[stock]['last_px'],
-                    'high': data[stock]['high_px'],
-                    'low': data[stock]['low_px'],
-                    'date': date, 'time': time_str,
-                    'volume': int(data[stock]['business_amount']),
-                    'amount': float(data[stock]['business_balance']),
-                    'change': float(data[stock]['change']),
-                    'change_px': float(data[stock]['change_px']),
-                    'bottom_price': float(data[stock]['down_price']),
-                    'top_price': float(data[stock]['up_price']),
-                    'cmc': 0 if data[stock]['cmc'] is None else float(data[stock]['cmc']),
-                    'avg_price': data[stock]['av_px'],
-                    'trade_status': data[stock]['trade_status'],
-                    'secu_type': data[stock]['secu_type'],
-                    'PE': data[stock]['pe'],
-                    'TTM_PE': data[stock]['ttm_pe'],
-                    'PB': data[stock]['pb'],
+                    k: sdata[f] if conv is None else conv(sdata[f]) for k, f, conv in convs
                 }
+                result[code].update(stamps)
         return result
 
     def format_quote5_response(self, rep_data):
@@ -187,20 +225,34 @@ class CailianShe(requestbase):
                 }
         return result
 
-    def format_tline_response(self, rep_data):
-        result = {}
+    tline_cols = ['time', 'price', 'change']
+
+    def _tline_lines(self, rep_data):
+        ''' (code, 接口返回的分时点列表) '''
         for codes, rsp in rep_data:
             data = json.loads(rsp)['data']
             for stock in data:
                 fcode = self.secu_to_fullcode(stock)
                 code = fcode if fcode in codes else fcode[-6:] if fcode[-6:] in codes else fcode
-                tline = []
-                for item in data[stock]['line']:
-                    tline.append([f'{str(item["minute"]//100).ljust(2, "0")}:{str(item["minute"]%100).ljust(2, "0")}', item['last_px'], item['change']])
-                result[code] = self.format_array_list(tline, ['time', 'price', 'change'])
-        return result
+                yield code, data[stock]['line']
+
+    @staticmethod
+    def _tline_rows(line, start=0):
+        return [[f'{item["minute"] // 100:02d}:{item["minute"] % 100:02d}', item['last_px'], item['change']]
+            for item in line[start:]]
+
+    def format_tline_response(self, rep_data, fmt=None):
+        return {code: self.format_array_list(self._tline_rows(line), self.tline_cols, fmt=fmt) for code, line in self._tline_lines(rep_data)}
+
+    def format_tline_updates(self, rep_data, known):
+        return {code: self._tline_rows(line, self._tline_start(known.get(code, 0), len(line))) for code, line in self._tline_lines(rep_data)}
+
+    def format_tline_points(self, rep_data, known):
+        nan = float('nan')
+        return {code: (len(line), [[item['minute'], item['last_px'], item.get('business_amount', nan)]
+            for item in line[self._tline_start(known.get(code, 0), len(line)):]]) for code, line in self._tline_lines(rep_data)}
 
-    def format_kline_response(self, rep_data, **kwargs):
+    def format_kline_response(self, rep_data, fields=None, fmt=None, **kwargs):
         result = {}
         kcols = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'amplitude', 'change', 'change_px']
         for code, rsp in rep_data:
@@ -213,7 +265,7 @@ class CailianShe(requestbase):
                     item['business_amount'], item['business_balance'],
                     item['amp'], item['change'], item['close_px'] - item['preclose_px'],
                 ])
-            result[code] = self.format_array_list(klarr, kcols)
+            result[code] = self.format_array_list(klarr, kcols, fields=fields, fmt=fmt)
         return result
 
     def get_signcode(self, param):
@@ -224,7 +276,7 @@ class CailianShe(requestbase):
         signcode = md5_obj.hexdigest()
         return signcode
 
-    def get_stock_list_url(self, page = 1, market = 'all'):
+    def get_stock_list_url(self, page = 1, market = 'all', fields=None):
         types = 'last_px,change,tr,main_fund_diff,cmc,trade_status'
         market = {'all': 'all', 'sha': 'h', 'sza': 's'}.get(market, 'all')
         param = f'app=CailianpressWeb&market={market}&os=web&page={page}&rever=1&sv=8.4.6&types={types}'
@@ -232,7 +284,7 @@ class CailianShe(requestbase):
         url = self.stocklistapi % (self.clsbase_param, market, page, types) + f"&sign={signcode}"
         return url, self._get_headers()
 
-    def parse_stock_list(self, rep_data):
+    def parse_stock_list(self, rep_data, fields=None):
         data = json.loads(rep_data)['data']['data']
         return [{
             'code': stock['secu_code'],
@@ -243,6 +295,6 @@ class CailianShe(requestbase):
             'change': stock['change'],
         } for stock in data]
 
-    def stock_list_for_market(self, market: str = 'all'):
+    def stock_list_for_market(self, market: str = 'all', fields=None):
         pages = [self.get_market_stock_count(market) // self.stocklist_page_size + 1]
-        return self._fetch_concurrently(pages, self.get_stock_list_url, self.format_stock_list_response, convert_code=False, url_kwargs={'market': market}, fmt_kwargs={'market': market})
+        return self._fetch_concurrently(pages, self.get_stock_list_url, self.format_stock_list_response, convert_code=False, url_kwargs={'market': market}, fmt_kwargs={'market': market, 'fields': fields})
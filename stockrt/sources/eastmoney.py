@@ -6,9 +6,15 @@ import time
 import json
 import requests
 import random
+import atexit
+import threading
 import traceback
-from functools import lru_cache
-from .rtbase import get_session, requestbase, _USER_AGENT, logger
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from .rtbase import get_session, get_fullcode, get_cache_dir, get_rate_budget, requestbase, rtbase, _USER_AGENT, logger
+from .secmaster import get_security_master
 
 
 '''
@@ -43,36 +49,208 @@ https://quote.eastmoney.com/f1.html?newcode=0.301005
 https://72.push2.eastmoney.com/api/qt/stock/details/sse?fields1=f1,f2,f3,f4&fields2=f51,f52,f53,f54,f55&mpi=2000&ut=bd1d9ddb04089700cf9c27f6f7426281&fltt=2&pos=-0&secid=0.301005&wbp2u=|0|0|0|web
 '''
 
+class EmMirrors:
+    """
+    东财 push2 / push2his 的镜像服务器
+
+    请求按延迟(指数移动平均)的倒数加权分散到各个镜像, 连续失败 max_errors 次的镜像暂时剔除,
+    evict_time 秒后重新启用, 重新启用后再失败一次即再次剔除, 成功则恢复正常.
+    """
+    mirrors = {
+        'push2.eastmoney.com': ['', '2.', '7.', '36.', '48.', '72.', '76.'],
+        'push2his.eastmoney.com': ['', '7.', '33.', '63.', '91.'],
+    }
+    alpha = 0.2
+    max_errors = 3
+    evict_time = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._bases = {f'{p}{base}': base for base, prefixes in self.mirrors.items() for p in prefixes}
+
+    def base(self, host):
+        """ 镜像对应的主域名, 不是镜像时返回 None """
+        return self._bases.get(host)
+
+    def hosts(self, base):
+        return [f'{p}{base}' for p in self.mirrors[base]]
+
+    def _stat(self, host):
+        return self._stats.setdefault(host, {'latency': None, 'ok': 0, 'fail': 0, 'errors': 0, 'evicted_until': 0})
+
+    def pick(self, base, exclude=()):
+        """ 按权重随机选择一个可用的镜像, 全部被剔除时选择最早恢复的 """
+        now = time.time()
+        with self._lock:
+            hosts = [h for h in self.hosts(base) if h not in exclude] or self.hosts(base)
+            stats = [self._stat(h) for h in hosts]
+            alive = [(h, st) for h, st in zip(hosts, stats) if st['evicted_until'] <= now]
+            if not alive:
+                return min(zip(hosts, stats), key=lambda x: x[1]['evicted_until'])[0]
+            known = [st['latency'] for _, st in alive if st['latency']]
+            # 还没有统计的镜像按已知的平均延迟计算, 保证新镜像也能分到请求
+            default = sum(known) / len(known) if known else 1
+            weights = [1 / max(st['latency'] or default, 0.001) for _, st in alive]
+            return random.choices([h for h, _ in alive], weights)[0]
+
+    def record(self, host, latency, ok=True):
+        """ 记录一次请求的结果 """
+        with self._lock:
+            st = self._stat(host)
+            if ok:
+                st['latency'] = latency if st['latency'] is None else st['latency'] * (1 - self.alpha) + latency * self.alpha
+                st['ok'] += 1
+                st['errors'] = 0
+                return
+            st['fail'] += 1
+            st['errors'] += 1
+            if st['errors'] >= self.max_errors:
+                st['evicted_until'] = time.time() + self.evict_time
+                # 重新启用后再失败一次即再次剔除
+                st['errors'] = self.max_errors - 1
+                logger.warning('em mirror %s evicted for %ds', host, self.evict_time)
+
+    def stats(self):
+        with self._lock:
+            return {h: dict(st) for h, st in self._stats.items()}
+
+
+class _EmMirrorAdapter(HTTPAdapter):
+    """ 将 push2 / push2his 的请求分散到镜像服务器, 连接失败时换一个镜像重试 """
+    mirror_retries = 2
+
+    def __init__(self, mirrors, **kwargs):
+        super().__init__(**kwargs)
+        self.mirrors = mirrors
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        base = self.mirrors.base(url.hostname)
+        if base is None:
+            return super().send(request, **kwargs)
+        tried = []
+        while True:
+            host = self.mirrors.pick(base, tried)
+            request.url = url._replace(netloc=host).geturl()
+            if 'Host' in request.headers:
+                request.headers['Host'] = host
+            start = time.time()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.mirrors.record(host, time.time() - start, False)
+                tried.append(host)
+                if len(tried) > self.mirror_retries:
+                    raise
+                continue
+            self.mirrors.record(host, time.time() - start, response.status_code < 500)
+            return response
+
+
 class Em:
     cookies = []
     max_used = 10
+    total_max_used = 50000
+    cookie_lifetime = 3600 * 24
+    # 可用的cookie少于 min_spare 个时在后台生成新的cookie
+    min_spare = 2
+    cookie_file = 'em_cookies.json'
+    save_interval = 60
+    # qt_clist 同时请求的页数
+    clist_workers = 8
+    clist_retries = 10
     session = get_session('em')
+    mirrors = EmMirrors()
+    _cookie_lock = threading.RLock()
+    _cookies_loaded = False
+    _last_save = 0
+    _replenish_thread = None
+
+    @classmethod
+    def _load_cookies(cls):
+        """启动后第一次使用时从缓存目录恢复cookie及其使用次数(只在内存中没有cookie时)"""
+        cls._cookies_loaded = True
+        if cls.cookies:
+            return
+        try:
+            with open(os.path.join(get_cache_dir(), cls.cookie_file), 'r') as f:
+                cls.cookies = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @classmethod
+    def save_cookies(cls, force=False):
+        """保存cookie及其使用次数, 本进程没有使用过cookie时不保存"""
+        if not cls._cookies_loaded or (not force and time.time() - cls._last_save < cls.save_interval):
+            return
+        with cls._cookie_lock:
+            data = json.dumps(cls.cookies)
+            cls._last_save = time.time()
+        try:
+            path = os.path.join(get_cache_dir(), cls.cookie_file)
+            with open(path + '.tmp', 'w') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.debug('save em cookies failed: %s', e)
+
     @classmethod
-    @lru_cache(maxsize=1)
-    def host(cls):
-        return f"{random.choice(['','48.','2.','7.','36.','76.'])}push2.eastmoney.com"
+    def _new_cookie(cls, value):
+        now = time.time()
+        return {'cookie': value, 'timestamp': now, 'created': now, 'used': 0, 'total_used': 0}
 
     @classmethod
     def get_cookie(cls):
         # 50000/24h, 500/5min (这里减半)
-        cls.cookies = [c for c in cls.cookies if c['total_used'] < 50000]
-        for cookie in cls.cookies:
-            if time.time() - cookie['timestamp'] > 300:
-                cookie['timestamp'] = time.time()
-                cookie['used'] = 0
-        cookie = next((c for c in cls.cookies if c['used'] < cls.max_used), None)
-        if not cookie:
-            cookie = {
-                'cookie': cls.generate_cookie(),
-                'timestamp': time.time(),
-                'used': 0,
-                'total_used': 0,
-            }
-            cls.cookies.append(cookie)
-        cookie['used'] += 1
-        cookie['total_used'] += 1
+        with cls._cookie_lock:
+            if not cls._cookies_loaded:
+                cls._load_cookies()
+            now = time.time()
+            cls.cookies = [c for c in cls.cookies
+                if c['total_used'] < cls.total_max_used and now - c.get('created', c['timestamp']) < cls.cookie_lifetime]
+            for cookie in cls.cookies:
+                if now - cookie['timestamp'] > 300:
+                    cookie['timestamp'] = now
+                    cookie['used'] = 0
+            cookie = next((c for c in cls.cookies if c['used'] < cls.max_used), None)
+            if not cookie:
+                # 后台生成跟不上时才在请求中同步生成
+                cookie = cls._new_cookie(cls.generate_cookie())
+                cls.cookies.append(cookie)
+            cookie['used'] += 1
+            cookie['total_used'] += 1
+            spare = sum(1 for c in cls.cookies if c['used'] < cls.max_used)
+        if spare < cls.min_spare:
+            cls._start_replenish()
+        cls.save_cookies()
         return cookie['cookie']
 
+    @classmethod
+    def _start_replenish(cls):
+        with cls._cookie_lock:
+            if cls._replenish_thread is not None and cls._replenish_thread.is_alive():
+                return
+            cls._replenish_thread = threading.Thread(target=cls._replenish, name='em-cookie', daemon=True)
+            cls._replenish_thread.start()
+
+    @classmethod
+    def _replenish(cls):
+        """生成cookie直到可用的cookie达到 min_spare 个"""
+        while True:
+            with cls._cookie_lock:
+                spare = sum(1 for c in cls.cookies if c['used'] < cls.max_used)
+            if spare >= cls.min_spare:
+                break
+            try:
+                cookie = cls._new_cookie(cls.generate_cookie())
+            except Exception as e:
+                logger.warning('generate em cookie failed: %s', e)
+                break
+            with cls._cookie_lock:
+                cls.cookies.append(cookie)
+        cls.save_cookies(True)
+
     @classmethod
     def generate_cookie(cls):
         def random_string(length=21):
@@ -108,15 +286,49 @@ class Em:
 
     @classmethod
     def set_over_used(cls, cookie):
-        c = next(c for c in cls.cookies if c['cookie'] == cookie)
-        if c:
-            c['used'] = cls.max_used
+        with cls._cookie_lock:
+            c = next((c for c in cls.cookies if c['cookie'] == cookie), None)
+            if c:
+                c['used'] = cls.max_used
+
+    @staticmethod
+    def _check_response(response, *args, **kwargs):
+        """请求被限制时(403/429 或者返回空内容)将请求使用的cookie标记为本时段已用完"""
+        cookie = response.request.headers.get('Cookie')
+        if not cookie or 'eastmoney.com' not in (response.url or ''):
+            return
+        if response.status_code in (403, 429) or (response.status_code == 200 and not response.content):
+            logger.debug('em cookie over used: %s', response.url)
+            Em.set_over_used(cookie)
+
+    @classmethod
+    def _clist_page(cls, query, pn, pgsize):
+        """请求 clist 的一页, 连接失败时换cookie重试, 返回 (diff, total), 没有数据时返回 None"""
+        for retry in range(cls.clist_retries + 1):
+            url = f'http://push2.eastmoney.com/api/qt/clist/get?pn={pn}&pz={pgsize}{query}&_={int(time.time()*1000)}'
+            cookie = cls.get_cookie()
+            try:
+                get_rate_budget('eastmoney', EastMoney.rate_limits).acquire()
+                resp = cls.session.get(url, headers={'Cookie': cookie, 'Host': 'push2.eastmoney.com'})
+                resp.raise_for_status()
+                jdata = resp.json()
+                if not jdata.get('data') or 'diff' not in jdata['data']:
+                    return None
+                return jdata['data']['diff'], jdata['data']['total']
+            except requests.exceptions.ConnectionError as ce:
+                cls.set_over_used(cookie)
+                if retry == cls.clist_retries:
+                    logger.error(f'ConnectionError: {ce} {url}')
+        return None
 
     @classmethod
     def qt_clist(cls, fs, fields=None, fid=None, po=1, qtcb=None):
         """
         Get stock list from eastmoney.
 
+        第一页返回总数之后, 其余页并发请求, 请求频率由 eastmoney 的请求预算控制.
+        同时请求的页数不超过 clist_workers 及剩余预算, 结果按页的顺序合并.
+
         Parameters
         ----------
         fs : str
@@ -128,7 +340,7 @@ class Em:
         po : int
             排序方式，1表示按照降序。
         qtcb : callable
-            Callback function to stop loop.
+            按页的顺序对每一页的数据调用, 返回True时停止请求后面的页.
 
         Returns
         -------
@@ -142,49 +354,41 @@ class Em:
             fields = 'f12,f13,f14,f21,f26'
         if fid is None:
             fid = 'f3'
-        pn = 1
-        ufmt = ('http://' + cls.host() + '/api/qt/clist/get?pn=%d&pz=%d&po=%d&np=1'
-            '&ut=bd1d9ddb04089700cf9c27f6f7426281&fltt=2&invt=2&fid=%s&fs=%s&fields=%s&_=%d')
-        headers = {
-            'Cookie': cls.get_cookie(),
-            'Host': cls.host()
-        }
-        data = []
-        retry = 0
-        while True:
-            try:
-                url = ufmt % (pn, pgsize, po, fid, fs, fields, int(time.time()*1000))
-                headers['Cookie'] = cls.get_cookie()
-                resp = cls.session.get(url, headers=headers)
-                resp.raise_for_status()
-                jdata = resp.json()
-                if 'data' not in jdata or 'diff' not in jdata['data']:
-                    break
-                data.extend(jdata['data']['diff'])
-                total = jdata['data']['total']
-                if len(data) >= total:
-                    break
-                if callable(qtcb) and qtcb(jdata['data']['diff']):
-                    break
-                if pn > 1 and len(jdata['data']['diff']) < pgsize:
-                    break
-                if pn == 1 and len(jdata['data']['diff']) < pgsize:
-                    pgsize = len(jdata['data']['diff'])
-                pn += 1
-                time.sleep(random.random()*random.choice([1, 2]))
-            except requests.exceptions.ConnectionError as ce:
-                cls.set_over_used(headers['Cookie'])
-                retry += 1
-                if retry % 3 == 0:
-                    cls.host.cache_clear()
-                if retry > 10:
-                    logger.error(f'ConnectionError: {ce} {url}')
-                    break
-                continue
-            except Exception as e:
-                logger.error(e)
-                logger.debug(traceback.format_exc())
-                break
+        query = f'&po={po}&np=1&ut=bd1d9ddb04089700cf9c27f6f7426281&fltt=2&invt=2&fid={fid}&fs={fs}&fields={fields}'
+        try:
+            first = cls._clist_page(query, 1, pgsize)
+            if first is None:
+                return []
+            data, total = first
+            if len(data) >= total or (callable(qtcb) and qtcb(data)):
+                return data
+            # 服务器可能限制每页的数量
+            pgsize = len(data)
+            pages = iter(range(2, (total + pgsize - 1) // pgsize + 1))
+            budget = get_rate_budget('eastmoney', EastMoney.rate_limits)
+            with ThreadPoolExecutor(max_workers=cls.clist_workers) as executor:
+                pending = deque()
+                while True:
+                    # 不限制频率时 available() 为 inf, 先与 clist_workers 比较再取整
+                    depth = max(1, int(min(cls.clist_workers, budget.available())))
+                    while len(pending) < depth:
+                        pn = next(pages, None)
+                        if pn is None:
+                            break
+                        pending.append(executor.submit(cls._clist_page, query, pn, pgsize))
+                    if not pending:
+                        break
+                    page = pending.popleft().result()
+                    if page is None or not page[0]:
+                        break
+                    data.extend(page[0])
+                    if callable(qtcb) and qtcb(page[0]):
+                        break
+                for future in pending:
+                    future.cancel()
+        except Exception as e:
+            logger.error(e)
+            logger.debug(traceback.format_exc())
 
         return data
 
@@ -243,8 +447,85 @@ class Em:
         return { field_map.get(k, k): convert(k, v) for k, v in data.items() }
 
 
+Em.session.hooks['response'].append(Em._check_response)
+Em.session.mount('http://', _EmMirrorAdapter(Em.mirrors))
+Em.session.mount('https://', _EmMirrorAdapter(Em.mirrors))
+atexit.register(Em.save_cookies, True)
+
+_safe_price = rtbase._safe_price
+
+
+def _em_secid(fcode):
+    return fcode.replace('sh', '1.').replace('sz', '0.').replace('bj', '0.')
+
+def _em_fullcode(sec):
+    return f'sh{sec[-6:]}' if sec.startswith('1.') else get_fullcode(sec[-6:])
+
+get_security_master().register_source('em', _em_secid, _em_fullcode)
+
+
+def _em_fields(table, fields, always=(), prefix=()):
+    ''' 按需要的字段名生成东财 fields 参数, fields 为 None 时请求全部字段, prefix 为总是请求的东财字段(如代码) '''
+    names = [k for k in table if fields is None or k in fields or k in always]
+    return names, ','.join([*prefix, *sorted({table[k][0] for k in names} - set(prefix), key=lambda f: int(f[1:]))])
+
+
 class EastMoney(requestbase):
     quote_max_num = 60
+    rate_limits = ((1000, 300), (50000, 86400))
+
+    # 字段名: (东财字段, 转换函数)
+    quote_fields = {
+        'name': ('f14', str),
+        'price': ('f2', _safe_price),
+        'change': ('f3', lambda v: _safe_price(v) / 100), # 涨跌幅
+        'change_px': ('f4', _safe_price), # 涨跌额
+        'volume': ('f5', lambda v: _safe_price(v) * 100),
+        'amount': ('f6', _safe_price),
+        'high': ('f15', _safe_price),
+        'low': ('f16', _safe_price),
+        'open': ('f17', _safe_price),
+        'lclose': ('f18', _safe_price),
+        'mc': ('f20', _safe_price),
+        'cmc': ('f21', _safe_price),
+    }
+
+    kline_fields = {
+        'time': ('f51', str),
+        'open': ('f52', _safe_price),
+        'close': ('f53', _safe_price),
+        'high': ('f54', _safe_price),
+        'low': ('f55', _safe_price),
+        'volume': ('f56', lambda v: int(v) * 100),
+        'amount': ('f57', _safe_price),
+        'amplitude': ('f58', lambda v: _safe_price(v) / 100),
+        'change': ('f59', lambda v: _safe_price(v) / 100),
+        'change_px': ('f60', _safe_price),
+        'turnover': ('f61', lambda v: _safe_price(v) / 100),
+    }
+
+    stocklist_fields = {
+        'name': ('f14', str),
+        'close': ('f2', float),
+        'high': ('f15', float),
+        'low': ('f16', float),
+        'open': ('f17', float),
+        'lclose': ('f18', float),
+        'change_px': ('f4', float),
+        'change': ('f3', lambda v: float(v) / 100),
+        'volume': ('f5', lambda v: int(v) * 100),
+        'amount': ('f6', float),
+        'main': ('f62', float),
+        'mainp': ('f184', float),
+        'small': ('f84', float),
+        'middle': ('f78', float),
+        'big': ('f72', float),
+        'super': ('f66', float),
+        'smallp': ('f87', float),
+        'midllep': ('f81', float),
+        'bigp': ('f75', float),
+        'superp': ('f69', float),
+    }
     @property
     def session(self):
         return get_session('em')
@@ -252,8 +533,7 @@ class EastMoney(requestbase):
     @property
     def qtapi(self):
         return (
-            "https://push2.eastmoney.com/api/qt/ulist.np/get?fltt=2&secids=%s&fields="
-            "f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f13,f14,f15,f16,f17,f18,f19,f20,f21,f22,f23,f115"
+            "https://push2.eastmoney.com/api/qt/ulist.np/get?fltt=2&secids=%s&fields=%s"
         )
 
     @property
@@ -265,7 +545,7 @@ class EastMoney(requestbase):
         return (
             'http://push2his.eastmoney.com/api/qt/stock/trends2/get?fields1='
             'f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f13&fields2=f51,f52,f53,f54,f55,f56,f57,f58'
-            '&secid=%s&ndays=1&iscr=1&iscca=0'
+            '&secid=%s&ndays=%d&iscr=1&iscca=0'
         )
 
     @property
@@ -273,7 +553,7 @@ class EastMoney(requestbase):
         return (
             'https://push2his.eastmoney.com/api/qt/stock/kline/get?secid=%s&klt=%d&fqt=%d&lmt=%d'
             '&end=20500000&fields1=f1,f2,f3,f4,f5,f6,f7,f8'
-            '&fields2=f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61,f62,f63,f64'
+            '&fields2=%s'
         )
 
     @property
@@ -289,13 +569,13 @@ class EastMoney(requestbase):
         return (
             "https://push2.eastmoney.com/api/qt/clist/get?np=1&fltt=2&invt=2&cb="
             "&fs=%s"
-            "&fields=f1,f2,f3,f4,f5,f6,f15,f16,f17,f18,f12,f13,f14,f62,f184,f66,f69,f72,f75,f78,f81,f84,f87,f124"
+            "&fields=%s"
             "&fid=f3&pn=%d&pz=%d&po=1&dect=1&ut=fa5fd1943c7b386f172d6893dbfba10b&wbp2u=|0|0|0|web&_=%d"
         )
 
     @staticmethod
     def get_secid(code):
-        return code.replace('sh', '1.').replace('sz', '0.').replace('bj', '0.')
+        return get_security_master().source_code('em', code)
 
     @staticmethod
     def get_em_cookie():
@@ -303,10 +583,11 @@ class EastMoney(requestbase):
 
     @classmethod
     def secid_to_fullcode(cls, sec):
-        return f'sh{sec[-6:]}' if sec.startswith('1.') else cls.get_fullcode(sec[-6:])
+        return get_security_master().from_source_code('em', sec)
 
-    def get_quote_url(self, stocks):
-        url = self.qtapi % (','.join([ self.get_secid(stock) for stock in stocks]))
+    def get_quote_url(self, stocks, fields=None):
+        _, efields = _em_fields(self.quote_fields, fields, prefix=('f12', 'f13'))
+        url = self.qtapi % (','.join([ self.get_secid(stock) for stock in stocks]), efields)
         headers = {
             **self._get_headers(),
             'Referer': 'https://quote.eastmoney.com/',
@@ -315,27 +596,16 @@ class EastMoney(requestbase):
         }
         return url, headers
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, fields=None, **kwargs):
         stock_dict = dict()
+        names, _ = _em_fields(self.quote_fields, fields)
+        convs = [(k, *self.quote_fields[k]) for k in names]
         for codes, rsp in rep_data:
             stocks_detail = json.loads(rsp)
             for stock in stocks_detail['data']['diff']:
                 fcode = self.secid_to_fullcode(f"{stock['f13']}.{stock['f12']}")
                 code = fcode if fcode in codes else stock['f12'] if stock['f12'] in codes else fcode
-                stock_dict[code] = {
-                    'name': stock['f14'],
-                    'price': self._safe_price(stock['f2']),
-                    'change': self._safe_price(stock['f3']) / 100, # 涨跌幅
-                    'change_px': self._safe_price(stock['f4']), # 涨跌额
-                    'volume': self._safe_price(stock['f5']) * 100,
-                    'amount': self._safe_price(stock['f6']),
-                    'high': self._safe_price(stock['f15']),
-                    'low': self._safe_price(stock['f16']),
-                    'open': self._safe_price(stock['f17']),
-                    'lclose': self._safe_price(stock['f18']),
-                    "mc": self._safe_price(stock['f20']),
-                    "cmc": self._safe_price(stock['f21']),
-                }
+                stock_dict[code] = {k: conv(stock[f]) for k, f, conv in convs}
         return stock_dict
 
     def get_quote5_url(self, stock):
@@ -348,8 +618,8 @@ class EastMoney(requestbase):
         }
         return url, headers
 
-    def quotes5(self, stocks):
-        return self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response)
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+        return self.format_quotes(self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response), fields, fmt)
 
     def format_quote5_response(self, rep_data):
         stock_dict = dict()
@@ -397,8 +667,8 @@ class EastMoney(requestbase):
             }
         return stock_dict
 
-    def get_tline_url(self, stock):
-        url = self.tlineapi % self.get_secid(stock)
+    def get_tline_url(self, stock, days=1):
+        url = self.tlineapi % (self.get_secid(stock), days)
         headers = {
             **self._get_headers(),
             'Referer': f'https://quote.eastmoney.com/{self.secid_to_fullcode(stock)}.html',
@@ -407,20 +677,37 @@ class EastMoney(requestbase):
         }
         return url, headers
 
-    def format_tline_response(self, rep_data):
+    @staticmethod
+    def _tline_rows(trends, start=0, dated=False):
+        return [[
+                time_str if dated else time_str.split()[1], float(price), int(volume) * 100, float(amount), float(avg_price),
+            ]
+            for kl in trends[start:]
+            for time_str, _, price, *_, volume, amount, avg_price in [kl.split(',')]
+        ]
+
+    def format_tline_response(self, rep_data, fmt=None, dated=False):
         stock_dict = {}
         for code, rsp in rep_data:
             stocks_detail = json.loads(rsp)
-            stock_dict[code] = self.format_array_list([[
-                    time_str.split()[1], float(price), int(volume) * 100, float(amount), float(avg_price),
-                ]
-                for kl in stocks_detail['data']['trends']
-                for time_str, _, price, *_, volume, amount, avg_price in [kl.split(',')]
-            ], ['time', 'price', 'volume', 'amount', 'avg_price'])
+            stock_dict[code] = self.format_array_list(self._tline_rows(stocks_detail['data']['trends'], dated=dated), self.tline_cols, fmt=fmt)
         return stock_dict
 
-    def get_mkline_url(self, stock, kltype='1', length=320, fq=1):
-        url = self.mklineapi % (self.get_secid(stock), kltype, fq, length)
+    def format_tline_updates(self, rep_data, known):
+        stock_dict = {}
+        for code, rsp in rep_data:
+            trends = json.loads(rsp)['data']['trends']
+            stock_dict[code] = self._tline_rows(trends, self._tline_start(known.get(code, 0), len(trends)))
+        return stock_dict
+
+    def tlines_days(self, stocks, days=5, fmt=None):
+        ''' ndays 最多为5 '''
+        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_response,
+            url_kwargs={'days': min(days, 5)}, fmt_kwargs={'fmt': fmt, 'dated': True})
+
+    def get_mkline_url(self, stock, kltype='1', length=320, fq=1, fields=None):
+        _, fields2 = _em_fields(self.kline_fields, fields, ('time',))
+        url = self.mklineapi % (self.get_secid(stock), kltype, fq, length, fields2)
         headers = {
             **self._get_headers(),
             'Referer': f'https://quote.eastmoney.com/{self.secid_to_fullcode(stock)}.html',
@@ -429,36 +716,27 @@ class EastMoney(requestbase):
         }
         return url, headers
 
-    def format_kline_response(self, rep_data, **kwargs):
+    def format_kline_response(self, rep_data, fields=None, fmt=None, **kwargs):
         stock_dict = dict()
-        kcols = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'amplitude', 'change', 'change_px', 'turnover']
+        # 服务端按 fields2 的字段顺序返回, 只包含请求的字段
+        kcols, _ = _em_fields(self.kline_fields, fields, ('time',))
+        convs = [self.kline_fields[k][1] for k in kcols]
         for code, rsp in rep_data:
             stocks_detail = json.loads(rsp)
             klines = stocks_detail['data']['klines']
             klarr = []
             for kline in klines:
-                kdata = kline.split(',')
-                klarr.append([
-                    kdata[0],
-                    self._safe_price(kdata[1]),
-                    self._safe_price(kdata[2]),
-                    self._safe_price(kdata[3]),
-                    self._safe_price(kdata[4]),
-                    int(kdata[5]) * 100,
-                    self._safe_price(kdata[6]),
-                    self._safe_price(kdata[7])/100,
-                    self._safe_price(kdata[8])/100,
-                    self._safe_price(kdata[9]),
-                    self._safe_price(kdata[10])/100])
-            stock_dict[code] = self.format_array_list(klarr, kcols)
+                klarr.append([conv(v) for conv, v in zip(convs, kline.split(','))])
+            stock_dict[code] = self.format_array_list(klarr, kcols, fmt=fmt)
 
         return stock_dict
 
-    def get_dkline_url(self, stock, kltype='101', length=320, fq=1):
-        return self.get_mkline_url(stock, kltype, length, fq)
+    def get_dkline_url(self, stock, kltype='101', length=320, fq=1, fields=None):
+        return self.get_mkline_url(stock, kltype, length, fq, fields)
 
-    def get_fkline_url(self, stock, kltype='101', fq=0):
-        url = self.fklineapi % (self.get_secid(stock), kltype, fq, 0)
+    def get_fkline_url(self, stock, kltype='101', fq=0, fields=None):
+        _, fields2 = _em_fields(self.kline_fields, fields, ('time',))
+        url = self.fklineapi % (self.get_secid(stock), kltype, fq, 0, fields2)
         headers = {
             **self._get_headers(),
             'Referer': f'https://quote.eastmoney.com/{self.secid_to_fullcode(stock)}.html',
@@ -478,8 +756,10 @@ class EastMoney(requestbase):
         }
         return fs[market]
 
-    def get_stock_list_url(self, page = 1, market = 'all'):
-        url = self.stocklistapi % (self.market_fs(market), page, self.stocklist_page_size, int(time.time()*1000))
+    def get_stock_list_url(self, page = 1, market = 'all', fields=None):
+        # 不指定字段时额外请求 f2/f5 用于过滤停牌股
+        _, efields = _em_fields(self.stocklist_fields, fields, ('close', 'volume'), prefix=('f12', 'f13'))
+        url = self.stocklistapi % (self.market_fs(market), efields, page, self.stocklist_page_size, int(time.time()*1000))
         headers = {
             **self._get_headers(),
             'Cookie': self.get_em_cookie(),
@@ -490,33 +770,16 @@ class EastMoney(requestbase):
         data = json.loads(rep_data)['data']
         return data['total'], len(data['diff'])
 
-    def parse_stock_list(self, rep_data):
+    def parse_stock_list(self, rep_data, fields=None):
         data = json.loads(rep_data)['data']['diff']
-        return self.parse_stock_list_json(data)
+        return self.parse_stock_list_json(data, fields)
 
-    def parse_stock_list_json(self, data):
+    def parse_stock_list_json(self, data, fields=None):
+        names, _ = _em_fields(self.stocklist_fields, fields)
+        convs = [(k, *self.stocklist_fields[k]) for k in names]
         return [{
             'code': self.secid_to_fullcode(f"{stock['f13']}.{stock['f12']}"),
-            'name': stock['f14'],
-            'close': float(stock['f2']),
-            'high': float(stock['f15']),
-            'low': float(stock['f16']),
-            'open': float(stock['f17']),
-            'lclose': float(stock['f18']),
-            'change_px': float(stock['f4']),
-            'change': float(stock['f3']) / 100,
-            'volume': int(stock['f5']) * 100,
-            'amount': float(stock['f6']),
-            'main': float(stock['f62']),
-            'mainp': float(stock['f184']),
-            'small': float(stock['f84']),
-            'middle': float(stock['f78']),
-            'big': float(stock['f72']),
-            'super': float(stock['f66']),
-            'smallp': float(stock['f87']),
-            'midllep': float(stock['f81']),
-            'bigp': float(stock['f75']),
-            'superp': float(stock['f69']),
+            **{k: conv(stock[f]) for k, f, conv in convs},
         } for stock in data if stock['f2'] != '-' and stock['f5'] != '-']
 
     # def stock_list_for_market(self, market: str = 'all'):
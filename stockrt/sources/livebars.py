@@ -0,0 +1,176 @@
+# coding:utf8
+'''
+实时K线
+
+LiveBars 只在开始时请求一次历史K线, 之后用批量行情更新最后一根K线的 close/high/low/volume/amount,
+行情时间跨过 kltype 的周期边界时新建一根K线. 每只股票每次更新都是 O(1), 每轮只需要一次批量行情请求.
+
+行情中的 volume/amount 是当天的累计值, 每根K线记录 base = K线成交量 - 当天累计成交量, 之后 K线成交量 = base + 新的累计值.
+周/月等K线在同一周期内跨过交易日时, base 重设为K线当前的成交量/额.
+两次行情之间跨过周期边界时, 这期间的成交全部计入新的K线.
+'''
+import threading
+from collections import deque
+from datetime import date
+from typing import Any, Dict, List, Optional, Union
+from .rtbase import rtbase, to_int_kltype, MINUTE_END_TIMES
+
+BAR_COLS = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount']
+_PERIOD_KEYS = {
+    101: lambda d: d,
+    102: lambda d: d.isocalendar()[:2],
+    103: lambda d: (d.year, d.month),
+    104: lambda d: (d.year, (d.month - 1) // 3),
+    105: lambda d: (d.year, (d.month - 1) // 6),
+    106: lambda d: d.year,
+}
+
+
+def minute_bar_time(kltype: int, hhmm: int) -> str:
+    ''' HHMM 时刻的成交所属的 kltype 分钟K线的时间, 09:30 之前计入第一根, 午休计入 11:30, 15:00 之后计入最后一根 '''
+    m = hhmm // 100 * 60 + hhmm % 100
+    idx = min(max(m - 570, 0), 119) if m < 780 else min(m - 780 + 120, 239)
+    return MINUTE_END_TIMES[min((idx // kltype + 1) * kltype - 1, 239)]
+
+
+class LiveBars:
+    def __init__(
+        self, stocks: Union[str, List[str]], kltype: Union[int, str] = 1, length: int = 320, fq: int = 1,
+        source: Union[str, rtbase, None] = None
+    ):
+        '''
+        :param stocks: 股票代码或列表
+        :param kltype: K线周期, 同 klines, 分钟K线只支持能整除240的周期
+        :param length: 保留的K线数量
+        :param source: 数据源名称或对象, None 表示使用默认数据源(klines/quotes)
+        '''
+        self.kltype = to_int_kltype(kltype)
+        if self.kltype < 101 and 240 % self.kltype:
+            raise ValueError(f'unsupported live kltype: {kltype}')
+        if isinstance(source, str):
+            from ..wrapper import rtsource
+            source = rtsource(source)
+        self.source = source
+        self.stocks = [stocks] if isinstance(stocks, str) else list(stocks)
+        self.length = length
+        self.fq = fq
+        self._lock = threading.Lock()
+        self._bars: Dict[str, deque] = {}
+        # code -> [base_volume, base_amount, 上次行情的累计成交量, 累计成交额, 上次行情的日期]
+        self._state: Dict[str, list] = {}
+
+    def _api(self, name):
+        if self.source is not None:
+            return getattr(self.source, name)
+        from .. import wrapper
+        return getattr(wrapper, name)
+
+    def load(self, stocks: Optional[List[str]] = None):
+        ''' 请求历史K线, 已有的股票会被重新加载 '''
+        stocks = self.stocks if stocks is None else stocks
+        data = self._api('klines')(stocks, kltype=self.kltype, length=self.length, fq=self.fq, fields=BAR_COLS[1:], fmt='list') or {}
+        with self._lock:
+            for code, bars in data.items():
+                self._bars[code] = deque((list(b[:len(BAR_COLS)]) + [0] * (len(BAR_COLS) - len(b)) for b in bars), maxlen=self.length)
+                self._state.pop(code, None)
+        return self
+
+    def __contains__(self, code):
+        return code in self._bars
+
+    def __getitem__(self, code) -> List[list]:
+        return list(self._bars[code])
+
+    def bars(self, code: str, fmt: Optional[str] = None) -> Any:
+        ''' 全部K线, fmt 同 set_array_format '''
+        return rtbase.format_array_list(list(self._bars.get(code, ())), BAR_COLS, fmt=fmt)
+
+    def last(self, code: str) -> Optional[list]:
+        bars = self._bars.get(code)
+        return bars[-1] if bars else None
+
+    def _bar_time(self, day: str, tm: str) -> str:
+        if self.kltype > 100:
+            return day
+        return f'{day} {minute_bar_time(self.kltype, int(tm.replace(":", "")[:4] or 0))}'
+
+    def _same_period(self, t1: str, t2: str) -> bool:
+        if self.kltype <= 101:
+            return t1 == t2
+        key = _PERIOD_KEYS[self.kltype]
+        return key(date.fromisoformat(t1[:10])) == key(date.fromisoformat(t2[:10]))
+
+    @staticmethod
+    def _initial_base(bars: deque, day: str, skip: int) -> list:
+        ''' 分钟K线第一次更新时的 base: 历史K线中当天的K线(不含最后 skip 根)的成交量/额之和的相反数 '''
+        volume = amount = 0
+        for i in range(len(bars) - skip - 1, -1, -1):
+            b = bars[i]
+            if b[0][:10] != day:
+                break
+            volume += b[5]
+            amount += b[6]
+        return [-volume, -amount]
+
+    def apply(self, code: str, quote: Any) -> Optional[list]:
+        '''
+        用一条行情更新K线
+
+        :param quote: quotes 返回的单只股票行情(dict 或 Quote), 需要 price/volume/amount, date/time 缺少时使用当前时间
+        :return: 更新后的最后一根K线, 没有历史K线或行情无效时返回 None
+        '''
+        bars = self._bars.get(code)
+        price = quote.get('price')
+        if bars is None or not price:
+            return None
+        day = quote.get('date') or date.today().isoformat()
+        volume = quote.get('volume') or 0
+        amount = quote.get('amount') or 0
+        label = self._bar_time(day, quote.get('time') or '15:00')
+        last = bars[-1] if bars else None
+        state = self._state.get(code)
+        if last is not None and (last[0] >= label or self._same_period(last[0], label)):
+            if last[0] > label:
+                # 过期的行情
+                return last
+            if state is None:
+                state = self._initial_base(bars, day, 1) if self.kltype < 101 else [last[5] - volume, last[6] - amount]
+            elif state[4] != day:
+                # 周/月等K线内的新交易日, 累计值从 0 开始
+                state = [last[5], last[6]]
+            last[0] = label
+            last[2] = price
+            last[3] = max(last[3], price)
+            last[4] = min(last[4], price)
+        else:
+            if state is None and self.kltype < 101:
+                state = self._initial_base(bars, day, 0)
+            elif state is None or self.kltype > 100 or state[4] != day:
+                state = [0, 0]
+            else:
+                state = [-state[2], -state[3]]
+            last = [label, price, price, price, price, 0, 0]
+            bars.append(last)
+        last[5] = state[0] + volume
+        last[6] = state[1] + amount
+        self._state[code] = state[:2] + [volume, amount, day]
+        return last
+
+    def update(self, quotes: Optional[Dict[str, Any]] = None) -> Dict[str, list]:
+        '''
+        用行情更新全部股票的最后一根K线, 第一次调用时先加载历史K线
+
+        :param quotes: {code: 行情}, None 时请求一次批量行情
+        :return: {code: 最后一根K线}
+        '''
+        if not self._bars:
+            self.load()
+        if quotes is None:
+            quotes = self._api('quotes')(list(self._bars), fields=['price', 'volume', 'amount', 'date', 'time']) or {}
+        result = {}
+        with self._lock:
+            for code, quote in quotes.items():
+                last = self.apply(code, quote)
+                if last is not None:
+                    result[code] = last
+        return result
@@ -11,15 +11,28 @@ else:
     import os
     import time
     import json
+    import queue
+    import asyncio
+    import weakref
     import random
-    import socket
+    import threading
+    from contextlib import contextmanager
     from datetime import datetime
     from concurrent.futures import ThreadPoolExecutor, as_completed
-    from functools import cached_property
     from typing import Callable, Any, Union, List, Dict
-    from .rtbase import rtbase, set_array_format
+    import numpy as np
+    from .rtbase import rtbase, get_cache_dir, get_array_format, MINUTE_END_TIMES
     from pytdx.hq import TdxHq_API
+    from pytdx.errors import TdxConnectionError
     from pytdx.config.hosts import hq_hosts
+    from pytdx.parser.get_security_bars import GetSecurityBarsCmd
+    from pytdx.parser.get_security_quotes import GetSecurityQuotesCmd
+    from pytdx.parser.get_minute_time_data import GetMinuteTimeData
+    from pytdx.parser.get_history_minute_time_data import GetHistoryMinuteTimeData
+    from pytdx.parser.get_transaction_data import GetTransactionData
+    from pytdx.parser.get_history_transaction_data import GetHistoryTransactionData
+    from .tdxparser import (
+        TdxNativeHq_API, AsyncTdxClient, SecurityBarsCmd, SecurityQuotesCmd, TransactionCmd, HistoryTransactionCmd)
 
     from pytdx.log import log as logger, logging
     for handler in logger.handlers[:]:
@@ -28,79 +41,402 @@ else:
     logger.setLevel(logging.root.level)
     logger.info("set pytdx logger propagate!")
 
-    class ClientWrapper:
-        """包装客户端，实现连接状态管理和上下文管理协议"""
-        def __init__(self, host):
-            self._tdx = TdxHq_API(auto_retry=True)
-            self._host = host
-            self._busy = False
-            self._sock = None
+    class TdxHosts:
+        """
+        TDX服务器列表
+
+        记录每个服务器的延迟(指数移动平均)和成功/失败次数, 保存在缓存目录的 tdx_hosts.json 中, 程序启动时直接使用上次的排名.
+        服务器探测在后台线程中进行, 请求的实际耗时也会计入统计, 排名随之持续更新.
+        """
+        file_name = 'tdx_hosts.json'
+        rediscover_interval = 3600 * 24
+        save_interval = 60
+        alpha = 0.2
+
+        def __init__(self):
+            self._lock = threading.Lock()
+            self._save_lock = threading.Lock()
+            self._stats = {}
+            self._last_discovery = 0
+            self._last_save = 0
+            self._ready = threading.Event()
+            self._discover_thread = None
+            self._load()
 
         @property
-        def is_connected(self):
-            """获取当前连接状态"""
+        def path(self):
+            return os.path.join(get_cache_dir(), self.file_name)
+
+        @staticmethod
+        def _key(host):
+            return f'{host[0]}:{host[1]}'
+
+        def _load(self):
             try:
-                self._sock.send(b'', socket.MSG_DONTWAIT)
-                return True
-            except Exception:
-                return False
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                self._stats = data.get('stats', {})
+                self._last_discovery = data.get('last_discovery', 0)
+            except (OSError, ValueError):
+                return
+            if any(st['ok'] > 0 for st in self._stats.values()):
+                self._ready.set()
+
+        def save(self):
+            # 按取得数据的顺序写入, 避免较早的数据覆盖较新的数据
+            with self._save_lock:
+                with self._lock:
+                    text = json.dumps({'stats': self._stats, 'last_discovery': self._last_discovery}, indent=4)
+                    self._last_save = time.time()
+                try:
+                    tmp = self.path + '.tmp'
+                    with open(tmp, 'w') as f:
+                        f.write(text)
+                    os.replace(tmp, self.path)
+                except OSError as e:
+                    logger.debug('save tdx hosts failed: %s', e)
+
+        def record(self, host, latency, ok=True):
+            """记录一次请求的结果"""
+            key = self._key(host)
+            with self._lock:
+                st = self._stats.setdefault(key, {'host': list(host), 'latency': latency, 'ok': 0, 'fail': 0})
+                if ok:
+                    st['latency'] = st['latency'] * (1 - self.alpha) + latency * self.alpha
+                    st['ok'] += 1
+                else:
+                    st['fail'] += 1
+                st['last'] = time.time()
+            if time.time() - self._last_save > self.save_interval:
+                self.save()
+
+        @staticmethod
+        def _score(st):
+            # 延迟除以(平滑后的)成功率, 越小越好
+            return st['latency'] * (st['ok'] + st['fail'] + 2) / (st['ok'] + 1)
+
+        def best(self, n=8, wait=10):
+            """
+            按排名返回前n个服务器 [[ip, port], ...]
+
+            没有可用的统计数据时启动探测并最多等待 wait 秒直到探测完成, 统计数据过期时在后台重新探测
+            """
+            if not self._ready.is_set() or time.time() - self._last_discovery > self.rediscover_interval:
+                self.discover()
+            self._ready.wait(wait)
+            with self._lock:
+                stats = [st for st in self._stats.values() if st['ok'] > 0]
+            return [st['host'] for st in sorted(stats, key=self._score)[:n]]
+
+        def discover(self, background=True, max_workers=16):
+            """探测所有服务器, 已经在探测中时不会重复启动"""
+            with self._lock:
+                if self._discover_thread is not None and self._discover_thread.is_alive():
+                    thread = self._discover_thread
+                else:
+                    thread = threading.Thread(target=self._discover, args=(max_workers,), name='tdx-discover', daemon=True)
+                    self._discover_thread = thread
+                    thread.start()
+            if not background:
+                thread.join()
+
+        def _discover(self, max_workers):
+            hosts = {(h[1], h[2]) for h in hq_hosts}
+            with self._lock:
+                hosts.update(tuple(st['host']) for st in self._stats.values())
+            pmarket = random.choice([0, 1, 2])
+            res = []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(SrcTdx.ping, host[0], host[1], pmarket) for host in hosts]
+                for future in as_completed(futures):
+                    success, delay, ip, port, response = future.result()
+                    res.append((success, delay, ip, port, response))
+                    if success:
+                        self.record((ip, port), delay)
+
+            # 返回的证券数量与多数服务器不一致的, 数据可能过期, 计为失败
+            values = {}
+            for success, _, ip, port, response in res:
+                if success and response:
+                    values[response] = values.get(response, 0) + 1
+            if values:
+                majority = max(values, key=values.get)
+                for success, delay, ip, port, response in res:
+                    if not success or response != majority:
+                        self.record((ip, port), delay, False)
+            self._last_discovery = time.time()
+            self.save()
+            self._ready.set()
+
+
+    class ClientWrapper:
+        """包装客户端, 连接的分配和回收由 TdxPool 管理"""
+        def __init__(self, host, on_result: Callable = None):
+            self._tdx = TdxNativeHq_API(auto_retry=True)
+            self._host = tuple(host)
+            self.last_used = 0
+            self.on_result = on_result
 
         @property
-        def busy(self):
-            """获取当前连接状态"""
-            return self._busy
+        def host(self):
+            return self._host
 
-        def connect(self):
-            """连接到服务器"""
-            if self._sock and self.is_connected:
+        @property
+        def is_connected(self):
+            """是否已建立连接, 连接是否可用由心跳和请求失败来检测"""
+            return self._tdx.client is not None
+
+        def connect(self, host=None):
+            """连接到服务器, 指定 host 时切换到该服务器"""
+            if host is not None and tuple(host) != self._host:
+                self.move(host)
+            if self.is_connected:
                 return True
 
             try:
-                success = self._tdx.connect(*self._host)
-                if success:
-                    self._sock = self._tdx.client
-                return success
+                if self._tdx.connect(*self._host):
+                    return True
             except Exception as e:
                 logger.debug('connect to %s failed: %s', self._host, e)
-                return False
+            # pytdx 连接失败时不会清除 client
+            self.disconnect()
+            return False
+
+        def move(self, host):
+            """切换到 host, 下次 connect 时再连接"""
+            self.disconnect()
+            self._host = tuple(host)
 
         def disconnect(self):
             """断开连接"""
-            if not self._sock or not self.is_connected:
+            if not self.is_connected:
                 return
-
             try:
                 self._tdx.disconnect()
+            except Exception:
+                pass
             finally:
-                self._sock = None
-
-        def __enter__(self):
-            """上下文管理入口"""
-            if not self.connect():
-                raise ConnectionError("Failed to connect to TDX server")
-            self._busy = True
-            return self._tdx
-
-        def __exit__(self, exc_type, exc_val, exc_tb):
-            """上下文管理出口"""
-            self._busy = False
-            return False
+                self._tdx.client = None
+
+        def heartbeat(self):
+            """
+            发送一个轻量请求保持连接, 返回连接是否可用
+
+            只尝试一次, 不使用 pytdx 的重试(多次等待和重连), 失败后由调用方断开, 下次 checkout 时重连
+            """
+            retry, self._tdx.auto_retry = self._tdx.auto_retry, False
+            try:
+                return self._tdx.get_security_count(0) is not None
+            except Exception:
+                return False
+            finally:
+                self._tdx.auto_retry = retry
+
+        def pipeline(self, requests, depth=1):
+            """
+            流水线请求, 见 TdxNativeHq_API.pipeline, 耗时按往返次数平均后通过 on_result 回调
+
+            pytdx 重试后仍然失败时返回 None, 这里改为抛出 TdxConnectionError, 此时连接已经关闭
+            """
+            start = time.time()
+            ok = False
+            try:
+                result = self._tdx.pipeline(requests, depth)
+                if result is None:
+                    raise TdxConnectionError(f'pipeline to {self._host} failed')
+                ok = True
+                return result
+            finally:
+                if self.on_result is not None and requests:
+                    rounds = (len(requests) + max(1, depth) - 1) // max(1, depth)
+                    self.on_result(self._host, (time.time() - start) / rounds, ok)
 
         def __getattr__(self, name):
-            """委托所有属性访问到底层客户端"""
-            return getattr(self._tdx, name)
+            """委托所有属性访问到底层客户端, get_* 请求的耗时和结果通过 on_result 回调"""
+            attr = getattr(self._tdx, name)
+            if self.on_result is None or not name.startswith('get_') or not callable(attr):
+                return attr
+
+            def timed(*args, **kwargs):
+                start = time.time()
+                ok = False
+                try:
+                    result = attr(*args, **kwargs)
+                    ok = result is not None
+                    return result
+                finally:
+                    self.on_result(self._host, time.time() - start, ok)
+            return timed
+
+
+    class TdxPool:
+        """
+        线程安全的TDX连接池
+
+        checkout 阻塞等待空闲连接(超时抛出 TimeoutError), 用完后 checkin 归还, 取出的连接没有连接时自动重连,
+        仍然失败则换到下一个可用的服务器.
+        后台心跳线程定期对空闲连接发送请求, 避免被服务器断开. 心跳每次只取出一个空闲连接, 心跳失败或服务器排名下降时
+        只断开连接, 重连留给下次 checkout, 不会长时间占用空闲连接.
+        """
+        def __init__(self, hosts_func: Callable[[], List], size_per_host=1, heartbeat_interval=30, checkout_timeout=10, on_result: Callable = None):
+            """
+            :param hosts_func: 返回按优先级排序的服务器列表 [[ip, port], ...]
+            :param on_result: 每次请求后以 (host, 耗时, 是否成功) 调用, 用于更新服务器排名
+            :param size_per_host: 每个服务器的连接数
+            :param heartbeat_interval: 空闲连接的心跳间隔(秒), 0 表示不发送心跳
+            :param checkout_timeout: checkout 默认的等待时间(秒)
+            """
+            self._hosts_func = hosts_func
+            self._on_result = on_result
+            self.size_per_host = size_per_host
+            self.heartbeat_interval = heartbeat_interval
+            self.checkout_timeout = checkout_timeout
+            self._idle = queue.LifoQueue()
+            self._wrappers = []
+            self._lock = threading.Lock()
+            self._stop = threading.Event()
+            self._heartbeat_thread = None
+
+        def _ensure_started(self):
+            if self._wrappers:
+                return
+            with self._lock:
+                if self._wrappers:
+                    return
+                wrappers = [ClientWrapper(h, self._on_result) for h in self._hosts_func() for _ in range(self.size_per_host)]
+                for w in wrappers:
+                    self._idle.put(w)
+                self._wrappers = wrappers
+                if self.heartbeat_interval > 0 and wrappers:
+                    self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='tdx-heartbeat', daemon=True)
+                    self._heartbeat_thread.start()
+
+        @property
+        def size(self):
+            self._ensure_started()
+            return len(self._wrappers)
+
+        @property
+        def clients(self) -> List[ClientWrapper]:
+            self._ensure_started()
+            return list(self._wrappers)
+
+        def checkout(self, timeout=None) -> ClientWrapper:
+            """取出一个已连接的客户端"""
+            self._ensure_started()
+            try:
+                wrapper = self._idle.get(timeout=self.checkout_timeout if timeout is None else timeout)
+            except queue.Empty:
+                raise TimeoutError('no idle tdx connection')
+            if not wrapper.is_connected and not self._reconnect(wrapper):
+                self._idle.put(wrapper)
+                raise ConnectionError('Failed to connect to TDX server')
+            return wrapper
+
+        def checkin(self, wrapper: ClientWrapper, broken=False):
+            """归还客户端, broken 为 True 时断开连接, 下次取出时重连"""
+            if broken:
+                wrapper.disconnect()
+            wrapper.last_used = time.time()
+            self._idle.put(wrapper)
+
+        @contextmanager
+        def client(self, timeout=None):
+            """with pool.client() as client: 取出并自动归还, 请求出错时断开该连接"""
+            wrapper = self.checkout(timeout)
+            broken = False
+            try:
+                yield wrapper
+            except Exception:
+                broken = True
+                raise
+            finally:
+                self.checkin(wrapper, broken)
+
+        def recover(self, wrapper: ClientWrapper):
+            """请求出现连接错误后重建连接, 在持有该连接时调用"""
+            wrapper.disconnect()
+            return self._reconnect(wrapper)
+
+        def _reconnect(self, wrapper: ClientWrapper):
+            if wrapper.connect():
+                return True
+            # 当前服务器不可用, 换到其他连接没有使用的服务器
+            used = {w.host for w in self._wrappers if w is not wrapper}
+            for host in self._hosts_func():
+                if tuple(host) not in used and wrapper.connect(host):
+                    logger.info('tdx connection moved to %s', wrapper.host)
+                    return True
+            return False
+
+        def _take_idle(self, wrapper: ClientWrapper):
+            """从空闲队列中取出指定的连接, 已经被取出时返回 False"""
+            with self._idle.mutex:
+                try:
+                    self._idle.queue.remove(wrapper)
+                except ValueError:
+                    return False
+            return True
+
+        def _heartbeat_loop(self):
+            while not self._stop.wait(self.heartbeat_interval):
+                self._heartbeat()
+
+        def _heartbeat(self):
+            """检查一轮空闲连接, 正在使用的连接会被跳过"""
+            best = [tuple(h) for h in self._hosts_func()]
+            for wrapper in list(self._wrappers):
+                used = {w.host for w in self._wrappers}
+                # 排名下降的服务器换成排名靠前且没有使用的服务器
+                spare = next((h for h in best if h not in used), None) if wrapper.host not in best else None
+                due = wrapper.is_connected and time.time() - wrapper.last_used >= self.heartbeat_interval
+                if (spare is None and not due) or not self._take_idle(wrapper):
+                    continue
+                try:
+                    if spare is not None:
+                        wrapper.move(spare)
+                    elif not wrapper.heartbeat():
+                        wrapper.disconnect()
+                    else:
+                        wrapper.last_used = time.time()
+                finally:
+                    self._idle.put(wrapper)
+
+        def close(self):
+            """停止心跳并断开所有连接"""
+            self._stop.set()
+            for w in self._wrappers:
+                w.disconnect()
 
 
     class SrcTdx(rtbase):
         quote_max_num = 80
+        # pytdx 的 buyorsell: 0 买, 1 卖, 2 中性
+        transaction_bs = (0, 1)
+        # 连接池配置, 需在第一次请求前设置
+        pool_size_per_host = 1
+        heartbeat_interval = 30
+        checkout_timeout = 10
+        host_count = 8
+        # 使用 tdxparser 中的解码器直接解码K线/行情/成交明细, 不经过 pytdx 的 OrderedDict
+        native = False
+        # 每个连接同时等待响应的请求数, 1 表示收到响应后才发送下一个请求
+        pipeline_depth = 1
+        # 异步接口(aquotes/amklines/atransactions)每个连接同时等待响应的请求数
+        async_pipeline_depth = 8
+        bars_page_size = 800
+        fkline_pages_per_round = 4
+        # category: K线类型（0 5分钟K线; 1 15分钟K线; 2 30分钟K线; 3 1小时K线; 4 日K线; 5 周K线; 6 月K线; 7 1分钟; 8 1分钟K线; 9 日K线; 10 季K线; 11 年K线）
+        kline_categories = {5: 0, 15: 1, 30: 2, 60: 3, 101: 4, 102: 5, 103: 6, 1: 8, 104: 10, 106: 11}
+        _pool_lock = threading.Lock()
+        _hosts = None
         @property
         def qtapi(self):
             return 'pyqtapi'
 
         @property
         def tlineapi(self):
-            # TODO: return 'tlineapi'
-            pass
+            return 'tlineapi'
 
         @property
         def mklineapi(self):
@@ -110,6 +446,10 @@ else:
         def dklineapi(self):
             return 'dklineapi'
 
+        @property
+        def fklineapi(self):
+            return 'fklineapi'
+
         def to_pytdx_market(self, code):
             """转换为pytdx的market"""
             if len(code) == 6:
@@ -136,66 +476,75 @@ else:
             endtime = time.time()
             return (success, endtime - starttime, ip, port, response)
 
-        @staticmethod
-        def search_best_tdx(n=8, max_workers=16):
-            hosts = [(host[1], host[2]) for host in hq_hosts]
-            file_hosts = os.path.join(os.path.dirname(__file__), 'tdx_hosts.json')
-            fexists = os.path.exists(file_hosts)
-            update_hosts = not fexists
-            if fexists:
-                with open(file_hosts, 'r') as f:
-                    hosts_json = json.load(f)
-                if time.time() - hosts_json['last_update'] < 3600*24*15:
-                    hosts = hosts_json['hosts']
-                    update_hosts = False
-
-            pmarket = random.choice([0, 1, 2])
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [
-                    executor.submit(SrcTdx.ping, host[0], host[1], pmarket)
-                    for host in hosts
-                ]
-                res = [future.result() for future in futures]
-
-            if update_hosts:
-                success_to_save = [(host, port) for (success, _, host, port, _) in res if success]
-                if success_to_save:
-                    hosts_json = {'hosts': success_to_save, 'last_update': time.time()}
-                    with open(file_hosts, 'w') as f:
-                        json.dump(hosts_json, f, indent=4)
-
-            successful_hosts = [(result, host, port, delay) for (success, delay, host, port, result) in res if success]
-            values = {}
-            for response, host, port, delay in successful_hosts:
-                if response:
-                    values.setdefault(response, []).append((host, port, delay))
+        @classmethod
+        def hosts(cls) -> TdxHosts:
+            """进程内共享的服务器排名"""
+            if cls._hosts is None:
+                with cls._pool_lock:
+                    if cls._hosts is None:
+                        SrcTdx._hosts = TdxHosts()
+            return cls._hosts
 
-            if not values:
-                return []
+        @classmethod
+        def discover_hosts(cls, background=True):
+            """立即(重新)探测服务器, 可以在程序启动时调用以便第一次请求时已有可用的服务器"""
+            cls.hosts().discover(background)
 
-            # 找到最长的结果组
-            longest_group = max(values.values(), key=len)
-            # 按delay排序并返回前n个
-            sorted_hosts = sorted(longest_group, key=lambda x: x[2])[:n]
+        @staticmethod
+        def search_best_tdx(n=8, max_workers=16):
+            hosts = SrcTdx.hosts()
+            hosts.discover(False, max_workers)
+            best = hosts.best(n)
             if n == 1:
-                return sorted_hosts[0][:2]
-            return [[h, p] for h, p, d in sorted_hosts]
+                return best[0] if best else []
+            return best
 
-        @cached_property
+        @property
         def tdxhosts(self):
-            return self.search_best_tdx()
+            return self.hosts().best(self.host_count)
 
-        @cached_property
+        @property
+        def pool(self) -> TdxPool:
+            if '_pool' not in self.__dict__:
+                with self._pool_lock:
+                    if '_pool' not in self.__dict__:
+                        self._pool = TdxPool(
+                            lambda: self.tdxhosts, self.pool_size_per_host, self.heartbeat_interval, self.checkout_timeout,
+                            self.hosts().record)
+            return self._pool
+
+        @property
         def clients(self):
-            return [ClientWrapper(h) for h in self.tdxhosts]
+            return self.pool.clients
+
+        def _map_groups(self, func, items, *args, **kwargs):
+            """将 items 平均分给连接池中的连接并发执行 func(group, *args), 合并返回的dict"""
+            if not items:
+                return {}
+            n = max(1, min(self.pool.size, len(items)))
+            gsize = (len(items) + n - 1) // n
+            groups = [items[i:i + gsize] for i in range(0, len(items), gsize)]
+            result = {}
+            if len(groups) == 1:
+                result.update(func(groups[0], *args, **kwargs))
+                return result
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                futures = [executor.submit(func, g, *args, **kwargs) for g in groups]
+                for future in as_completed(futures):
+                    result.update(future.result())
+            return result
+
+        def _request_code(self, stocks, code6):
+            """返回结果使用请求时的代码写法"""
+            fcode = self.get_fullcode(code6)
+            return fcode if fcode in stocks else code6 if code6 in stocks else fcode
 
         def format_quote_response(self, stocks, rep_data):
             if not rep_data:
                 return {}
             result = {}
             for q in rep_data:
-                fcode = self.get_fullcode(q['code'])
-                code = fcode if fcode in stocks else q['code'] if q['code'] in stocks else fcode
+                code = self._request_code(stocks, q['code'])
                 result[code] = {
                     'price': q['price'],
                     'change': (q['price'] - q['last_close']) / q['last_close'],
@@ -230,150 +579,207 @@ else:
                 }
             return result
 
-        def quotes(self, stocks):
+        def quotes(self, stocks, lazy=False, fields=None, fmt=None):
             if isinstance(stocks, str):
                 stocks = [stocks]
-            batches = 1
-            if len(stocks) > self.quote_max_num:
-                batches = len(stocks) // self.quote_max_num + 1
+            groups = [stocks[i:i + self.quote_max_num] for i in range(0, len(stocks), self.quote_max_num)]
+            return self.format_quotes(self._map_groups(self._get_quotes_for_groups, groups), fields, fmt)
 
-            wrappers = [next((c for c in self.clients if not c.busy), None)] if batches == 1 else [ c for c in self.clients if not c.busy][:batches]
-            if not wrappers:
-                return
+        def _quote_requests(self, groups):
+            cmd_cls = SecurityQuotesCmd if self.native else GetSecurityQuotesCmd
+            return [(cmd_cls, ([(self.to_pytdx_market(code), code[-6:]) for code in stocks],)) for stocks in groups]
 
-            batches = len(wrappers)
-            if batches == 1:
-                return self._get_quotes_for_group(wrappers[0], stocks)
+        def _quote_result(self, stocks, qt):
+            if not qt:
+                return {}
+            if self.native:
+                return {self._request_code(stocks, code): q for _, code, q in qt}
+            return self.format_quote_response(stocks, qt)
 
-            batches = len(wrappers)
-            gsize = len(stocks) // batches + 1
+        def _get_quotes_for_groups(self, groups):
             result = {}
-            with ThreadPoolExecutor(max_workers=batches) as executor:
-                futures = {
-                    executor.submit(
-                        self._get_quotes_for_group,
-                        wrappers[i],
-                        stocks[i*gsize:(i+1)*gsize]
-                    ): i for i in range(batches)
-                }
-                for future in as_completed(futures):
-                    result.update(future.result())
+            with self.pool.client() as client:
+                for stocks, qt in zip(groups, client.pipeline(self._quote_requests(groups), self.pipeline_depth)):
+                    result.update(self._quote_result(stocks, qt))
             return result
 
-        def _get_quotes_for_group(self, wrapper, stocks):
-            result = {}
-            with wrapper as client:
-                for i in range(0, len(stocks), self.quote_max_num):
-                    qt = client.get_security_quotes([(self.to_pytdx_market(code), code[-6:]) for code in stocks[i:i + self.quote_max_num]])
-                    if qt:
-                        result.update(self.format_quote_response(stocks[i:i + self.quote_max_num], qt))
-            return result
+        def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+            return self.quotes(stocks, fields=fields, fmt=fmt)
 
-        def quotes5(self, stocks):
-            return self.quotes(stocks)
+        def format_tline_response(self, rep_data, fmt=None):
+            """
+            TDX分时数据只有价格和成交量(手), 时间按交易时段依次生成(09:31 ~ 11:30, 13:01 ~ 15:00), 没有 09:30 的集合竞价点.
+            每分钟的成交额按 价格*成交量 估算(与新浪相同), 均价由估算的成交额累计得到, 列与 tline_cols 相同
+            """
+            tline = []
+            total_amount = 0
+            total_volume = 0
+            for t, q in zip(MINUTE_END_TIMES, rep_data):
+                volume = q['vol'] * 100
+                amount = q['price'] * volume
+                total_amount += amount
+                total_volume += volume
+                tline.append([t, q['price'], volume, amount, total_amount / total_volume if total_volume else q['price']])
+            return self.format_array_list(tline, self.tline_cols, fmt=fmt)
 
-        def format_tline_response(self, rep_data):
-            return self.format_array_list([[q['price'], q['vol'] * 100] for q in rep_data], ['price', 'volume'])
+        def tlines(self, stocks, fmt=None, date=None):
+            """
+            分时数据
 
-        def tlines(self, stocks):
+            :param date: 日期 'YYYY-MM-DD' 或 'YYYYMMDD', None 表示最近一个交易日(交易时段内为实时数据)
+            """
             if isinstance(stocks, str):
                 stocks = [stocks]
+            if date is not None:
+                date = int(date.replace('-', ''))
+            return self._map_groups(self._get_tlines_for_group, stocks, date, fmt)
 
-            today = datetime.now().strftime('%Y%m%d')
-            wrappers = [c for c in self.clients if not c.busy]
-            gsize = len(stocks) // len(wrappers) + 1
-            result = {}
-            with ThreadPoolExecutor(max_workers=len(wrappers)) as executor:
-                futures = {
-                    executor.submit(
-                        self._get_tlines_for_group,
-                        wrappers[i],
-                        stocks[i*gsize:(i+1)*gsize],
-                        today
-                    ): i for i in range(len(wrappers))
-                }
-                for future in as_completed(futures):
-                    result.update(future.result())
-
-            return result
-
-        def _get_tlines_for_group(self, wclient, stocks, date):
-            """处理单个股票组的K线获取"""
+        def _get_tlines_for_group(self, stocks, date=None, fmt=None):
+            """处理单个股票组的分时数据获取"""
             group_result = {}
-            with wclient as client:  # 每个线程获取独立的client
-                for code in stocks:
-                    try:
-                        data = client.get_history_minute_time_data(self.to_pytdx_market(code), code[-6:], date)
+            if date is None:
+                requests = [(GetMinuteTimeData, (self.to_pytdx_market(code), code[-6:])) for code in stocks]
+            else:
+                requests = [(GetHistoryMinuteTimeData, (self.to_pytdx_market(code), code[-6:], date)) for code in stocks]
+            with self.pool.client() as client:
+                try:
+                    for code, data in zip(stocks, client.pipeline(requests, self.pipeline_depth)):
                         if data:
-                            group_result[code] = self.format_tline_response(data)
-                    except Exception as e:
-                        logger.error(f"Failed to get klines for {code}: {str(e)}")
+                            group_result[code] = self.format_tline_response(data, fmt)
+                except Exception as e:
+                    logger.error(f"Failed to get tlines for {stocks}: {str(e)}")
+                    if isinstance(e, (OSError, TdxConnectionError)):
+                        self.pool.recover(client)
             return group_result
 
-        def format_kline_response(self, rep_data):
+        def format_kline_response(self, rep_data, fields=None, fmt=None):
+            if isinstance(rep_data, np.ndarray):
+                return self.format_kline_array(rep_data, fields, fmt)
             return self.format_array_list([[
                 kl['datetime'], kl['open'], kl['close'], kl['high'], kl['low'], kl['vol'], kl['amount']
-            ] for kl in rep_data], ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'])
+            ] for kl in rep_data], ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'], fields=fields, fmt=fmt)
+
+        def _kline_category(self, kltype):
+            kltype = self.to_int_kltype(kltype)
+            assert kltype in self.kline_categories, f'不支持的K线类型: {kltype}'
+            return self.kline_categories[kltype]
 
-        def mklines(self, stocks, kltype, length=320, fq=1, withqt=False):
+        def format_kline_array(self, arr, fields=None, fmt=None):
+            """转换 tdxparser 解码的K线数组, 结果与 format_kline_response 转换 pytdx 的数据相同"""
+            cols = list(arr.dtype.names)
+            if fields:
+                cols = [c for c in cols if c == 'time' or c in fields]
+            fmt = get_array_format(fmt)
+            if fmt == 'np':
+                return np.array(arr[cols], dtype=[(c, {'time': 'U20', 'volume': 'int64'}.get(c, 'float64')) for c in cols])
+            return self.format_array_list([list(r) for r in arr[cols].tolist()], cols, fmt=fmt)
+
+        def mklines(self, stocks, kltype, length=320, fq=1, withqt=False, fields=None, fmt=None):
+            """
+            pytdx 返回的K线都是不复权的, 但 klines/qklines/dklines 的默认参数是 fq=1, 为兼容以前的调用这里只接受 fq=1.
+            fklines/amklines 按数据的实际情况只接受 fq=0.
+            """
             if isinstance(stocks, str):
                 stocks = [stocks]
             if fq != 1:
                 logger.warning('pytdx不支持复权类型%s', fq)
                 return {}
 
-            kltype = self.to_int_kltype(kltype)
-            categories = {5: 0, 15: 1, 30: 2, 60: 3, 101: 4, 102: 5, 103: 6, 1: 8, 104: 10, 106: 11}
-            # category: K线类型（0 5分钟K线; 1 15分钟K线; 2 30分钟K线; 3 1小时K线; 4 日K线; 5 周K线; 6 月K线; 7 1分钟; 8 1分钟K线; 9 日K线; 10 季K线; 11 年K线）
-            assert kltype in categories, f'不支持的K线类型: {kltype}'
+            data = self._get_bars(stocks, self._kline_category(kltype), length)
+            return {code: self.format_kline_response(bars, fields, fmt) for code, bars in data.items()}
 
-            gsize = len(stocks) // len(self.tdxhosts) + 1
-            result = {}
-            wrappers = [c for c in self.clients if not c.busy]
-            with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
-                futures = {
-                    executor.submit(
-                        self._get_klines_for_group,
-                        wrappers[i],
-                        stocks[i*gsize:(i+1)*gsize],
-                        categories[kltype],
-                        length
-                    ): i for i in range(len(wrappers))
-                }
+        def fklines(self, stocks, kltype=101, fq=0, fmt=None):
+            if isinstance(stocks, str):
+                stocks = [stocks]
+            if fq != 0:
+                logger.warning('pytdx不支持复权类型%s', fq)
+                return {}
 
-                for future in as_completed(futures):
-                    result.update(future.result())
+            data = self._get_bars(stocks, self._kline_category(kltype))
+            return {code: self.format_kline_response(bars, fmt=fmt) for code, bars in data.items()}
+
+        def _get_bars(self, stocks, category, length=None):
+            """
+            分页获取K线原始数据, 每页最多 bars_page_size 根, 所有分页平均分给连接池中的连接
+
+            :param length: K线数量, None 表示获取全部, 此时每轮为每只股票请求 fkline_pages_per_round 页, 直到某页不满为止
+            :return: {code: [bar, ...]} 按时间升序
+            """
+            pages = {code: {} for code in stocks}
+            tasks = self._bar_tasks(stocks, length)
+            while tasks:
+                for (code, p), data in self._map_groups(self._get_bar_pages_for_group, tasks, category).items():
+                    pages[code][p] = data
+                tasks = self._next_bar_tasks(pages, length)
+            return self._join_bar_pages(pages)
+
+        def _bar_tasks(self, stocks, length=None):
+            """第一轮的分页 [(code, page, count), ...]"""
+            size = self.bars_page_size
+            if length is None:
+                return [(code, p, size) for code in stocks for p in range(self.fkline_pages_per_round)]
+            return [(code, p, min(size, length - p * size)) for code in stocks for p in range((length + size - 1) // size)]
+
+        def _next_bar_tasks(self, pages, length=None):
+            """获取全部K线时, 已获取的分页都是满页的股票继续请求后面的分页"""
+            if length is not None:
+                return []
+            size = self.bars_page_size
+            tasks = []
+            for code, pg in pages.items():
+                n = len(pg)
+                if n and all(len(pg.get(p, ())) == size for p in range(n)):
+                    tasks += [(code, p, size) for p in range(n, n + self.fkline_pages_per_round)]
+            return tasks
+
+        def _join_bar_pages(self, pages):
+            size = self.bars_page_size
+            result = {}
+            for code, pg in pages.items():
+                # 第0页为最近的数据, 只使用从第0页开始连续且前面各页都是满页的分页
+                valid = []
+                for p in range(len(pg)):
+                    if not len(pg.get(p, ())):
+                        break
+                    valid.append(pg[p])
+                    if len(pg[p]) < size:
+                        break
+                if valid:
+                    if self.native:
+                        result[code] = np.concatenate(valid[::-1])
+                    else:
+                        result[code] = [bar for page in reversed(valid) for bar in page]
             return result
 
-        def _get_klines_for_group(self, wclient, stocks, category, length=320, fq=1):
-            """处理单个股票组的K线获取"""
+        def _bar_request(self, category, code, page, count):
+            cmd_cls = SecurityBarsCmd if self.native else GetSecurityBarsCmd
+            return cmd_cls, (category, self.to_pytdx_market(code), code[-6:], page * self.bars_page_size, count)
+
+        def _get_bar_pages_for_group(self, tasks, category):
+            """处理一组分页的K线获取, tasks 为 [(code, page, count), ...], 返回 {(code, page): data}"""
             group_result = {}
-            with wclient as client:  # 每个线程获取独立的client
-                for code in stocks:
-                    try:
-                        data = client.get_security_bars(
-                            category,
-                            self.to_pytdx_market(code),
-                            code[-6:],
-                            0,
-                            length
-                        )
-                        if data:
-                            group_result[code] = self.format_kline_response(data)
-                    except Exception as e:
-                        logger.error(f"Failed to get klines for {code}: {str(e)}")
+            requests = [self._bar_request(category, code, page, count) for code, page, count in tasks]
+            with self.pool.client() as client:
+                try:
+                    for (code, page, _), data in zip(tasks, client.pipeline(requests, self.pipeline_depth)):
+                        if data is not None:
+                            group_result[(code, page)] = data
+                except Exception as e:
+                    logger.error(f"Failed to get klines for {len(tasks)} pages: {str(e)}")
+                    if isinstance(e, (OSError, TdxConnectionError)):
+                        self.pool.recover(client)
             return group_result
 
-        def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False):
-            return self.mklines(stocks, kltype, length, fq, withqt)
+        def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False, fields=None, fmt=None):
+            return self.mklines(stocks, kltype, length, fq, withqt, fields, fmt)
 
-        def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
-            return self.mklines(stocks, kltype, length, fq, False)
+        def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
+            return self.mklines(stocks, kltype, length, fq, False, fields, fmt)
 
-        def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
-            return self.mklines(stocks, kltype, length, fq, True)
+        def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
+            return self.mklines(stocks, kltype, length, fq, True, fields, fmt)
 
-        def stock_list(self, market = 'all'):
+        def stock_list(self, market = 'all', fields=None):
             pass
 
         def format_transaction_response(self, rep_data, start=''):
@@ -382,7 +788,8 @@ else:
                 else [tr['time'], tr['price'], tr['vol'] * 100, tr['buyorsell']] 
             for tr in rep_data if tr['time'] >= start]
 
-        def transactions(self, stocks, date=None, start=''):
+        def _transaction_args(self, stocks, date=None, start=''):
+            """返回 ([(code, start), ...], date)"""
             if isinstance(stocks, str):
                 stocks = [stocks]
             if isinstance(start, str):
@@ -396,55 +803,227 @@ else:
                 else:
                     arr_start.append('')
 
-            gsize = len(stocks) // len(self.tdxhosts) + 1
-            result = {}
-            wrappers = [c for c in self.clients if not c.busy]
-            ofmt = set_array_format('list')
-            with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
-                futures = {
-                    executor.submit(
-                        self._get_transaction_for_group,
-                        wrappers[i],
-                        stocks[i*gsize:(i+1)*gsize],
-                        date,
-                        arr_start[i*gsize:(i+1)*gsize]
-                    ): i for i in range(len(wrappers))
-                }
+            if date is not None:
+                date = int(date.replace('-', ''))
+            return list(zip(stocks, arr_start)), date
 
-                for future in as_completed(futures):
-                    result.update(future.result())
-            if ofmt != 'list':
-                set_array_format(ofmt)
-                for k, v in result.items():
-                    cols = ['time', 'price', 'volume', 'num', 'bs'] if v and len(v[0]) == 5 else ['time', 'price', 'volume', 'bs']
-                    result[k] = self.format_array_list(v, cols, {'time': 'U20', 'volume': 'int64', 'num': 'int32', 'bs': 'int32'})
+        def transactions(self, stocks, date=None, start='', fmt=None):
+            items, date = self._transaction_args(stocks, date, start)
+            return self._format_transactions(self._map_groups(self._get_transaction_for_group, items, date), fmt)
+
+        def _format_transactions(self, result, fmt=None):
+            # 各分页的原始数据合并后一次转换为需要的格式
+            for k, v in result.items():
+                cols = ['time', 'price', 'volume', 'num', 'bs'] if v and len(v[0]) == 5 else ['time', 'price', 'volume', 'bs']
+                result[k] = self.format_array_list(v, cols, {'time': 'U20', 'volume': 'int64', 'num': 'int32', 'bs': 'int32'}, fmt=fmt)
             return result
 
-        def _get_transaction_for_group(self, wclient, stocks, date=None, start=''):
-            """处理单个股票组的K线获取"""
+        def _transaction_requests(self, code, offset, size, n, date=None):
+            """从 offset 开始的 n 页成交明细请求"""
+            if self.native:
+                cmd_cls = TransactionCmd if date is None else HistoryTransactionCmd
+            else:
+                cmd_cls = GetTransactionData if date is None else GetHistoryTransactionData
+            extra = () if date is None else (date,)
+            return [(cmd_cls, (self.to_pytdx_market(code), code[-6:], offset + i * size, size) + extra) for i in range(n)]
+
+        def _transaction_page(self, data, start=''):
+            """返回 (过滤后的成交明细, 本页第一笔的时间)"""
+            if self.native:
+                return ([tr for tr in data if tr[0] >= start] if start else data), data[0][0]
+            return self.format_transaction_response(data, start), data[0]['time']
+
+        def _transaction_pages(self, client, code, start='', date=None):
+            """
+            逐页获取成交明细, 从最近的一页开始, 每页内按时间升序
+
+            第一页确定每页的数量之后, 每次流水线请求 pipeline_depth 页, 遇到不满的页或早于 start 的页为止
+            """
+            offset = 0
+            r_size = None
+            while True:
+                n = 1 if r_size is None else max(1, self.pipeline_depth)
+                for data in client.pipeline(self._transaction_requests(code, offset, r_size or 2000, n, date), n):
+                    if not data:
+                        return
+                    if r_size is None:
+                        r_size = len(data)
+                    offset += len(data)
+                    trans, first_time = self._transaction_page(data, start)
+                    yield trans
+                    if first_time < start or len(data) < r_size:
+                        return
+
+        def _get_transaction_for_group(self, stocks, date=None):
+            """处理单个股票组的成交明细获取, stocks 为 [(code, start), ...]"""
             group_result = {}
-            with wclient as client:  # 每个线程获取独立的client
-                for code, start_hr_min in zip(stocks, start):
+            with self.pool.client() as client:
+                for code, start_hr_min in stocks:
                     try:
-                        trans = []
-                        i = 0
-                        r_size = None
-                        if date is not None:
-                            date = int(date.replace('-', ''))
-                        while True:
-                            if date is None:
-                                data = client.get_transaction_data(self.to_pytdx_market(code), code[-6:], len(trans), r_size or 2000)
-                            else:
-                                data = client.get_history_transaction_data(self.to_pytdx_market(code), code[-6:], len(trans), r_size or 2000, date)
-                            if not data:
-                                break
-                            if r_size is None:
-                                r_size = len(data)
-                            trans = self.format_transaction_response(data, start_hr_min) + trans
-                            if data[0]['time'] < start_hr_min or len(data) < r_size:
-                                break
-                            i += 1
-                        group_result[code] = trans
+                        # 各页先放入列表, 最后一次拼接, 避免每页都复制已获取的数据
+                        pages = list(self._transaction_pages(client, code, start_hr_min, date))
+                        group_result[code] = [tr for page in reversed(pages) for tr in page]
                     except Exception as e:
                         logger.error(f"Failed to get transaction for {code}: {str(e)}")
+                        if isinstance(e, (OSError, TdxConnectionError)):
+                            self.pool.recover(client)
             return group_result
+
+        def iter_transactions(self, stocks, date=None, start='', max_pending=16):
+            """
+            逐页返回成交明细的生成器, 适合获取大量股票的成交明细, 内存占用与 max_pending 页相当
+
+            各股票由连接池中的连接并发获取, 每只股票的分页从最近的一页开始返回, 每页内按时间升序.
+            消费速度跟不上时获取线程会等待.
+
+            :param max_pending: 已获取但还没有被消费的最大页数
+            :return: 生成 (code, page), page 为 [[time, price, volume, num, bs], ...] 或 [[time, price, volume, bs], ...]
+            """
+            items, date = self._transaction_args(stocks, date, start)
+            if not items:
+                return
+            n = max(1, min(self.pool.size, len(items)))
+            gsize = (len(items) + n - 1) // n
+            groups = [items[i:i + gsize] for i in range(0, len(items), gsize)]
+            pages = queue.Queue(max_pending)
+            stop = threading.Event()
+            done = object()
+
+            def put(item):
+                while not stop.is_set():
+                    try:
+                        pages.put(item, timeout=0.5)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+
+            def worker(group):
+                try:
+                    with self.pool.client() as client:
+                        for code, start_hr_min in group:
+                            try:
+                                for page in self._transaction_pages(client, code, start_hr_min, date):
+                                    if page and not put((code, page)):
+                                        return
+                            except Exception as e:
+                                logger.error(f"Failed to get transaction for {code}: {str(e)}")
+                                if isinstance(e, (OSError, TdxConnectionError)):
+                                    self.pool.recover(client)
+                finally:
+                    put(done)
+
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                for g in groups:
+                    executor.submit(worker, g)
+                try:
+                    remaining = len(groups)
+                    while remaining:
+                        item = pages.get()
+                        if item is done:
+                            remaining -= 1
+                        else:
+                            yield item
+                finally:
+                    stop.set()
+
+        def _async_clients_by_loop(self):
+            if '_aclients' not in self.__dict__:
+                self._aclients = weakref.WeakKeyDictionary()
+            return self._aclients
+
+        async def _async_clients(self):
+            """当前事件循环使用的异步连接, 每个服务器 pool_size_per_host 个"""
+            loop = asyncio.get_running_loop()
+            by_loop = self._async_clients_by_loop()
+            clients = [c for c in by_loop.get(loop, []) if c.is_connected]
+            if not clients:
+                hosts = await loop.run_in_executor(None, lambda: self.tdxhosts)
+                candidates = [AsyncTdxClient(h[0], h[1], self.async_pipeline_depth)
+                              for h in hosts for _ in range(self.pool_size_per_host)]
+                results = await asyncio.gather(*(c.connect() for c in candidates), return_exceptions=True)
+                clients = [c for c, r in zip(candidates, results) if not isinstance(r, BaseException)]
+                if not clients:
+                    raise TdxConnectionError('没有可用的TDX服务器')
+            by_loop[loop] = clients
+            return clients
+
+        async def aclose(self):
+            """关闭当前事件循环中的异步连接"""
+            clients = self._async_clients_by_loop().pop(asyncio.get_running_loop(), [])
+            await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+        @staticmethod
+        async def _acall(client, request, what=''):
+            cmd_cls, params = request
+            try:
+                return await client.call(cmd_cls, *params)
+            except (OSError, TdxConnectionError, asyncio.TimeoutError) as e:
+                logger.error(f"Failed to get {what}: {str(e)}")
+                return None
+
+        async def aquotes(self, stocks, fields=None, fmt=None):
+            """quotes 的异步版本, 请求分配到各连接并流水线发送"""
+            if isinstance(stocks, str):
+                stocks = [stocks]
+            clients = await self._async_clients()
+            groups = [stocks[i:i + self.quote_max_num] for i in range(0, len(stocks), self.quote_max_num)]
+            rsps = await asyncio.gather(*(
+                self._acall(clients[i % len(clients)], req, 'quotes') for i, req in enumerate(self._quote_requests(groups))))
+            result = {}
+            for g, qt in zip(groups, rsps):
+                result.update(self._quote_result(g, qt))
+            return self.format_quotes(result, fields, fmt)
+
+        async def amklines(self, stocks, kltype, length=320, fq=0, fields=None, fmt=None):
+            """mklines/fklines 的异步版本, length 为 None 时获取全部K线, K线不复权, 只支持 fq=0"""
+            if isinstance(stocks, str):
+                stocks = [stocks]
+            if fq != 0:
+                logger.warning('pytdx不支持复权类型%s', fq)
+                return {}
+
+            category = self._kline_category(kltype)
+            clients = await self._async_clients()
+            pages = {code: {} for code in stocks}
+            tasks = self._bar_tasks(stocks, length)
+            while tasks:
+                rsps = await asyncio.gather(*(
+                    self._acall(clients[i % len(clients)], self._bar_request(category, *t), f'klines for {t[0]}')
+                    for i, t in enumerate(tasks)))
+                for (code, page, _), data in zip(tasks, rsps):
+                    if data is not None:
+                        pages[code][page] = data
+                tasks = self._next_bar_tasks(pages, length)
+            return {code: self.format_kline_response(bars, fields, fmt) for code, bars in self._join_bar_pages(pages).items()}
+
+        async def _atransaction_pages(self, client, code, start='', date=None):
+            pages = []
+            offset = 0
+            r_size = None
+            while True:
+                n = 1 if r_size is None else self.async_pipeline_depth
+                rsps = await asyncio.gather(*(
+                    self._acall(client, req, f'transaction for {code}')
+                    for req in self._transaction_requests(code, offset, r_size or 2000, n, date)))
+                for data in rsps:
+                    if not data:
+                        return pages
+                    if r_size is None:
+                        r_size = len(data)
+                    offset += len(data)
+                    trans, first_time = self._transaction_page(data, start)
+                    pages.append(trans)
+                    if first_time < start or len(data) < r_size:
+                        return pages
+
+        async def atransactions(self, stocks, date=None, start='', fmt=None):
+            """transactions 的异步版本"""
+            items, date = self._transaction_args(stocks, date, start)
+            clients = await self._async_clients()
+            all_pages = await asyncio.gather(*(
+                self._atransaction_pages(clients[i % len(clients)], code, st, date) for i, (code, st) in enumerate(items)))
+            result = {}
+            for (code, _), pages in zip(items, all_pages):
+                result[code] = [tr for page in reversed(pages) for tr in page]
+            return self._format_transactions(result, fmt)
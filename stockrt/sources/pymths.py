@@ -11,23 +11,162 @@ if importlib.util.find_spec("thsdk") is None:
     from .rtbase import NoneSourcePy as SrcThs
 else:
     import time
-    from functools import lru_cache
-    from typing import Any, Union, List, Dict
+    import queue
+    import atexit
+    import threading
+    from contextlib import contextmanager
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from typing import Any, Callable, Optional, Union, List, Dict
     from thsdk import THS
     from thsdk._constants import *
     from .rtbase import rtbase
+    from .secmaster import get_security_master
     from thsdk.thsdk import logger
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
     logger.propagate = True
     logger.info("set thsdk logger propagate!")
 
+    class ThsSession:
+        """
+        一个登录的THS连接, 同一时间只能被一个线程使用(由 ThsPool 保证)
+
+        每次请求前等待到距离上一次请求至少 min_interval 秒, 避免请求过快被限制
+        """
+        def __init__(self, ops: Optional[Dict[str, Any]] = None, min_interval=0.04):
+            self._ops = ops
+            self._ths = None
+            self.min_interval = min_interval
+            self._last_request = 0
+
+        @property
+        def is_connected(self):
+            return self._ths is not None and self._ths._login
+
+        def connect(self):
+            if self.is_connected:
+                return True
+            if self._ths is None:
+                self._ths = THS(self._ops) if self._ops else THS()
+            try:
+                self._ths.connect()
+            except Exception as e:
+                logger.error('ths connect failed: %s', e)
+                return False
+            return self.is_connected
+
+        def disconnect(self):
+            if self._ths is None:
+                return
+            try:
+                self._ths.disconnect()
+            except Exception:
+                pass
+            finally:
+                self._ths = None
+
+        def call(self, func_name: str, *args, **kwargs):
+            """按间隔调用 THS 的方法"""
+            if not self.is_connected and not self.connect():
+                raise ConnectionError('ths session not connected')
+            wait = self._last_request + self.min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                return getattr(self._ths, func_name)(*args, **kwargs)
+            finally:
+                self._last_request = time.time()
+
+
+    class ThsPool:
+        """
+        THS连接池, 连接在第一次使用或调用 connect() 时建立, disconnect() 断开全部连接
+        """
+        def __init__(self, accounts: List[Optional[Dict[str, Any]]], min_interval=0.04, checkout_timeout=30):
+            self._sessions = [ThsSession(ops, min_interval) for ops in accounts]
+            self._idle = queue.LifoQueue()
+            for session in self._sessions:
+                self._idle.put(session)
+            self.checkout_timeout = checkout_timeout
+
+        @property
+        def size(self):
+            return len(self._sessions)
+
+        def connect(self):
+            """连接所有会话, 返回连接成功的数量"""
+            with ThreadPoolExecutor(max_workers=self.size) as executor:
+                return sum(executor.map(lambda s: s.connect(), self._sessions))
+
+        def disconnect(self):
+            for session in self._sessions:
+                session.disconnect()
+
+        @contextmanager
+        def session(self):
+            try:
+                session = self._idle.get(timeout=self.checkout_timeout)
+            except queue.Empty:
+                raise TimeoutError('no idle ths session')
+            try:
+                yield session
+            except (OSError, ConnectionError):
+                session.disconnect()
+                raise
+            finally:
+                self._idle.put(session)
+
+
     class SrcThs(rtbase):
+        # 连接数, accounts 为空时使用 session_count 个匿名连接
+        session_count = 2
+        # 每个连接两次请求之间的最小间隔(秒)
+        min_interval = 0.04
+        # 登录账号列表, 每个账号一个连接, 元素为传给 THS() 的参数
+        accounts: Optional[List[Dict[str, Any]]] = None
+        _pool_lock = threading.Lock()
+
         def __init__(self, **kwargs):
             super().__init__(**kwargs)
 
-        def __del__(self):
-            self.ths().disconnect()
+        @property
+        def pool(self) -> ThsPool:
+            if '_pool' not in self.__dict__:
+                with self._pool_lock:
+                    if '_pool' not in self.__dict__:
+                        pool = ThsPool(self.accounts or [None] * self.session_count, self.min_interval)
+                        atexit.register(pool.disconnect)
+                        self._pool = pool
+            return self._pool
+
+        def connect(self):
+            """建立所有连接, 不调用时在第一次请求时建立"""
+            return self.pool.connect()
+
+        def disconnect(self):
+            """断开所有连接"""
+            if '_pool' in self.__dict__:
+                self.pool.disconnect()
+
+        def _map_sessions(self, func: Callable, items: List, *args):
+            """将 items 平均分给各连接并发执行 func(session, group, *args), 合并返回的dict"""
+            if not items:
+                return {}
+            n = max(1, min(self.pool.size, len(items)))
+            gsize = (len(items) + n - 1) // n
+            groups = [items[i:i + gsize] for i in range(0, len(items), gsize)]
+
+            def run(group):
+                with self.pool.session() as session:
+                    return func(session, group, *args)
+
+            if len(groups) == 1:
+                return run(groups[0])
+            result = {}
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                for future in as_completed([executor.submit(run, g) for g in groups]):
+                    result.update(future.result())
+            return result
 
         @property
         def qtapi(self):
@@ -45,23 +184,13 @@ else:
         def dklineapi(self):
             return 'dklineapi'
 
-        @lru_cache(maxsize=1)
-        def ths(self):
-            return THS()
-
-        @property
-        def thsapi(self):
-            ths = self.ths()
-            if not ths._login:
-                ths.connect()
-            return ths
-
-        def to_ths_market(self, code):
+        @classmethod
+        def to_ths_market(cls, code):
             if len(code) == 10:
                 return code[:4]
 
             if len(code) == 6:
-                code = self.get_fullcode(code)
+                code = cls.get_fullcode(code)
             if code.startswith('sh00'):
                 return MarketUSHI
             if code.startswith('sh6'):
@@ -86,7 +215,11 @@ else:
             """转换为thsdk的code"""
             if len(code) == 10:
                 return code
-            m = self.to_ths_market(code)
+            return get_security_master().source_code('ths', code)
+
+        @classmethod
+        def _ths_code(cls, code):
+            m = cls.to_ths_market(code)
             if m == MarketUSHI:
                 # 不清楚同花顺的指数代码规则，大部分都是USHI1Bxxxx 工业指数 USHI1B0001
                 # 上证指数是USHI1A0001，还有少数1C，如USHI1C0002
@@ -144,7 +277,7 @@ else:
                     })
             return result
 
-        def query_quote_data(self, stocks, datatypes):
+        def query_quote_data(self, stocks, datatypes, fields=None, fmt=None):
             if isinstance(stocks, str):
                 stocks = [stocks]
             stock_grp = {}
@@ -155,43 +288,45 @@ else:
                     stock_grp[m] = []
                 stock_grp[m].append(thcode[-6:])
 
+            result = self._map_sessions(self._query_markets, list(stock_grp.items()), stocks, datatypes)
+            return self.format_quotes(result, fields, fmt)
+
+        def _query_markets(self, session, markets, stocks, datatypes):
             result = {}
-            for i, m in enumerate(stock_grp):
+            for m, codes in markets:
                 stypes = datatypes
                 if m in (MarketUSZI, MarketUSHI):
                     stypes = [s for s in stypes if s not in [69, 70]]
                 stypes = ','.join([str(t) for t in stypes])
                 params = {
-                    'id': 200, 'codelist': ','.join(stock_grp[m]),
+                    'id': 200, 'codelist': ','.join(codes),
                     'market': m,
                     'datatype': stypes,
                     'service': 'zhu' if m in (MarketUSHA, MarketUSZA) else 'fu'}
-                r = self.thsapi.query_data(params)
-                result = {**result, **self.format_quote_response(stocks, r.payload.result)}
-                if i < len(stock_grp) - 1:
-                    time.sleep(0.04)
+                r = session.call('query_data', params)
+                result.update(self.format_quote_response(stocks, r.payload.result))
             return result
 
-        def quotes(self, stocks):
+        def quotes(self, stocks, lazy=False, fields=None, fmt=None):
             datatypes = [5,55,6,10,13,19,69,70,199112,264648]
-            return self.query_quote_data(stocks, datatypes)
+            return self.query_quote_data(stocks, datatypes, fields, fmt)
 
-        def quotes5(self, stocks):
+        def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
             datatypes = [5,55,6,10,13,19,69,70,199112,264648,24,25,26,27,28,29,30,31,32,33,34,35,150,151,152,153,154,155,156,157]
-            return self.query_quote_data(stocks, datatypes)
+            return self.query_quote_data(stocks, datatypes, fields, fmt)
 
-        def format_tline_response(self, rep_data):
+        def format_tline_response(self, rep_data, fmt=None):
             pass
 
-        def tlines(self, stocks):
+        def tlines(self, stocks, fmt=None):
             pass
 
-        def format_kline_response(self, rep_data):
+        def format_kline_response(self, rep_data, fields=None, fmt=None):
             return self.format_array_list([[
                 kl['时间'].strftime('%Y-%m-%d' if kl['时间'].hour == 0 and kl['时间'].minute == 0 else '%Y-%m-%d %H:%M'), kl['开盘价'], kl['收盘价'], kl['最高价'], kl['最低价'], kl['成交量'], kl['总金额']
-            ] for kl in rep_data.payload.result], ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'])
+            ] for kl in rep_data.payload.result], ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'], fields=fields, fmt=fmt)
 
-        def mklines(self, stocks, kltype, length=320, fq=1, withqt=False):
+        def mklines(self, stocks, kltype, length=320, fq=1, withqt=False, fields=None, fmt=None):
             if isinstance(stocks, str):
                 stocks = [stocks]
             kltype = self.to_int_kltype(kltype)
@@ -207,22 +342,32 @@ else:
             else:
                 raise ValueError(f'不支持的K线类型: {kltype}')
             adj = ['', 'forward', 'backward'][fq]
+            return self._map_sessions(self._get_klines_for_group, stocks, kltype, length, adj, fields, fmt)
+
+        def _get_klines_for_group(self, session, stocks, interval, length, adj, fields=None, fmt=None):
             klines = {}
             for c in stocks:
-                thkl = self.thsapi.klines(self.to_ths_code(c), interval=kltype, count=length, adjust=adj)
+                try:
+                    thkl = session.call('klines', self.to_ths_code(c), interval=interval, count=length, adjust=adj)
+                except Exception as e:
+                    logger.error(f"Failed to get klines for {c}: {str(e)}")
+                    if isinstance(e, (OSError, ConnectionError)):
+                        session.disconnect()
+                    continue
                 if thkl.payload.result:
-                    klines[c] = self.format_kline_response(thkl)
-                time.sleep(0.04)
+                    klines[c] = self.format_kline_response(thkl, fields, fmt)
             return klines
 
-        def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False):
-            return self.mklines(stocks, kltype, length, fq, withqt)
+        def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False, fields=None, fmt=None):
+            return self.mklines(stocks, kltype, length, fq, withqt, fields, fmt)
 
-        def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
-            return self.mklines(stocks, kltype, length, fq, False)
+        def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
+            return self.mklines(stocks, kltype, length, fq, False, fields, fmt)
 
-        def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
-            return self.mklines(stocks, kltype, length, fq, True)
+        def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
+            return self.mklines(stocks, kltype, length, fq, True, fields, fmt)
 
-        def stock_list(self, market = 'all'):
+        def stock_list(self, market = 'all', fields=None):
             pass
+
+    get_security_master().register_source('ths', SrcThs._ths_code)
@@ -0,0 +1,140 @@
+# coding:utf8
+'''
+紧凑的行情/K线记录类型
+
+Quote 与 Bar 使用 __slots__ 固定字段布局, 比 dict 占用内存少很多, 适合缓存大量股票的行情和K线.
+数据源没有提供的字段值为 MISSING (而不是缺少该key), to_dict() 返回与原来一致的 dict(不含 MISSING 字段).
+'''
+from typing import Any, Dict, Iterable, Optional
+
+
+class _Missing:
+    __slots__ = ()
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        return (_Missing, ())
+
+
+MISSING = _Missing()
+
+
+class _Record:
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for k in self.__slots__:
+            setattr(self, k, MISSING)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def _lookup(self, key):
+        return getattr(self, key, MISSING) if isinstance(key, str) else MISSING
+
+    def __getitem__(self, key):
+        v = self._lookup(key)
+        if v is MISSING:
+            raise KeyError(key)
+        return v
+
+    def __contains__(self, key):
+        return self._lookup(key) is not MISSING
+
+    def get(self, key, default=None):
+        v = self._lookup(key)
+        return default if v is MISSING else v
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: v for k in self.__slots__ if (v := getattr(self, k)) is not MISSING}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()})'
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+
+class Bar(_Record):
+    ''' K线记录, 字段与 klines 的列名一致 '''
+    __slots__ = (
+        'time', 'open', 'close', 'high', 'low', 'volume', 'amount',
+        'amplitude', 'change', 'change_px', 'turnover',
+    )
+
+    @classmethod
+    def accepts(cls, cols: Iterable[str]) -> bool:
+        ''' cols 是否都是 Bar 的字段 '''
+        return all(c in cls.__slots__ for c in cols)
+
+    @classmethod
+    def from_row(cls, cols: Iterable[str], row: Iterable[Any]) -> 'Bar':
+        return cls(**dict(zip(cols, row)))
+
+
+_BOOK_FIELDS = tuple(
+    f'{side}{i}{suffix}' for i in range(1, 6) for side in ('bid', 'ask') for suffix in ('', '_volume')
+)
+
+
+class Quote(_Record):
+    '''
+    行情记录, 各数据源共有的字段使用固定布局, 五档买卖盘为 bid1..bid5 / ask1..ask5 及对应的 *_volume.
+    数据源特有的字段(如 '量比', '委差', '最近逐笔成交')保存在 extra 中, 没有时 extra 为 MISSING.
+    '''
+    __slots__ = (
+        'name', 'date', 'time', 'price', 'open', 'high', 'low', 'lclose',
+        'change', 'change_px', 'volume', 'amount', 'avg_price', 'turnover', 'amplitude',
+        'top_price', 'bottom_price', 'mc', 'cmc', 'PE', 'PB', 'TTM_PE',
+    ) + _BOOK_FIELDS + ('extra',)
+
+    _fields = frozenset(__slots__[:-1])
+
+    @classmethod
+    def from_dict(cls, quote: Optional[Dict[str, Any]]) -> Optional['Quote']:
+        ''' 由数据源返回的行情 dict 创建 Quote, 已经是 Quote 时直接返回 '''
+        if quote is None or isinstance(quote, Quote):
+            return quote
+        q = cls()
+        extra = None
+        for k, v in quote.items():
+            if k in cls._fields:
+                setattr(q, k, v)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+        if extra is not None:
+            q.extra = extra
+        return q
+
+    def _lookup(self, key):
+        v = super()._lookup(key)
+        if v is MISSING and self.extra is not MISSING:
+            return self.extra.get(key, MISSING)
+        return v
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {k: v for k in self.__slots__[:-1] if (v := getattr(self, k)) is not MISSING}
+        if self.extra is not MISSING:
+            result.update(self.extra)
+        return result
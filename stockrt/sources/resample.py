@@ -0,0 +1,123 @@
+# coding:utf8
+'''
+K线周期转换
+
+由1分钟K线合成 5/15/30/60/120/240 分钟K线, 由日K线合成 周/月/季/半年/年K线, 不需要再请求数据源.
+分钟K线按A股的交易时段分组: 09:30 的集合竞价K线并入第一根, 11:30/13:00 不跨越, 15:00 之后的盘后K线并入最后一根,
+合成的K线时间为该周期的结束时间(与数据源一致). 日K线以上的周期时间为该周期内最后一个交易日.
+
+全部股票的K线拼接后一次计算(np.ufunc.reduceat), 不逐只股票循环.
+'''
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
+from .rtbase import rtbase, to_int_kltype, MINUTE_END_TIMES
+
+
+KLINE_COLS = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount']
+# 月/季/半年/年K线包含的月数
+_CALENDAR_MONTHS = {103: 1, 104: 3, 105: 6, 106: 12}
+
+_MINUTE_TIMES = np.array(MINUTE_END_TIMES)
+
+
+def _bar_columns(bars: Any, cols: Optional[List[str]]) -> Dict[str, np.ndarray]:
+    ''' 各种返回格式的K线 -> {列名: 数组}, 只保留 KLINE_COLS 中的列 '''
+    if hasattr(bars, 'dtype') and bars.dtype.names:
+        names = bars.dtype.names
+        return {c: np.asarray(bars[c]) for c in KLINE_COLS if c in names}
+    if hasattr(bars, 'columns'):
+        return {c: bars[c].to_numpy() for c in KLINE_COLS if c in bars.columns}
+    bars = list(bars)
+    if not bars:
+        return {}
+    first = bars[0]
+    if isinstance(first, (list, tuple)):
+        cols = cols or KLINE_COLS
+        return {c: np.array([b[i] for b in bars]) for i, c in enumerate(cols) if c in KLINE_COLS and i < len(first)}
+    # dict 或 Bar
+    return {c: np.array([b[c] for b in bars]) for c in KLINE_COLS if c in first}
+
+
+def _minute_buckets(times: np.ndarray, minutes: int):
+    ''' 分钟K线的 (交易日, 周期序号), 以及每个周期的结束时间 '''
+    t = times.astype('datetime64[m]')
+    days = t.astype('datetime64[D]')
+    m = (t - days).astype(np.int64)
+    # 交易分钟序号: 09:31 -> 0, 11:30 -> 119, 13:01 -> 120, 15:00 -> 239
+    idx = np.where(m <= 690, m - 571, m - 781 + 120)
+    idx = np.clip(np.where((m > 690) & (m <= 780), 120, idx), 0, 239)
+    bucket = idx // minutes
+    end = np.minimum((bucket + 1) * minutes - 1, 239)
+    labels = np.char.add(np.char.add(days.astype('U10'), ' '), _MINUTE_TIMES[end])
+    return days.astype(np.int64) * 1000 + bucket, labels
+
+
+def _calendar_buckets(times: np.ndarray, kltype: int):
+    days = times.astype('datetime64[D]')
+    if kltype == 102:
+        # 1970-01-01 是星期四, +3 后按周一分组
+        return (days.astype(np.int64) + 3) // 7
+    months = days.astype('datetime64[M]').astype(np.int64)
+    return months // _CALENDAR_MONTHS[kltype]
+
+
+def resample(
+    klines: Dict[str, Any], kltype: Union[int, str], cols: Optional[List[str]] = None, fmt: Optional[str] = None
+) -> Dict[str, Any]:
+    '''
+    K线周期转换
+
+    :param klines: klines 的返回值 {code: K线}, 分钟K线要转换为分钟周期, 日K线要转换为周/月/季/半年/年
+    :param kltype: 目标周期, 5/15/30/60/120/240 或 102~106 ('w', 'm', 'q', 'h', 'y')
+    :param cols: K线为 list/tuple 格式时的列名, 默认为 KLINE_COLS
+    :param fmt: 返回格式, 同 set_array_format
+    :return: {code: K线}, 列为 time/open/close/high/low/volume/amount 中输入包含的列
+    '''
+    kltype = to_int_kltype(kltype)
+    if kltype not in (5, 15, 30, 60, 120, 240, 102, 103, 104, 105, 106):
+        raise ValueError(f'unsupported resample kltype: {kltype}')
+    columns = {}
+    for code, bars in klines.items():
+        data = _bar_columns(bars, cols) if bars is not None else {}
+        if len(data.get('time', ())) > 0:
+            columns[code] = data
+    if not columns:
+        return {}
+    codes = list(columns)
+    names = [c for c in KLINE_COLS if all(c in d for d in columns.values())]
+    sizes = np.array([len(columns[c]['time']) for c in codes])
+    times = np.concatenate([columns[c]['time'].astype('U20') for c in codes])
+    values = {c: np.concatenate([columns[code][c] for code in codes]).astype(np.float64) for c in names if c != 'time'}
+
+    if kltype in _CALENDAR_MONTHS or kltype == 102:
+        keys, labels = _calendar_buckets(times, kltype), times
+    else:
+        keys, labels = _minute_buckets(times, kltype)
+    owner = np.repeat(np.arange(len(codes)), sizes)
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (owner[1:] != owner[:-1])])
+    ends = np.r_[starts[1:], len(times)] - 1
+
+    out = {'time': labels[ends]}
+    for c, v in values.items():
+        if c == 'open':
+            out[c] = v[starts]
+        elif c == 'close':
+            out[c] = v[ends]
+        elif c == 'high':
+            out[c] = np.maximum.reduceat(v, starts)
+        elif c == 'low':
+            out[c] = np.minimum.reduceat(v, starts)
+        else:
+            out[c] = np.add.reduceat(v, starts)
+    if 'volume' in out:
+        out['volume'] = np.round(out['volume']).astype(np.int64)
+    if 'amount' in out:
+        out['amount'] = np.round(out['amount'], 2)
+
+    splits = np.cumsum(np.bincount(owner[starts], minlength=len(codes)))[:-1]
+    parts = {c: np.split(out[c], splits) for c in names}
+    result = {}
+    for i, code in enumerate(codes):
+        rows = [list(r) for r in zip(*(parts[c][i].tolist() for c in names))]
+        result[code] = rtbase.format_array_list(rows, names, fmt=fmt)
+    return result
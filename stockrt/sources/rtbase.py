@@ -1,7 +1,12 @@
 # coding:utf8
 
+import os
 import abc
+import json
+import time
+import atexit
 import logging
+import threading
 import requests
 import importlib.util
 from functools import lru_cache
@@ -10,9 +15,12 @@ if importlib.util.find_spec("numpy"):
 if importlib.util.find_spec("pandas"):
     import pandas as pd
 from typing import Optional
+from collections.abc import Mapping
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Callable, Any, Union, List, Dict
 from functools import cached_property
+from datetime import date, timedelta
+from .records import Quote, Bar
 
 
 logger: logging.Logger = logging.getLogger('stockrt')
@@ -28,12 +36,212 @@ def get_session(src):
     })
     return session
 
+_CACHE_DIR = None
+def set_cache_dir(path: Optional[str]):
+    '''
+    设置缓存目录, 用于保存TDX服务器统计等数据. 也可以通过环境变量 STOCKRT_CACHE_DIR 设置,
+    都没有设置时使用 ~/.cache/stockrt (或 $XDG_CACHE_HOME/stockrt)
+
+    :param path str: 缓存目录, None 表示恢复默认
+    :return str: 旧的设置
+    '''
+    global _CACHE_DIR
+    old_dir = _CACHE_DIR
+    _CACHE_DIR = path
+    return old_dir
+
+def get_cache_dir() -> str:
+    ''' 缓存目录, 不存在时自动创建 '''
+    path = _CACHE_DIR or os.environ.get('STOCKRT_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'stockrt')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class RateBudget:
+    """
+    单个数据源的请求预算(令牌桶)
+
+    limits 为 [(次数, 秒数), ...], 每个窗口是一个容量为 次数, 每秒补充 次数/秒数 个令牌的桶, 例如东财的 1000/5min 50000/24h
+    对应 ((1000, 300), (50000, 86400)). 请求前取得全部窗口的令牌, 令牌不足时排队等待, 而不是等数据源开始报错.
+    没有限制时 limits 为空, acquire 总是立即返回.
+    """
+    def __init__(self, name: str, limits=(), tokens=None, timestamp=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self.limits = [(int(c), float(p)) for c, p in limits or ()]
+        self._tokens = [float(c) for c, _ in self.limits]
+        self._timestamp = time.time()
+        if tokens is not None and len(tokens) == len(self.limits):
+            self._tokens = [min(float(t), c) for t, (c, _) in zip(tokens, self.limits)]
+            self._timestamp = timestamp or self._timestamp
+            self._refill(time.time())
+
+    def _refill(self, now):
+        elapsed = max(0, now - self._timestamp)
+        self._tokens = [min(c, t + elapsed * c / p) for t, (c, p) in zip(self._tokens, self.limits)]
+        self._timestamp = now
+
+    def _wait_time(self, n):
+        return max([(n - t) * p / c for t, (c, p) in zip(self._tokens, self.limits) if t < n], default=0)
+
+    def wait_time(self, n: int = 1) -> float:
+        """ 取得 n 个令牌需要等待的秒数, 0 表示可以立即请求 """
+        with self._lock:
+            self._refill(time.time())
+            return self._wait_time(n)
+
+    def available(self) -> float:
+        """ 各窗口中最少的剩余令牌数, 没有限制时为 inf """
+        with self._lock:
+            self._refill(time.time())
+            return min(self._tokens, default=float('inf'))
+
+    def remaining(self) -> float:
+        """ 剩余预算比例 0~1, 取各窗口中最小的 """
+        with self._lock:
+            self._refill(time.time())
+            return min([t / c for t, (c, _) in zip(self._tokens, self.limits)], default=1.0)
+
+    def acquire(self, n: int = 1, timeout: Optional[float] = None) -> bool:
+        """
+        取得 n 个令牌, 不足时等待
+
+        :param timeout: 最长等待秒数, None 表示一直等待
+        :return bool: 超时返回 False, 此时不消耗令牌
+        """
+        if not self.limits:
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                wait = self._wait_time(n)
+                if wait <= 0:
+                    self._tokens = [t - n for t in self._tokens]
+                    break
+            if deadline is not None and now + wait > deadline:
+                return False
+            logger.debug('%s rate limited, wait %.2fs', self.name, wait)
+            time.sleep(min(wait, 1))
+        _rate_budgets.saved_later()
+        return True
+
+    def state(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.time())
+            return {'limits': self.limits, 'tokens': self._tokens, 'timestamp': self._timestamp}
+
+
+class _RateBudgets:
+    """ 全部数据源的请求预算, 预算的剩余令牌及通过 set_rate_limits 设置的限制保存在缓存目录的 rate_budgets.json 中 """
+    file_name = 'rate_budgets.json'
+    save_interval = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._budgets: Dict[str, RateBudget] = {}
+        self._configured: Dict[str, list] = {}
+        self._saved = None
+        self._last_save = 0
+
+    def _load(self):
+        if self._saved is not None:
+            return
+        self._saved = {}
+        try:
+            with open(os.path.join(get_cache_dir(), self.file_name), 'r') as f:
+                data = json.load(f)
+            self._saved = data.get('budgets', {})
+            self._configured = {k: [tuple(l) for l in v] for k, v in data.get('configured', {}).items()}
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def get(self, name: str, limits=()) -> RateBudget:
+        budget = self._budgets.get(name)
+        if budget is not None:
+            return budget
+        with self._lock:
+            if name not in self._budgets:
+                self._load()
+                limits = self._configured.get(name, limits)
+                saved = self._saved.get(name, {})
+                same = [tuple(l) for l in saved.get('limits', [])] == [(int(c), float(p)) for c, p in limits or ()]
+                self._budgets[name] = RateBudget(name, limits, saved.get('tokens') if same else None, saved.get('timestamp'))
+            return self._budgets[name]
+
+    def configure(self, name: str, limits):
+        with self._lock:
+            self._load()
+            if limits is None:
+                self._configured.pop(name, None)
+            else:
+                self._configured[name] = [tuple(l) for l in limits]
+            self._budgets.pop(name, None)
+            self._saved.pop(name, None)
+        self.save()
+
+    def saved_later(self):
+        if time.time() - self._last_save > self.save_interval:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if self._saved is None:
+                return
+            self._last_save = time.time()
+            budgets = dict(self._saved)
+            budgets.update({k: b.state() for k, b in self._budgets.items() if b.limits})
+            data = {'budgets': budgets, 'configured': self._configured}
+        try:
+            path = os.path.join(get_cache_dir(), self.file_name)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.debug('save rate budgets failed: %s', e)
+
+    def reset(self):
+        """ 丢弃内存中的预算, 下次使用时重新从缓存目录加载 """
+        with self._lock:
+            self._budgets.clear()
+            self._configured.clear()
+            self._saved = None
+
+
+_rate_budgets = _RateBudgets()
+atexit.register(_rate_budgets.save)
+
+def get_rate_budget(name: str, limits=()) -> RateBudget:
+    '''
+    获取数据源的请求预算
+
+    :param name str: 数据源名称, 如 'eastmoney'
+    :param limits: 数据源声明的默认限制 [(次数, 秒数), ...], 通过 set_rate_limits 设置过的以设置为准
+    '''
+    return _rate_budgets.get(name, limits)
+
+
+def _trading_day(today: Optional[date] = None) -> str:
+    ''' 最近一个交易日 'YYYY-MM-DD', 只跳过周末, 不考虑节假日 '''
+    today = today or date.today()
+    if today.weekday() >= 5:
+        today -= timedelta(days=today.weekday() - 4)
+    return today.isoformat()
+
+# 第 i 个交易分钟(0~239)的结束时间, 即1分钟K线的时间
+MINUTE_END_TIMES = [f'{t // 60:02d}:{t % 60:02d}' for t in list(range(571, 691)) + list(range(781, 901))]
+# 分时数据的241个时间, 09:30 为集合竞价
+TLINE_TIMES = ['09:30'] + MINUTE_END_TIMES
+
 _DEFAULT_ARRAY_FORMAT = 'list'
 def set_array_format(fmt:str):
     '''
-    序列数据(tlines/klines)返回格式，默认返回纯序列，需注意各字段的含义.
+    序列数据(tlines/klines)默认返回格式，默认返回纯序列，需注意各字段的含义.
+    多线程中使用不同格式时应在调用接口时传入 fmt 参数, 而不是修改默认格式.
 
-    :param fmt str: 'list' | 'tuple' | 'dict' = 'json' | 'pd' | 'df' | 'np'
+    :param fmt str: 'list' | 'tuple' | 'dict' = 'json' | 'pd' | 'df' | 'np' | 'record'
+        'record' 时K线的每一项为 Bar 对象, 其他序列(分时/成交明细)为 tuple
     :return str: 旧格式
     '''
     global _DEFAULT_ARRAY_FORMAT
@@ -41,12 +249,52 @@ def set_array_format(fmt:str):
     _DEFAULT_ARRAY_FORMAT = fmt
     return old_fmt
 
-def get_array_format():
-    if _DEFAULT_ARRAY_FORMAT == 'np' and not importlib.util.find_spec("numpy"):
+def get_array_format(fmt:Optional[str]=None):
+    '''
+    :param fmt str: 调用时指定的格式, 为 None 时使用 set_array_format 设置的默认格式
+    :return str: 实际使用的格式, 没有安装 numpy/pandas 时返回 'list'
+    '''
+    fmt = fmt or _DEFAULT_ARRAY_FORMAT
+    if fmt == 'np' and not importlib.util.find_spec("numpy"):
         return 'list'
-    if _DEFAULT_ARRAY_FORMAT in ('pd', 'df') and not importlib.util.find_spec("pandas"):
+    if fmt in ('pd', 'df') and not importlib.util.find_spec("pandas"):
         return 'list'
-    return _DEFAULT_ARRAY_FORMAT
+    return fmt
+
+_DEFAULT_QUOTE_FORMAT = 'dict'
+def set_quote_format(fmt:str):
+    '''
+    行情数据(quotes/quotes5)中每只股票的返回格式
+
+    :param fmt str: 'dict' | 'record', 'record' 时返回 Quote 对象, 可以通过 Quote.to_dict() 转换为dict
+    :return str: 旧格式
+    '''
+    global _DEFAULT_QUOTE_FORMAT
+    if fmt not in ('dict', 'record'):
+        raise ValueError(f"不支持的格式: {fmt}，可选: ['dict', 'record']")
+    old_fmt = _DEFAULT_QUOTE_FORMAT
+    _DEFAULT_QUOTE_FORMAT = fmt
+    return old_fmt
+
+def get_quote_format(fmt:Optional[str]=None):
+    ''' fmt 为调用时指定的格式, 为 None 时使用 set_quote_format 设置的默认格式 '''
+    fmt = fmt or _DEFAULT_QUOTE_FORMAT
+    if fmt not in ('dict', 'record'):
+        raise ValueError(f"不支持的格式: {fmt}，可选: ['dict', 'record']")
+    return fmt
+
+_BJ_HEAD = ("43", "83", "87", "89", "92")
+_SH_HEAD = ("5", "6", "7", "9", "110", "113", "118", "132", "204")
+
+def _build_prefix_market():
+    table = {}
+    for i in range(1000):
+        head = f'{i:03d}'
+        table[head] = 'bj' if head.startswith(_BJ_HEAD) else 'sh' if head.startswith(_SH_HEAD) else 'sz'
+    return table
+
+# 6位代码前3位 -> 市场, 规则中的前缀最长为3位
+_PREFIX_MARKET = _build_prefix_market()
 
 def get_fullcode(stock_code):
     """判断股票ID对应的证券市场
@@ -67,13 +315,39 @@ def get_fullcode(stock_code):
         return stock_code
 
     assert len(stock_code) == 6, "stock code length should be 6"
-    bj_head = ("43", "83", "87", "89", "92")
-    sh_head = ("5", "6", "7", "9", "110", "113", "118", "132", "204")
-    if stock_code.startswith(bj_head):
-        return f"bj{stock_code}"
-    elif stock_code.startswith(sh_head):
-        return f"sh{stock_code}"
-    return f"sz{stock_code}"
+    return _PREFIX_MARKET.get(stock_code[:3], 'sz') + stock_code
+
+def get_fullcodes(stock_codes: List[str]) -> List[str]:
+    """批量转换为完整代码, 结果与逐个调用 get_fullcode 相同
+
+    代码较多且安装了 numpy 时6位数字代码使用向量化的方式转换.
+
+    :param stock_codes list: 股票代码列表
+    :return list: 以 'sz', 'sh', 'bj' 开头的股票代码列表
+    """
+    if len(stock_codes) >= 2000 and importlib.util.find_spec("numpy"):
+        return _get_fullcodes_np(stock_codes)
+    prefix = _PREFIX_MARKET
+    return [
+        prefix[code[:3]] + code if len(code) == 6 and code.isdigit() else get_fullcode(code)
+        for code in stock_codes
+    ]
+
+@lru_cache(maxsize=1)
+def _prefix_market_array():
+    return np.array([_PREFIX_MARKET[f'{i:03d}'] for i in range(1000)])
+
+def _get_fullcodes_np(stock_codes):
+    arr = np.asarray(stock_codes)
+    if arr.dtype.kind != 'U':
+        return [get_fullcode(c) for c in stock_codes]
+    short = (np.char.str_len(arr) == 6) & np.char.isdigit(arr)
+    heads = arr[short].astype('U3').astype(np.int16)
+    codes = np.char.add(_prefix_market_array()[heads], arr[short]).tolist()
+    if len(codes) == len(stock_codes):
+        return codes
+    it = iter(codes)
+    return [next(it) if s else get_fullcode(c) for c, s in zip(stock_codes, short.tolist())]
 
 def to_int_kltype(kltype: Union[int, str]):
     if kltype is None:
@@ -95,15 +369,97 @@ def to_int_kltype(kltype: Union[int, str]):
     return kltype
 
 
+class _RawQuote:
+    __slots__ = ('parser', 'raw')
+
+    def __init__(self, parser, raw):
+        self.parser = parser
+        self.raw = raw
+
+
+class LazyQuotes(Mapping):
+    '''
+    按需解析的行情结果, 与 dict 的读取接口兼容.
+
+    数据源的响应只按股票切分一次, 每只股票的原始记录在第一次被访问时才解析, 解析结果会被缓存.
+    遍历 keys() / in 判断不会触发解析, 访问 values() / items() 会解析全部股票.
+    '''
+    __slots__ = ('_data', '_converter')
+
+    def __init__(self, data: Optional[Mapping] = None, converter: Optional[Callable] = None):
+        self._data = {}
+        self._converter = converter
+        if data:
+            self.update(data)
+
+    def add(self, code: str, parser: Callable, raw: Any):
+        ''' 添加一只股票的原始记录, parser(raw) 返回该股票的行情dict '''
+        self._data[code] = _RawQuote(parser, raw)
+
+    def __getitem__(self, code):
+        v = self._data[code]
+        if type(v) is _RawQuote:
+            v = v.parser(v.raw)
+            if self._converter is not None:
+                v = self._converter(v)
+            self._data[code] = v
+        return v
+
+    def __contains__(self, code):
+        return code in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self._data)} codes)'
+
+    def update(self, other: Mapping):
+        if isinstance(other, LazyQuotes) and other._converter is self._converter:
+            self._data.update(other._data)
+        elif isinstance(other, LazyQuotes):
+            for code, v in other._data.items():
+                self._data[code] = v if type(v) is _RawQuote or self._converter is None else self._converter(v)
+        else:
+            self._data.update(other if self._converter is None else {c: self._converter(v) for c, v in other.items()})
+
+    @property
+    def converter(self) -> Optional[Callable]:
+        return self._converter
+
+    def convert(self, converter: Callable) -> 'LazyQuotes':
+        ''' 设置解析后的转换函数, 已解析的数据立即转换, 未解析的数据在访问时转换 '''
+        for code, v in self._data.items():
+            if type(v) is not _RawQuote:
+                self._data[code] = converter(v)
+        self._converter = converter
+        return self
+
+    def to_dict(self) -> dict:
+        ''' 解析全部股票并返回普通dict '''
+        return {code: self[code] for code in self._data}
+
+
 class rtbase(abc.ABC):
     # 每次请求的最大股票数
     quote_max_num = 800
     stocklist_page_size = 100
+    # 请求频率限制 [(次数, 秒数), ...], 为空表示不限制, 可以通过 set_rate_limits 修改
+    rate_limits = ()
+    # 成交明细 bs 列中 (主动买, 主动卖) 的值, 其他值为中性盘
+    transaction_bs = (1, 2)
 
     @staticmethod
     def get_fullcode(stock_code):
         return get_fullcode(stock_code)
 
+    @staticmethod
+    def get_fullcodes(stock_codes):
+        return get_fullcodes(stock_codes)
+
     @staticmethod
     def to_int_kltype(kltype: Union[int, str]):
         return to_int_kltype(kltype)
@@ -115,11 +471,23 @@ class rtbase(abc.ABC):
         try:
             resp = requests.get(url, timeout=5)
             if resp.status_code == 200:
-                return int(eval(resp.text.strip()))
+                return int(resp.text.strip().strip('"'))
         except Exception as e:
             logger.error(f"get_market_stock_count error: {str(e)}")
             return 0
 
+    @property
+    def rate_budget(self) -> RateBudget:
+        return get_rate_budget(self.__class__.__name__.lower(), self.rate_limits)
+
+    def set_rate_limits(self, limits):
+        '''
+        设置请求频率限制, 设置会保存在缓存目录中
+
+        :param limits: [(次数, 秒数), ...], 空列表表示不限制, None 表示恢复为数据源声明的默认限制
+        '''
+        _rate_budgets.configure(self.__class__.__name__.lower(), limits)
+
     @property
     @abc.abstractmethod
     def qtapi(self):
@@ -165,24 +533,53 @@ class rtbase(abc.ABC):
             return 0
 
     @abc.abstractmethod
-    def quotes(self, stocks):
+    def quotes(self, stocks, lazy=False, fields=None, fmt=None):
         pass
 
     @abc.abstractmethod
-    def quotes5(self, stocks):
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
         pass
 
     @abc.abstractmethod
-    def tlines(self, stocks):
+    def tlines(self, stocks, fmt=None):
         ''' 分时数据
         '''
         pass
 
+    def tlines_days(self, stocks, days=5, fmt=None):
+        ''' 最近 days 个交易日的分时数据, time 为 'YYYY-MM-DD HH:MM', 不支持的数据源返回 None
+        '''
+        pass
+
+    # 分时数据的列
+    tline_cols = ['time', 'price', 'volume', 'amount', 'avg_price']
+
+    @staticmethod
+    def _tline_start(known: int, total: int) -> int:
+        '''
+        增量解析的起始位置: 已有 known 个点时从最后一个点开始(当前分钟的数据还会变化),
+        数据比已有的少时(新的交易日)从头开始
+        '''
+        start = known - 1
+        return start if 0 < start <= total else 0
+
+    def tline_updates(self, stocks, known: Dict[str, int]) -> Dict[str, List[list]]:
+        '''
+        增量分时数据, 用于 TlineTracker
+
+        :param known: {code: 已有的点数}
+        :return: {code: 从第 known-1 个点开始的数据(list格式)}, 新的交易日从第一个点开始
+        '''
+        data = self.tlines(stocks, fmt='list') or {}
+        return {c: rows[self._tline_start(known.get(c, 0), len(rows)):] for c, rows in data.items()}
+
     @staticmethod
     def format_array_list(
         tlines: list[list],
         cols: Optional[list[str]] = ['time', 'price', 'volume', 'amount'],
-        dtdict: Optional[dict] = {'time': 'U20','volume': 'int64'}
+        dtdict: Optional[dict] = {'time': 'U20','volume': 'int64'},
+        fields: Optional[list[str]] = None,
+        fmt: Optional[str] = None
     ) -> Union[list[dict], tuple[tuple], list[tuple], Any]:
         """将K线/分时数据列表转换为指定格式。
 
@@ -190,15 +587,17 @@ class rtbase(abc.ABC):
             tlines: 输入的K线/分时数据列表，每项为 (time, price, volume, amount)。
             cols: 字段名列表，默认 ['time', 'price', 'volume', 'amount']。
             dtdict: 字段类型字典，默认为 {'time': 'U20', 'volume': 'int64'}。未设置的字段使用float64
+            fields: 需要返回的字段, 默认全部返回, 'time' 总是保留
+            fmt: 返回格式, 默认为 `set_array_format()` 设置的格式
 
         Returns:
-            根据 `get_array_format()` 返回的格式转换后的数据。
+            根据 `get_array_format(fmt)` 返回的格式转换后的数据。
         """
         if not tlines:
             return tlines  # 空数据直接返回
 
-        fmt = get_array_format()
-        supported_fmts = ['list', 'tuple', 'dict', 'json', 'pd', 'df', 'np']
+        fmt = get_array_format(fmt)
+        supported_fmts = ['list', 'tuple', 'dict', 'json', 'pd', 'df', 'np', 'record']
         if fmt not in supported_fmts:
             raise ValueError(f"不支持的格式: {fmt}，可选: {supported_fmts}")
         if len(tlines[0]) != len(cols):
@@ -208,6 +607,12 @@ class rtbase(abc.ABC):
             if len(tlines[i]) != len(cols):
                 tlines[i] = tlines[i][:len(cols)]
 
+        if fields:
+            idx = [i for i, c in enumerate(cols) if c == 'time' or c in fields]
+            if len(idx) < len(cols):
+                tlines = [[tl[i] for i in idx] for tl in tlines]
+                cols = [cols[i] for i in idx]
+
         if fmt == 'list':
             return tlines
         elif fmt == 'tuple':
@@ -222,38 +627,65 @@ class rtbase(abc.ABC):
             for i, tl in enumerate(tlines):
                 arr[i] = tuple(tl)
             return arr
+        elif fmt == 'record':
+            if Bar.accepts(cols):
+                return [Bar.from_row(cols, tl) for tl in tlines]
+            return tuple(tuple(tl) for tl in tlines)
+
+    @staticmethod
+    def project_fields(data: Optional[Dict[str, Any]], fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        """只保留 fields 中的字段, fields 为空时原样返回"""
+        if not fields or not data:
+            return data
+        return {k: data[k] for k in fields if k in data}
+
+    @staticmethod
+    def format_quotes(quotes: Optional[Dict[str, Any]], fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """按 `get_quote_format(fmt)` 转换行情数据, 'record' 时每只股票的行情转换为 Quote 对象
+
+        fields 不为空时只保留其中的字段, LazyQuotes 由数据源在解析时处理 fields
+        """
+        if not quotes:
+            return quotes
+        if fields and not isinstance(quotes, LazyQuotes):
+            quotes = {code: rtbase.project_fields(q, fields) for code, q in quotes.items()}
+        if get_quote_format(fmt) != 'record':
+            return quotes
+        if isinstance(quotes, LazyQuotes):
+            return quotes.convert(Quote.from_dict)
+        return {code: Quote.from_dict(q) for code, q in quotes.items()}
 
     @abc.abstractmethod
-    def mklines(self, stocks, kltype, length=320, fq=0, withqt=False):
+    def mklines(self, stocks, kltype, length=320, fq=0, withqt=False, fields=None, fmt=None):
         '''
         分钟K线数据
         '''
         pass
 
     @abc.abstractmethod
-    def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False):
+    def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False, fields=None, fmt=None):
         ''' 日K线或更大周期K线数据
         '''
         pass
 
-    def fklines(self, stocks, kltype=101, fq=0):
+    def fklines(self, stocks, kltype=101, fq=0, fmt=None):
         ''' 获取全部K线数据
         '''
         pass
 
     @abc.abstractmethod
-    def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+    def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
         pass
 
     @abc.abstractmethod
-    def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+    def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
         pass
 
     @abc.abstractmethod
-    def stock_list(self, market: str = 'all') -> Dict[str, Any]:
+    def stock_list(self, market: str = 'all', fields=None) -> Dict[str, Any]:
         pass
 
-    def transactions(self, stocks, date=None, start=''):
+    def transactions(self, stocks, date=None, start='', fmt=None):
         pass
 
 
@@ -263,7 +695,7 @@ class requestbase(rtbase):
         return get_session(self.__class__.__name__)
 
     @abc.abstractmethod
-    def get_quote_url(self, stocks):
+    def get_quote_url(self, stocks, fields=None):
         pass
 
     @abc.abstractmethod
@@ -271,17 +703,17 @@ class requestbase(rtbase):
         pass
 
     @abc.abstractmethod
-    def get_mkline_url(self, stock, kltype='1', length=320, fq=1):
+    def get_mkline_url(self, stock, kltype='1', length=320, fq=1, fields=None):
         pass
 
     @abc.abstractmethod
-    def get_dkline_url(self, stock, kltype='101', length=320, fq=1):
+    def get_dkline_url(self, stock, kltype='101', length=320, fq=1, fields=None):
         pass
 
     def get_fkline_url(self, stock, kltype='101', fq=0):
         pass
 
-    def get_stock_list_url(self, page: int = 1, market: str = 'all'):
+    def get_stock_list_url(self, page: int = 1, market: str = 'all', fields=None):
         pass
 
     def get_transactions_url(self, stock, date=None, start=''):
@@ -299,9 +731,14 @@ class requestbase(rtbase):
         if not isinstance(stocks, (list, tuple)):
             stocks = [stocks]
 
+        if convert_code:
+            # 所有代码(包括分组内的)只转换一次
+            flat = [c for stock in stocks for c in (stock if isinstance(stock, (list, tuple)) else (stock,))]
+            fullcodes = dict(zip(flat, self.get_fullcodes(flat)))
+
         def fetch_single(stock):
             if convert_code:
-                fcode = [self.get_fullcode(s) for s in stock] if isinstance(stock, (list, tuple)) else self.get_fullcode(stock)
+                fcode = [fullcodes[s] for s in stock] if isinstance(stock, (list, tuple)) else fullcodes[stock]
             else:
                 fcode = stock
             url, headers = url_func(fcode, **url_kwargs)
@@ -309,6 +746,7 @@ class requestbase(rtbase):
                 return None
 
             try:
+                self.rate_budget.acquire()
                 data = self.session.get(url, headers=headers)
                 if data and data.text:
                     return [stock, data.text]
@@ -338,28 +776,34 @@ class requestbase(rtbase):
             if results:
                 return format_func(results, **fmt_kwargs)
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, lazy=False, fields=None):
         return dict(rep_data)
 
-    def format_tline_response(self, rep_data):
+    def format_tline_response(self, rep_data, fmt=None):
         return dict(rep_data)
 
-    def format_kline_response(self, rep_data, is_minute=False, withqt=False):
+    def format_kline_response(self, rep_data, is_minute=False, withqt=False, fields=None, fmt=None):
         return dict(rep_data)
 
-    def parse_stock_list(self, rep_data):
+    def parse_stock_list(self, rep_data, fields=None):
         return []
 
+    def _parse_stock_list(self, rep_data, fields=None):
+        stocks = self.parse_stock_list(rep_data, fields=fields)
+        if fields:
+            stocks = [self.project_fields(s, fields) for s in stocks]
+        return stocks
+
     def get_total_count(self, rep_data):
         '''
         :return: 总数，每页数
         '''
         return 0, 100
 
-    def format_stock_list_response(self, rep_data, market='all'):
+    def format_stock_list_response(self, rep_data, market='all', fields=None):
         result = {}
         for pg, rsp in rep_data:
-            result[pg] = self.parse_stock_list(rsp)
+            result[pg] = self._parse_stock_list(rsp, fields)
 
         result_arr = []
         for i in range(1, max(result.keys()) + 1):
@@ -367,81 +811,95 @@ class requestbase(rtbase):
                 result_arr.extend(result[i])
         return {market: result_arr}
 
-    def format_transactions_response(self, rep_data, date=None, start=''):
+    def format_transactions_response(self, rep_data, date=None, start='', fmt=None):
         pass
 
-    def quotes(self, stocks):
+    def quotes(self, stocks, lazy=False, fields=None, fmt=None):
         stocks = self._stock_groups(stocks)
-        return self._fetch_concurrently(stocks, self.get_quote_url, self.format_quote_response)
+        return self.format_quotes(self._fetch_concurrently(
+            stocks, self.get_quote_url, self.format_quote_response, url_kwargs={'fields': fields}, fmt_kwargs={'lazy': lazy, 'fields': fields}
+        ), fields, fmt)
+
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+        return self.quotes(stocks, lazy=lazy, fields=fields, fmt=fmt)
+
+    def tlines(self, stocks, fmt=None):
+        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_response, fmt_kwargs={'fmt': fmt})
 
-    def quotes5(self, stocks):
-        return self.quotes(stocks)
+    def format_tline_updates(self, rep_data, known):
+        ''' 默认解析全部数据后截取, 数据源可以只解析新的点 '''
+        data = self.format_tline_response(rep_data, fmt='list') or {}
+        return {c: rows[self._tline_start(known.get(c, 0), len(rows)):] for c, rows in data.items()}
 
-    def tlines(self, stocks):
-        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_response)
+    def tline_updates(self, stocks, known):
+        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_updates, fmt_kwargs={'known': known})
 
-    def mklines(self, stocks, kltype, length=320, fq=1, withqt=False):
+    def mklines(self, stocks, kltype, length=320, fq=1, withqt=False, fields=None, fmt=None):
         if not self.mklineapi:
             return
         kltype = self.to_int_kltype(kltype)
-        return self._fetch_concurrently(stocks, self.get_mkline_url, self.format_kline_response, url_kwargs={'kltype': kltype, 'length': length, 'fq': fq}, fmt_kwargs={'is_minute': True, 'withqt': withqt})
+        return self._fetch_concurrently(stocks, self.get_mkline_url, self.format_kline_response, url_kwargs={'kltype': kltype, 'length': length, 'fq': fq, 'fields': fields}, fmt_kwargs={'is_minute': True, 'withqt': withqt, 'fields': fields, 'fmt': fmt})
 
-    def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False):
+    def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False, fields=None, fmt=None):
         if not self.dklineapi:
             return
         kltype = self.to_int_kltype(kltype)
-        return self._fetch_concurrently(stocks, self.get_dkline_url, self.format_kline_response, url_kwargs={'kltype': kltype, 'length': length, 'fq': fq}, fmt_kwargs={'is_minute': False, 'fq': fq, 'withqt': withqt})
+        return self._fetch_concurrently(stocks, self.get_dkline_url, self.format_kline_response, url_kwargs={'kltype': kltype, 'length': length, 'fq': fq, 'fields': fields}, fmt_kwargs={'is_minute': False, 'fq': fq, 'withqt': withqt, 'fields': fields, 'fmt': fmt})
 
-    def fklines(self, stocks, kltype=101, fq=0):
+    def fklines(self, stocks, kltype=101, fq=0, fmt=None):
         if not self.fklineapi:
             return
         kltype = self.to_int_kltype(kltype)
-        return self._fetch_concurrently(stocks, self.get_fkline_url, self.format_kline_response, url_kwargs={'kltype': kltype, 'fq': fq}, fmt_kwargs={'is_minute': kltype < 100 or kltype % 15 == 0, 'fq': fq, 'withqt': False})
+        return self._fetch_concurrently(stocks, self.get_fkline_url, self.format_kline_response, url_kwargs={'kltype': kltype, 'fq': fq}, fmt_kwargs={'is_minute': kltype < 100 or kltype % 15 == 0, 'fq': fq, 'withqt': False, 'fmt': fmt})
 
-    def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+    def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
         kltype = self.to_int_kltype(kltype)
         if kltype in [101, 102, 103, 104, 105, 106]:
-            return self.dklines(stocks, kltype=kltype, length=length, fq=fq)
-        return self.mklines(stocks, kltype=kltype, length=length, fq=fq)
+            return self.dklines(stocks, kltype=kltype, length=length, fq=fq, fields=fields, fmt=fmt)
+        return self.mklines(stocks, kltype=kltype, length=length, fq=fq, fields=fields, fmt=fmt)
 
-    def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+    def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
         kltype = self.to_int_kltype(kltype)
         if kltype in [101, 102, 103, 104, 105, 106]:
-            return self.dklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True)
-        return self.mklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True)
+            return self.dklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True, fields=fields, fmt=fmt)
+        return self.mklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True, fields=fields, fmt=fmt)
 
-    def first_page_with_totalcount(self, market='all'):
-        url, headers = self.get_stock_list_url(page=1, market=market)
+    def first_page_with_totalcount(self, market='all', fields=None):
+        url, headers = self.get_stock_list_url(page=1, market=market, fields=fields)
         self.session.headers.update(headers)
+        self.rate_budget.acquire()
         response = self.session.get(url)
         response.raise_for_status()
-        stocks = self.parse_stock_list(response.text)
+        stocks = self._parse_stock_list(response.text, fields)
         total, count = self.get_total_count(response.text)
         if total == 0:
             total = self.get_market_stock_count(market)
             count = len(stocks)
         return stocks, total, count
 
-    def stock_list_for_market(self, market: str = 'all') -> Dict[str, Any]:
-        stocks_1, total, count_1 = self.first_page_with_totalcount(market)
+    def stock_list_for_market(self, market: str = 'all', fields=None) -> Dict[str, Any]:
+        stocks_1, total, count_1 = self.first_page_with_totalcount(market, fields=fields)
         if total <= len(stocks_1):
             return {market: stocks_1}
         if count_1 < self.stocklist_page_size:
             self.stocklist_page_size = count_1
         pages = [i for i in range(2, total // self.stocklist_page_size + 2)]
-        stocks = self._fetch_concurrently(pages, self.get_stock_list_url, self.format_stock_list_response, convert_code=False, url_kwargs={'market': market}, fmt_kwargs={'market': market})
+        stocks = self._fetch_concurrently(pages, self.get_stock_list_url, self.format_stock_list_response, convert_code=False, url_kwargs={'market': market, 'fields': fields}, fmt_kwargs={'market': market, 'fields': fields})
         return {market: stocks_1 + stocks[market]}
 
-    def stock_list(self, market: Union[str, List[str]] = 'all') -> Dict[str, Any]:
+    def stock_list(self, market: Union[str, List[str]] = 'all', fields=None) -> Dict[str, Any]:
+        ''' fields 不为空时只返回其中的字段, 'code' 总是保留 '''
+        if fields:
+            fields = ['code'] + [f for f in fields if f != 'code']
         if isinstance(market, str):
-            return self.stock_list_for_market(market)
+            return self.stock_list_for_market(market, fields=fields)
         result = {}
         for mkt in market:
-            result.update(self.stock_list_for_market(mkt))
+            result.update(self.stock_list_for_market(mkt, fields=fields))
         return result
 
-    def transactions(self, stocks, date=None, start=''):
-        return self._fetch_concurrently(stocks, self.get_transactions_url, self.format_transactions_response, url_kwargs={'date': date, 'start': start}, fmt_kwargs={'date': date, 'start': start})
+    def transactions(self, stocks, date=None, start='', fmt=None):
+        return self._fetch_concurrently(stocks, self.get_transactions_url, self.format_transactions_response, url_kwargs={'date': date, 'start': start}, fmt_kwargs={'date': date, 'start': start, 'fmt': fmt})
 
 class NoneSourcePy(rtbase):
     @property
@@ -460,26 +918,26 @@ class NoneSourcePy(rtbase):
     def dklineapi(self):
         pass
 
-    def quotes(self, stocks):
+    def quotes(self, stocks, lazy=False, fields=None, fmt=None):
         pass
 
-    def quotes5(self, stocks):
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
         pass
 
-    def tlines(self, stocks):
+    def tlines(self, stocks, fmt=None):
         pass
 
-    def mklines(self, stocks, kltype, length=320, fq=1, withqt=False):
+    def mklines(self, stocks, kltype, length=320, fq=1, withqt=False, fields=None, fmt=None):
         pass
 
-    def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False):
+    def dklines(self, stocks, kltype=101, length=320, fq=1, withqt=False, fields=None, fmt=None):
         pass
 
-    def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+    def klines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
         pass
 
-    def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+    def qklines(self, stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields=None, fmt=None) -> Dict[str, Any]:
         pass
 
-    def stock_list(self, market: str = 'all') -> Dict[str, Any]:
+    def stock_list(self, market: str = 'all', fields=None) -> Dict[str, Any]:
         pass
\ No newline at end of file
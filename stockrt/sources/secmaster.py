@@ -0,0 +1,286 @@
+# coding:utf8
+'''
+证券主表
+
+进程内共享的代码表: 完整代码(sh600000) <-> 6位代码 <-> 整数id <-> 市场 <-> 各数据源的代码(东财 secid, 同花顺代码, 财联社 secu_code, 搜狐 cn_/zs_ 等).
+所有查询都是 dict/list 的 O(1) 操作, 第一次遇到的代码会自动登记, 返回的完整代码都是 intern 过的同一个字符串对象.
+整数id在进程内稳定, 可以用作 numpy 数组的下标代替字符串key.
+
+refresh() 从东财获取全部A股的代码/名称/上市日期并保存在缓存目录中, 每个交易日最多请求一次,
+其他进程启动时直接从缓存文件加载. 平时只按上市日期倒序请求新上市的股票, 每隔 full_refresh_days 天完整更新一次(名称变更/退市).
+'''
+import os
+import sys
+import json
+import threading
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from .rtbase import get_fullcode, get_cache_dir, logger, _trading_day
+
+
+class SecurityMaster:
+    cache_file = 'security_master.json'
+    full_refresh_days = 7
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._codes: List[str] = []             # id -> 完整代码
+        self._names: List[Optional[str]] = []   # id -> 名称
+        self._listing_dates: List[Optional[str]] = []  # id -> 上市日期 'YYYYMMDD'
+        self._listed: Dict[int, None] = {}      # 当前上市的A股, 按登记顺序
+        self._updated = ''                      # 上次更新的交易日
+        self._full_updated = ''                 # 上次完整更新的交易日
+        self._cache_loaded = False
+        self._ids: Dict[str, int] = {}          # 各种写法的代码 -> id
+        self._converters: Dict[str, tuple] = {} # 数据源 -> (to_source, from_source)
+        self._src_codes: Dict[str, Dict[int, str]] = {}
+        self._src_ids: Dict[str, Dict[str, int]] = {}
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __contains__(self, code):
+        return code in self._ids
+
+    def _register(self, fcode: str) -> int:
+        with self._lock:
+            sid = self._ids.get(fcode)
+            if sid is not None:
+                return sid
+            fcode = sys.intern(fcode)
+            sid = len(self._codes)
+            self._codes.append(fcode)
+            self._names.append(None)
+            self._listing_dates.append(None)
+            self._ids[fcode] = sid
+            code6 = fcode[2:]
+            if code6 not in self._ids and get_fullcode(code6) == fcode:
+                self._ids[sys.intern(code6)] = sid
+            return sid
+
+    def id(self, code: str) -> int:
+        ''' 代码对应的整数id, 未登记的代码自动登记 '''
+        sid = self._ids.get(code)
+        if sid is None:
+            fcode = get_fullcode(code)
+            sid = self._ids.get(fcode)
+            if sid is None:
+                sid = self._register(fcode)
+            self._ids[code] = sid
+        return sid
+
+    def ids(self, codes: Iterable[str]) -> List[int]:
+        return [self.id(c) for c in codes]
+
+    def code(self, sid: int) -> str:
+        ''' 整数id对应的完整代码 '''
+        return self._codes[sid]
+
+    def codes(self, sids: Iterable[int]) -> List[str]:
+        return [self._codes[i] for i in sids]
+
+    def fullcode(self, code: str) -> str:
+        ''' 与 get_fullcode 相同, 但结果会被缓存且返回 intern 过的字符串 '''
+        return self._codes[self.id(code)]
+
+    def code6(self, code: str) -> str:
+        return self.fullcode(code)[2:]
+
+    def market(self, code: str) -> str:
+        ''' 'sh' | 'sz' | 'bj' '''
+        return self.fullcode(code)[:2]
+
+    def name(self, code: str) -> Optional[str]:
+        return self._names[self.id(code)]
+
+    def listing_date(self, code: str) -> Optional[str]:
+        ''' 上市日期 'YYYYMMDD', 未知时返回 None '''
+        return self._listing_dates[self.id(code)]
+
+    def load(self, stocks: Union[Dict[str, List[Any]], List[Any]], listed: bool = False) -> int:
+        '''
+        从 stock_list 的结果登记代码和名称
+
+        :param stocks: stock_list 的返回值 {market: [{'code':..., 'name':..., 'listing_date':...}, ...]}, 也可以是其中的列表或代码列表
+        :param listed: 是否记为当前上市的A股(出现在 listed/stock_list 的结果中)
+        :return int: 登记的数量
+        '''
+        if isinstance(stocks, dict):
+            stocks = [s for v in stocks.values() for s in v]
+        n = 0
+        for s in stocks:
+            if isinstance(s, str):
+                sid = self.id(s)
+            else:
+                sid = self.id(s['code'])
+                if s.get('name'):
+                    self._names[sid] = s['name']
+                if s.get('listing_date'):
+                    self._listing_dates[sid] = s['listing_date']
+            if listed:
+                self._listed[sid] = None
+            n += 1
+        return n
+
+    @staticmethod
+    def _in_market(fcode: str, market: str) -> bool:
+        if market == 'all':
+            return True
+        if market in ('sha', 'sza', 'bjs'):
+            return fcode[:2] == market[:2]
+        if market == 'kcb':
+            return fcode.startswith('sh68')
+        if market == 'cyb':
+            return fcode.startswith('sz30')
+        return False
+
+    def listed(self, market: str = 'all') -> List[str]:
+        ''' 当前上市的A股代码, market 同 stock_list '''
+        return [c for c in (self._codes[i] for i in self._listed) if self._in_market(c, market)]
+
+    def stock_list(self, market: str = 'all', fields: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        '''
+        与 stock_list 返回格式相同的股票列表, 需要先调用 refresh/load_cache
+
+        :param fields: 'name' / 'listing_date', 'code' 总是返回, None 表示全部
+        '''
+        fields = ['name', 'listing_date'] if fields is None else [f for f in fields if f != 'code']
+        result = []
+        for sid in self._listed:
+            fcode = self._codes[sid]
+            if self._in_market(fcode, market):
+                item = {'code': fcode, 'name': self._names[sid], 'listing_date': self._listing_dates[sid]}
+                result.append({'code': fcode, **{f: item.get(f) for f in fields}})
+        return {market: result}
+
+    @property
+    def cache_path(self) -> str:
+        return os.path.join(get_cache_dir(), self.cache_file)
+
+    def load_cache(self) -> bool:
+        ''' 从缓存目录加载上次 refresh 的结果, 没有缓存时返回 False '''
+        self._cache_loaded = True
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.load([{'code': c, 'name': n, 'listing_date': d} for c, n, d in data.get('stocks', [])], listed=True)
+        self._updated = data.get('updated', '')
+        self._full_updated = data.get('full_updated', '')
+        return True
+
+    def save_cache(self):
+        data = {
+            'updated': self._updated,
+            'full_updated': self._full_updated,
+            'stocks': [[self._codes[i], self._names[i], self._listing_dates[i]] for i in self._listed],
+        }
+        try:
+            with open(self.cache_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(self.cache_path + '.tmp', self.cache_path)
+        except OSError as e:
+            logger.debug('save security master failed: %s', e)
+
+    @staticmethod
+    def _fetch_listing(since: Optional[str] = None) -> List[Dict[str, Any]]:
+        '''
+        从东财获取A股的代码/名称/上市日期(f26)
+
+        :param since: 'YYYYMMDD', 只获取这一天及之后上市的股票(按上市日期倒序请求, 遇到更早的日期即停止), None 表示全部
+        '''
+        from .eastmoney import Em, _em_fullcode
+        def listing_date(s):
+            d = str(s.get('f26', '-'))
+            return d if d.isdigit() else None
+
+        qtcb = None
+        if since:
+            qtcb = lambda page: any((listing_date(s) or '99999999') < since for s in page)
+        data = Em.qt_clist(None, 'f12,f13,f14,f26', 'f26', 1, qtcb)
+        stocks = [{'code': _em_fullcode(f"{s['f13']}.{s['f12']}"), 'name': s['f14'], 'listing_date': listing_date(s)} for s in data]
+        if since:
+            stocks = [s for s in stocks if (s['listing_date'] or '99999999') >= since]
+        return stocks
+
+    def refresh(self, *, force: bool = False) -> int:
+        '''
+        更新当前上市的A股列表, 每个交易日最多从数据源请求一次(force=True 时总是请求), 结果保存在缓存目录中.
+
+        :return int: 本次从数据源获取的股票数量
+        '''
+        with self._refresh_lock:
+            if not self._cache_loaded:
+                self.load_cache()
+            today = _trading_day()
+            if not force and self._updated >= today and self._listed:
+                return 0
+            full = force or not self._listed or not self._full_updated or (
+                date.fromisoformat(today) - date.fromisoformat(self._full_updated)).days >= self.full_refresh_days
+            since = None
+            if not full:
+                dates = [d for d in (self._listing_dates[i] for i in self._listed) if d]
+                since = max(dates) if dates else None
+                full = since is None
+            stocks = self._fetch_listing(since)
+            if not stocks:
+                return 0
+            if full and len(stocks) < len(self._listed) * 0.9:
+                # 请求不完整时不删除已有的股票
+                logger.warning('security master refresh incomplete: %d < %d', len(stocks), len(self._listed))
+                full = False
+            if full:
+                self._listed = {}
+                self._full_updated = today
+            n = self.load(stocks, listed=True)
+            self._updated = today
+            self.save_cache()
+            return n
+
+    def register_source(self, source: str, to_source: Callable[[str], str], from_source: Optional[Callable[[str], str]] = None):
+        '''
+        登记数据源代码的转换规则
+
+        :param source: 数据源名称, 如 'em'
+        :param to_source: 完整代码 -> 数据源代码
+        :param from_source: 数据源代码 -> 完整代码, 用于解析没有通过 source_code 转换过的代码
+        '''
+        with self._lock:
+            self._converters[source] = (to_source, from_source)
+            self._src_codes.setdefault(source, {})
+            self._src_ids.setdefault(source, {})
+
+    def source_code(self, source: str, code: str) -> str:
+        ''' 完整代码/6位代码 -> 数据源代码, 结果会被缓存 '''
+        sid = self.id(code)
+        scodes = self._src_codes[source]
+        scode = scodes.get(sid)
+        if scode is None:
+            scode = sys.intern(self._converters[source][0](self._codes[sid]))
+            scodes[sid] = scode
+            self._src_ids[source][scode] = sid
+        return scode
+
+    def from_source_code(self, source: str, scode: str) -> Optional[str]:
+        ''' 数据源代码 -> 完整代码, 无法识别时返回 None '''
+        sid = self._src_ids[source].get(scode)
+        if sid is not None:
+            return self._codes[sid]
+        from_source = self._converters[source][1]
+        if from_source is None:
+            return None
+        sid = self.id(from_source(scode))
+        self._src_ids[source][scode] = sid
+        return self._codes[sid]
+
+    def index_by_id(self, data: Dict[str, Any]) -> Dict[int, Any]:
+        ''' 将以代码为key的结果转换为以整数id为key '''
+        return {self.id(k): v for k, v in data.items()}
+
+
+_security_master = SecurityMaster()
+
+def get_security_master() -> SecurityMaster:
+    return _security_master
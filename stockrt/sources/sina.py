@@ -2,7 +2,8 @@
 import re
 import time
 import json
-from .rtbase import requestbase, logger
+from functools import partial
+from .rtbase import requestbase, LazyQuotes, logger
 
 """
 reference: https://vip.stock.finance.sina.com.cn/mkt/
@@ -32,6 +33,19 @@ https://money.finance.sina.com.cn/quotes_service/view/CN_TransListV2.php?num=500
 """
 
 
+def _quote_price(stock):
+    price = float(stock[4])
+    if (price == 0 or float(stock[2]) == 0) and (float(stock[12]) > 0 and stock[12] == stock[22]):
+        # 如果价格为0，或者开盘价为0，买1价等于卖1价，是集合竞价
+        price = float(stock[12])
+    return price
+
+
+def _quote_volume(stock):
+    volume = int(stock[9])
+    return volume if volume * float(stock[6]) < float(stock[10]) < volume * float(stock[5]) else volume * 100
+
+
 class Sina(requestbase):
     quote_max_num = 800
     grep_detail = re.compile(
@@ -46,6 +60,44 @@ class Sina(requestbase):
         r"(\w{2}\d+)=\"\";"
     )
 
+    # 行情字段及其转换, 只转换请求的字段
+    quote_fields = {
+        'name': lambda s: s[1],
+        'open': lambda s: float(s[2]),
+        'lclose': lambda s: float(s[3]),
+        'price': lambda s: _quote_price(s),
+        'high': lambda s: float(s[5]),
+        'low': lambda s: float(s[6]),
+        'buy': lambda s: float(s[7]),
+        'sell': lambda s: float(s[8]),
+        'volume': lambda s: _quote_volume(s),
+        'amount': lambda s: float(s[10]),
+        'change': lambda s: (_quote_price(s) - float(s[3])) / float(s[3]),
+        'change_px': lambda s: _quote_price(s) - float(s[3]),
+        'bid1_volume': lambda s: int(s[11]),
+        'bid1': lambda s: float(s[12]),
+        'bid2_volume': lambda s: int(s[13]),
+        'bid2': lambda s: float(s[14]),
+        'bid3_volume': lambda s: int(s[15]),
+        'bid3': lambda s: float(s[16]),
+        'bid4_volume': lambda s: int(s[17]),
+        'bid4': lambda s: float(s[18]),
+        'bid5_volume': lambda s: int(s[19]),
+        'bid5': lambda s: float(s[20]),
+        'ask1_volume': lambda s: int(s[21]),
+        'ask1': lambda s: float(s[22]),
+        'ask2_volume': lambda s: int(s[23]),
+        'ask2': lambda s: float(s[24]),
+        'ask3_volume': lambda s: int(s[25]),
+        'ask3': lambda s: float(s[26]),
+        'ask4_volume': lambda s: int(s[27]),
+        'ask4': lambda s: float(s[28]),
+        'ask5_volume': lambda s: int(s[29]),
+        'ask5': lambda s: float(s[30]),
+        'date': lambda s: s[31],
+        'time': lambda s: s[32],
+    }
+
     def __init__(self):
         super(Sina, self).__init__()
 
@@ -79,12 +131,19 @@ class Sina(requestbase):
             'Referer': 'http://finance.sina.com.cn/'
         }
 
-    def get_quote_url(self, stocks):
+    def get_quote_url(self, stocks, fields=None):
         return self.qtapi % (int(time.time() * 1000), ','.join(stocks)), self._get_headers()
 
-    def format_quote_response(self, rep_data):
-        stocks_detail = "".join([rsp for _, rsp in rep_data])
+    def parse_quote(self, stock, fields=None):
+        if fields is None:
+            return {k: f(stock) for k, f in self.quote_fields.items()}
+        return {k: self.quote_fields[k](stock) for k in fields if k in self.quote_fields}
+
+    def format_quote_response(self, rep_data, lazy=False, fields=None):
         codes = sum([c for c,_ in rep_data], [])
+        if lazy:
+            return self.format_quote_response_lazy(rep_data, codes, fields)
+        stocks_detail = "".join([rsp for _, rsp in rep_data])
         stocks_detail = self.del_null_data_stock.sub('', stocks_detail)
         stocks_detail = stocks_detail.replace(' ', '')
         grep_str = self.grep_detail_with_prefix
@@ -93,64 +152,49 @@ class Sina(requestbase):
         for stock_match_object in result:
             stock = stock_match_object.groups()
             code = stock[0] if stock[0] in codes else stock[0][2:] if stock[0][2:] in codes else stock[0]
-            price = float(stock[4])
-            if (price == 0 or float(stock[2]) == 0) and (float(stock[12]) > 0 and stock[12] == stock[22]):
-                # 如果价格为0，或者开盘价为0，买1价等于卖1价，是集合竞价
-                price = float(stock[12])
-            stock_dict[code] = dict(
-                name=stock[1],
-                open=float(stock[2]),
-                lclose=float(stock[3]),
-                price=price,
-                high=float(stock[5]),
-                low=float(stock[6]),
-                buy=float(stock[7]),
-                sell=float(stock[8]),
-                volume=int(stock[9]) if int(stock[9]) * float(stock[6]) < float(stock[10]) < int(stock[9]) * float(stock[5]) else int(stock[9]) * 100,
-                amount=float(stock[10]),
-                change=(price - float(stock[3])) / float(stock[3]),
-                change_px=price - float(stock[3]),
-                bid1_volume=int(stock[11]),
-                bid1=float(stock[12]),
-                bid2_volume=int(stock[13]),
-                bid2=float(stock[14]),
-                bid3_volume=int(stock[15]),
-                bid3=float(stock[16]),
-                bid4_volume=int(stock[17]),
-                bid4=float(stock[18]),
-                bid5_volume=int(stock[19]),
-                bid5=float(stock[20]),
-                ask1_volume=int(stock[21]),
-                ask1=float(stock[22]),
-                ask2_volume=int(stock[23]),
-                ask2=float(stock[24]),
-                ask3_volume=int(stock[25]),
-                ask3=float(stock[26]),
-                ask4_volume=int(stock[27]),
-                ask4=float(stock[28]),
-                ask5_volume=int(stock[29]),
-                ask5=float(stock[30]),
-                date=stock[31],
-                time=stock[32],
-            )
+            stock_dict[code] = self.parse_quote(stock, fields)
+        return stock_dict
+
+    def format_quote_response_lazy(self, rep_data, codes, fields=None):
+        # 每行形如 var hq_str_sh600000="...";  只切分出字段字符串, 类型转换在访问时才进行
+        # 与非 lazy 时一样, 无法匹配的行(空数据/格式错误)不包含在结果中
+        parser = self.parse_quote if fields is None else partial(self.parse_quote, fields=fields)
+        stock_dict = LazyQuotes()
+        for _, rsp in rep_data:
+            for line in rsp.split('\n'):
+                m = self.grep_detail_with_prefix.search(line.replace(' ', ''))
+                if m is None:
+                    continue
+                stock = m.groups()
+                code = stock[0] if stock[0] in codes else stock[0][2:] if stock[0][2:] in codes else stock[0]
+                stock_dict.add(code, parser, stock)
         return stock_dict
 
     def get_tline_url(self, stock):
         return self.tlineapi % stock, self._get_headers()
 
-    def format_tline_response(self, rep_data):
+    @staticmethod
+    def _tline_rows(data, start=0):
+        return [[d['m'][:-3], float(d['p']), int(d['v']), int(d['v']) * float(d['p']), float(d['avg_p'])] for d in data[start:]]
+
+    def format_tline_response(self, rep_data, fmt=None):
+        result = {}
+        for c, v in rep_data:
+            data = json.loads(v)['result']['data']
+            result[c] = self.format_array_list(self._tline_rows(data), self.tline_cols, fmt=fmt)
+        return result
+
+    def format_tline_updates(self, rep_data, known):
         result = {}
         for c, v in rep_data:
             data = json.loads(v)['result']['data']
-            result[c] = self.format_array_list([
-                [d['m'][:-3], float(d['p']), int(d['v']), int(d['v']) * float(d['p']), float(d['avg_p'])] for d in data],
-                ['time', 'price', 'volume', 'amount', 'avg_price'])
+            result[c] = self._tline_rows(data, self._tline_start(known.get(c, 0), len(data)))
         return result
 
-    def get_mkline_url(self, stock, kltype='1', length=320, fq=0):
+    def get_mkline_url(self, stock, kltype='1', length=320, fq=0, fields=None):
         return self.mklineapi % (stock, kltype, length), self._get_headers()
 
-    def format_kline_response(self, rep_data, is_minute=False, **kwargs):
+    def format_kline_response(self, rep_data, is_minute=False, fields=None, fmt=None, **kwargs):
         result = {}
         kpattern = r'x\((\[.*?\])\);'
         for c, kltxt in rep_data:
@@ -167,21 +211,21 @@ class Sina(requestbase):
                         int(x['volume']),
                         float(x['amount']) if 'amount' in x else float(x['close']) * int(x['volume'])
                     ])
-                result[c] = self.format_array_list(karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'])
+                result[c] = self.format_array_list(karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'], fields=fields, fmt=fmt)
         return result
 
-    def get_dkline_url(self, stock, kltype=101, length=320, fq=0):
+    def get_dkline_url(self, stock, kltype=101, length=320, fq=0, fields=None):
         if fq != 0:
             logger.warning('sina kline api only support fq=0')
         klt2scale = {101: 240, 102: 1200, 103: 7200, 106: 86400}
         assert kltype in klt2scale, f'sina kline api only support {klt2scale.keys()}'
         return self.mklineapi % (stock, klt2scale[kltype], length), self._get_headers()
 
-    def get_stock_list_url(self, page = 1, market = 'all'):
+    def get_stock_list_url(self, page = 1, market = 'all', fields=None):
         market = {'all': 'hs_a', 'sha': 'sh_a', 'sza': 'sz_a', 'kcb': 'kcb', 'cyb': 'cyb', 'bjs': 'hs_bjs'}.get(market, 'hs_a')
         return self.stocklistapi % (page, market), self._get_headers()
 
-    def parse_stock_list(self, rep_data):
+    def parse_stock_list(self, rep_data, fields=None):
         data = json.loads(rep_data)
         return [{
             'code': stock['symbol'],
@@ -201,7 +245,7 @@ class Sina(requestbase):
         url = 'https://money.finance.sina.com.cn/quotes_service/view/CN_TransListV2.php?num=5000&symbol=%s&rn=%d' % (stock, int(time.time() * 1000))
         return url, self._get_headers()
 
-    def format_transactions_response(self, rep_data, date=None, start=''):
+    def format_transactions_response(self, rep_data, date=None, start='', fmt=None):
         reg = re.compile(r'trade_item_list\[\d+\]\s*=\s*new Array\((.*?)\);')
         result = {}
         bsdic = {'UP': 1, 'DOWN': 2, 'EQUAL': 0}
@@ -211,5 +255,5 @@ class Sina(requestbase):
                 items = match.group(1).replace("'", "").split(',')
                 trades.append([items[0], float(items[2]), int(items[1]), bsdic[items[3].strip()]])
             trades.reverse()
-            result[c] = self.format_array_list(trades, ['time', 'price', 'volume', 'bs'])
+            result[c] = self.format_array_list(trades, ['time', 'price', 'volume', 'bs'], fmt=fmt)
         return result
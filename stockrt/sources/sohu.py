@@ -4,7 +4,8 @@ import ast
 import time
 import json
 from datetime import datetime
-from .rtbase import requestbase
+from .rtbase import requestbase, get_fullcode
+from .secmaster import get_security_master
 
 """
 reference: https://q.stock.sohu.com/
@@ -35,6 +36,19 @@ https://hq.stock.sohu.com/cn/030/cn_600030-3-1.html?_=1766659268279
 """
 
 
+def _sohu_code(fcode):
+    # 指数使用 zs_ 前缀, 其他使用 cn_ 前缀
+    return f'zs_{fcode[2:]}' if fcode.startswith(('sh00', 'sz399')) else f'cn_{fcode[2:]}'
+
+def _sohu_fullcode(cncode):
+    code = cncode[-6:]
+    if cncode.startswith('zs_'):
+        return f'sh{code}' if code.startswith('00') else f'sz{code}'
+    return get_fullcode(code)
+
+get_security_master().register_source('sohu', _sohu_code, _sohu_fullcode)
+
+
 class Sohu(requestbase):
     @property
     def qtapi(self):
@@ -80,25 +94,19 @@ class Sohu(requestbase):
         return f'zs_{fcode[2:]}'
 
     def get_cnzs_code(self, stock):
-        if stock.startswith(('sh00', 'sz399')):
-            cnzs = 'zs'
-            cncode = self.get_zscode(stock)
-        else:
-            cnzs = 'cn'
-            cncode = self.get_cncode(stock)
-        return cnzs, cncode
-
-    def get_quote_url(self, stocks):
-        cncodes = [self.get_zscode(s) if s.startswith(('sh00', 'sz399')) else self.get_cncode(s) for s in stocks]
+        cncode = get_security_master().source_code('sohu', stock)
+        return cncode[:2], cncode
+
+    def get_quote_url(self, stocks, fields=None):
+        cncodes = [get_security_master().source_code('sohu', s) for s in stocks]
         return self.qtapi % ','.join(cncodes), self._get_headers()
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, **kwargs):
         result = {}
         for codes, resp in rep_data:
             data = json.loads(resp)
             for stock in data:
-                code = stock[-6:]
-                fcode = self.get_fullcode(code)
+                fcode = get_security_master().from_source_code('sohu', stock)
                 code = fcode if fcode in codes else fcode[-6:] if fcode[-6:] in codes else fcode
                 result[code] = {
                     'name': data[stock][1],
@@ -128,8 +136,8 @@ class Sohu(requestbase):
         cncode = self.get_cncode(stock)
         return self.qt5api % (cncode[-3:], cncode), self._get_headers()
 
-    def quotes5(self, stocks):
-        return self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response)
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+        return self.format_quotes(self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response), fields, fmt)
 
     def parse_jsonp(self, jsonp):
         dict_str = re.search(r'\((\[{.*}\]|\[.*\]|\{.*\})\);?$', jsonp).group(1)
@@ -172,7 +180,7 @@ class Sohu(requestbase):
         cnzs, cncode = self.get_cnzs_code(stock)
         return self.tlineapi % (cnzs, cncode[-3:], cncode), self._get_headers()
 
-    def format_tline_response(self, rep_data):
+    def format_tline_response(self, rep_data, fmt=None):
         result = {}
         for c, v in rep_data:
             data = self.parse_jsonp(v)
@@ -187,17 +195,17 @@ class Sohu(requestbase):
                     tline.append([d[0], float(d[1]), int(float(d[2])*100)])
                 else:
                     tline.append([d[0], float(d[1]), int(d[3])*100, float(d[4])*10000, float(d[2])])
-            result[c] = self.format_array_list(tline, cols)
+            result[c] = self.format_array_list(tline, cols, fmt=fmt)
         return result
 
-    def get_mkline_url(self, stock, kltype='5', length=320, fq=1):
+    def get_mkline_url(self, stock, kltype='5', length=320, fq=1, fields=None):
         klt = self.to_int_kltype(kltype)
         if klt not in [5, 15, 30, 60]:
             raise ValueError("Invalid period for Sohu MKLine API")
         cnzs, cncode = self.get_cnzs_code(stock)
         return self.mklineapi % (cnzs, cncode[-3:], cncode, klt), self._get_headers()
 
-    def get_dkline_url(self, stock, kltype='101', length=320, fq=1):
+    def get_dkline_url(self, stock, kltype='101', length=320, fq=1, fields=None):
         klt = self.to_int_kltype(kltype)
         if klt not in [101, 102, 103]:  # 101: 日K, 102: 周K, 103: 月K
             raise ValueError("Invalid kltype for Sohu DKLine API")
@@ -208,7 +216,7 @@ class Sohu(requestbase):
     def get_fkline_url(self, stock, kltype='101', fq=0):
         return self.get_dkline_url(stock, kltype, fq=fq)
 
-    def format_mkline_response(self, rep_data, fq=0, **kwargs):
+    def format_mkline_response(self, rep_data, fq=0, fields=None, fmt=None, **kwargs):
         result = {}
         year = str(datetime.now().year)[0:2]
         for c, v in rep_data:
@@ -244,11 +252,12 @@ class Sohu(requestbase):
                         float(d[6].strip('%')) / 100,  # change
                         float(d[7]),  # change_px
                     ])
-            result[c] = self.format_array_list(karr, cols)
+            result[c] = self.format_array_list(karr, cols, fields=fields, fmt=fmt)
+        return result
 
-    def format_kline_response(self, rep_data, is_minute=False, fq=0, **kwargs):
+    def format_kline_response(self, rep_data, is_minute=False, fq=0, fields=None, fmt=None, **kwargs):
         if is_minute:
-            return self.format_mkline_response(rep_data, fq=fq, **kwargs)
+            return self.format_mkline_response(rep_data, fq=fq, fields=fields, fmt=fmt, **kwargs)
         result = {}
         dkey = 'dataBasic' if fq == 0 else 'dataDiv'
         for c, v in rep_data:
@@ -270,6 +279,6 @@ class Sohu(requestbase):
                     float(d[8]),  # change_px
                 ])
             result[c] = self.format_array_list(
-                karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'change', 'change_px']
+                karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'change', 'change_px'], fields=fields, fmt=fmt
             )
         return result
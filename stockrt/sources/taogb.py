@@ -52,12 +52,12 @@ class Taogb(requestbase):
             'Referer': 'https://www.tgb.cn/'
         }
 
-    def get_quote_url(self, stocks):
+    def get_quote_url(self, stocks, fields=None):
         # stocks: list of codes like ['sz002235', 'sh601162']
         stock_list_str = json.dumps([self.get_fullcode(s) for s in stocks])
         return self.qtapi % stock_list_str, self._get_headers()
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, **kwargs):
         # rep_data: list of (codes, response_text)
         result = {}
         for codes, resp in rep_data:
@@ -91,8 +91,8 @@ class Taogb(requestbase):
         # 单只股票买卖5档
         return self.qt5api % self.get_fullcode(stock), self._get_headers()
 
-    def quotes5(self, stocks):
-        return self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response)
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+        return self.format_quotes(self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response), fields, fmt)
 
     def format_quote5_response(self, rep_data):
         result = {}
@@ -131,7 +131,7 @@ class Taogb(requestbase):
     def get_tline_url(self, stock):
         return self.tlineapi % stock, self._get_headers()
 
-    def format_tline_response(self, rep_data):
+    def format_tline_response(self, rep_data, fmt=None):
         result = {}
         for c, v in rep_data:
             data = json.loads(v)
@@ -150,13 +150,13 @@ class Taogb(requestbase):
                     float(parts[2]) * 100 if c.startswith(('sh00', 'sz399')) else float(parts[2]), # volume
                     float(parts[3]),         # amount
                 ])
-            result[c] = self.format_array_list(tline, ['time', 'price', 'volume', 'amount'])
+            result[c] = self.format_array_list(tline, ['time', 'price', 'volume', 'amount'], fmt=fmt)
         return result
 
-    def get_mkline_url(self, stock, kltype='1', length=320, fq=1):
+    def get_mkline_url(self, stock, kltype='1', length=320, fq=1, fields=None):
         pass
 
-    def get_dkline_url(self, stock, kltype='d', length=320, fq=1):
+    def get_dkline_url(self, stock, kltype='d', length=320, fq=1, fields=None):
         # kltype: 'd' for 日K, 'w' for 周K, 'm' for 月K
         # Only 日K supported in this example
         kltype = self.to_int_kltype(kltype)
@@ -164,7 +164,7 @@ class Taogb(requestbase):
             raise ValueError("Only 日K (101) is supported in TGB.")
         return self.dklineapi % self.get_fullcode(stock), self._get_headers()
 
-    def format_kline_response(self, rep_data, is_minute=False, fq=0, **kwargs):
+    def format_kline_response(self, rep_data, is_minute=False, fq=0, fields=None, fmt=None, **kwargs):
         result = {}
         for c, v in rep_data:
             m = re.search(r'var\s+\w+\s*=\s*(\[[^\]]*\]);', v)
@@ -189,7 +189,7 @@ class Taogb(requestbase):
                     float(parts[3]) - float(parts[1]),  # change_px
                 ])
             result[c] = self.format_array_list(
-                karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'change', 'change_px']
+                karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'change', 'change_px'], fields=fields, fmt=fmt
             )
         return result
 
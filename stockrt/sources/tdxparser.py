@@ -0,0 +1,374 @@
+# coding:utf8
+'''
+TDX 响应包解码和请求流水线
+
+pytdx 将每一根K线/每一条行情/每一笔成交都解码为 OrderedDict, SrcTdx 再把这些 dict 转换为列表, 数据量大时这两次构造占用了大部分CPU.
+这里继承 pytdx 的命令类, 只替换 parseResponse, 直接从解压后的响应包读取:
+    - K线: numpy 结构化数组, 价格差分累加和成交量/成交额的解码都是向量化的
+    - 行情: 与 SrcTdx.format_quote_response 相同的 dict
+    - 成交明细: 与 SrcTdx.format_transaction_response 相同的行
+只在 SrcTdx.native 为 True 时使用.
+
+pytdx 每个请求都要等待响应之后才发送下一个, TdxNativeHq_API.pipeline 和 AsyncTdxClient 在同一个连接上连续发送多个请求,
+服务器按发送顺序返回响应(0x10字节的头 <IIIHH, 最后两个字段为压缩后/压缩前的长度, 长度不同时包体为zlib压缩),
+按顺序与请求对应即可.
+这里的模块依赖 pytdx, 只能在 pytdx 已安装时导入.
+'''
+import zlib
+import struct
+import asyncio
+from collections import deque
+import numpy as np
+from pytdx.hq import TdxHq_API
+from pytdx.errors import TdxConnectionError
+from pytdx.base_socket_client import update_last_ack_time
+from pytdx.parser.base import RSP_HEADER_LEN, ResponseRecvFails
+from pytdx.parser.setup_commands import SetupCmd1, SetupCmd2, SetupCmd3
+from pytdx.parser.get_security_bars import GetSecurityBarsCmd
+from pytdx.parser.get_security_quotes import GetSecurityQuotesCmd
+from pytdx.parser.get_transaction_data import GetTransactionData
+from pytdx.parser.get_history_transaction_data import GetHistoryTransactionData
+
+
+BAR_DTYPE = np.dtype([
+    ('time', 'U20'), ('open', 'float64'), ('close', 'float64'), ('high', 'float64'), ('low', 'float64'),
+    ('volume', 'float64'), ('amount', 'float64'),
+])
+
+_RSP_HEADER = struct.Struct('<IIIHH')
+_unpack_H = struct.Struct('<H').unpack_from
+_unpack_I = struct.Struct('<I').unpack_from
+_unpack_II = struct.Struct('<II').unpack_from
+_unpack_B6sH = struct.Struct('<B6sH').unpack_from
+
+
+def read_prices(buf, pos, n, out):
+    ''' 连续读取 n 个 pytdx.helper.get_price 格式的变长整数追加到 out, 返回新的 pos '''
+    for _ in range(n):
+        b = buf[pos]
+        pos += 1
+        v = b & 0x3f
+        neg = b & 0x40
+        if b & 0x80:
+            shift = 6
+            while True:
+                b = buf[pos]
+                pos += 1
+                v += (b & 0x7f) << shift
+                shift += 7
+                if not b & 0x80:
+                    break
+        out.append(-v if neg else v)
+    return pos
+
+
+def get_volumes(raw) -> np.ndarray:
+    ''' pytdx.helper.get_volume 的向量化版本, 计算顺序相同, 结果完全一致 '''
+    raw = np.asarray(raw, dtype=np.int64)
+    logpoint = raw >> 24
+    hleax = (raw >> 16) & 0xff
+    lheax = (raw >> 8) & 0xff
+    lleax = raw & 0xff
+
+    ecx = logpoint * 2 - 0x7f
+    edx = logpoint * 2 - 0x86
+    esi = logpoint * 2 - 0x8e
+    eax = logpoint * 2 - 0x96
+
+    xmm6 = np.ldexp(1.0, ecx)
+    xmm4 = np.where(
+        hleax > 0x80,
+        np.ldexp(1.0, edx) * 128.0 + (hleax & 0x7f) * np.ldexp(1.0, edx + 1),
+        np.ldexp(1.0, np.abs(edx)) * hleax)
+    xmm3 = np.ldexp(1.0, esi) * lheax
+    xmm1 = np.ldexp(1.0, eax) * lleax
+    high = (hleax & 0x80) != 0
+    xmm3 = np.where(high, xmm3 * 2.0, xmm3)
+    xmm1 = np.where(high, xmm1 * 2.0, xmm1)
+    return xmm6 + xmm4 + xmm3 + xmm1
+
+
+def decode_bars(body, category) -> np.ndarray:
+    ''' 解码 get_security_bars 的响应, 返回 BAR_DTYPE 数组 '''
+    (count,) = _unpack_H(body, 0)
+    pos = 2
+    dates = []
+    diffs = []
+    vols = []
+    for _ in range(count):
+        dates.append(_unpack_I(body, pos)[0])
+        pos = read_prices(body, pos + 4, 4, diffs)
+        vols.extend(_unpack_II(body, pos))
+        pos += 8
+
+    arr = np.empty(count, dtype=BAR_DTYPE)
+    if count == 0:
+        return arr
+
+    d = np.array(diffs, dtype=np.int64).reshape(-1, 4)
+    # 开盘价为相对上一根K线(开盘价+收盘价差)的差分, 其余价格为相对本K线开盘价的差分
+    base = np.cumsum(d[:, 0])
+    base[1:] += np.cumsum(d[:-1, 1])
+    arr['open'] = base / 1000
+    arr['close'] = (base + d[:, 1]) / 1000
+    arr['high'] = (base + d[:, 2]) / 1000
+    arr['low'] = (base + d[:, 3]) / 1000
+    v = get_volumes(np.array(vols, dtype=np.int64).reshape(-1, 2))
+    arr['volume'] = v[:, 0]
+    arr['amount'] = v[:, 1]
+
+    raw = np.array(dates, dtype=np.int64)
+    if category < 4 or category == 7 or category == 8:
+        zipday = raw & 0xffff
+        tminutes = raw >> 16
+        year = (zipday >> 11) + 2004
+        month = (zipday % 2048) // 100
+        day = (zipday % 2048) % 100
+        hour = tminutes // 60
+        minute = tminutes % 60
+        arr['time'] = ['%d-%02d-%02d %02d:%02d' % t for t in zip(
+            year.tolist(), month.tolist(), day.tolist(), hour.tolist(), minute.tolist())]
+    else:
+        arr['time'] = ['%d-%02d-%02d 15:00' % (z // 10000, z % 10000 // 100, z % 100) for z in raw.tolist()]
+    return arr
+
+
+class SecurityBarsCmd(GetSecurityBarsCmd):
+    def parseResponse(self, body_buf):
+        return decode_bars(body_buf, self.category)
+
+
+class SecurityQuotesCmd(GetSecurityQuotesCmd):
+    def parseResponse(self, body_buf):
+        ''' 返回 [(market, code, quote), ...], quote 与 SrcTdx.format_quote_response 的值相同 '''
+        (num_stock,) = _unpack_H(body_buf, 2)
+        pos = 4
+        stocks = []
+        for _ in range(num_stock):
+            market, code, _ = _unpack_B6sH(body_buf, pos)
+            head = []
+            pos = read_prices(body_buf, pos + 9, 9, head)
+            (amount_raw,) = _unpack_I(body_buf, pos)
+            book = []
+            pos = read_prices(body_buf, pos + 4, 24, book)
+            pos = read_prices(body_buf, pos + 2, 4, [])
+            pos += 4
+
+            price, lc_diff, open_diff, high_diff, low_diff, rb0, _, vol, _ = head
+            p = price / 100
+            lclose = (price + lc_diff) / 100
+            quote = {
+                'price': p,
+                'change': (p - lclose) / lclose,
+                'change_px': p - lclose,
+                'volume': vol * 100,
+                'amount': float(get_volumes(amount_raw)),
+                'high': (price + high_diff) / 100,
+                'low': (price + low_diff) / 100,
+                'open': (price + open_diff) / 100,
+                'lclose': lclose,
+                'time': self._format_time('%s' % rb0).split('.')[0],
+            }
+            # book: s_vol, b_vol, 2个保留字段, 之后每档依次为 bid, ask, bid_vol, ask_vol
+            for i in range(5):
+                bid, ask, bid_vol, ask_vol = book[4 + i * 4: 8 + i * 4]
+                quote[f'bid{i + 1}'] = (price + bid) / 100
+                quote[f'ask{i + 1}'] = (price + ask) / 100
+                quote[f'bid{i + 1}_volume'] = bid_vol * 100
+                quote[f'ask{i + 1}_volume'] = ask_vol * 100
+            stocks.append((market, code.decode('utf-8'), quote))
+        return stocks
+
+
+def _decode_transactions(body_buf, pos, count, nvar):
+    times = []
+    values = []
+    for _ in range(count):
+        (tminutes,) = _unpack_H(body_buf, pos)
+        times.append('%02d:%02d' % (tminutes // 60, tminutes % 60))
+        pos = read_prices(body_buf, pos + 2, nvar, values)
+    if count == 0:
+        return []
+    v = np.array(values, dtype=np.int64).reshape(-1, nvar)
+    prices = (np.cumsum(v[:, 0]) / 100).tolist()
+    vols = (v[:, 1] * 100).tolist()
+    if nvar == 5:
+        return [list(r) for r in zip(times, prices, vols, v[:, 2].tolist(), v[:, 3].tolist())]
+    return [list(r) for r in zip(times, prices, vols, v[:, 2].tolist())]
+
+
+class TransactionCmd(GetTransactionData):
+    def parseResponse(self, body_buf):
+        ''' 返回 [[time, price, volume, num, bs], ...] '''
+        (count,) = _unpack_H(body_buf, 0)
+        return _decode_transactions(body_buf, 2, count, 5)
+
+
+class HistoryTransactionCmd(GetHistoryTransactionData):
+    def parseResponse(self, body_buf):
+        ''' 返回 [[time, price, volume, bs], ...] '''
+        (count,) = _unpack_H(body_buf, 0)
+        return _decode_transactions(body_buf, 6, count, 4)
+
+
+class TdxNativeHq_API(TdxHq_API):
+    '''
+    增加使用上面的解码器的接口, 其他接口与 TdxHq_API 相同
+    '''
+    @update_last_ack_time
+    def get_security_bars_np(self, category, market, code, start, count):
+        cmd = SecurityBarsCmd(self.client, lock=self.lock)
+        cmd.setParams(category, market, code, start, count)
+        return cmd.call_api()
+
+    @update_last_ack_time
+    def get_security_quotes_fast(self, all_stock):
+        cmd = SecurityQuotesCmd(self.client, lock=self.lock)
+        cmd.setParams(all_stock)
+        return cmd.call_api()
+
+    @update_last_ack_time
+    def get_transaction_rows(self, market, code, start, count):
+        cmd = TransactionCmd(self.client, lock=self.lock)
+        cmd.setParams(market, code, start, count)
+        return cmd.call_api()
+
+    @update_last_ack_time
+    def get_history_transaction_rows(self, market, code, start, count, date):
+        cmd = HistoryTransactionCmd(self.client, lock=self.lock)
+        cmd.setParams(market, code, start, count, date)
+        return cmd.call_api()
+
+    @update_last_ack_time
+    def pipeline(self, requests, depth=8):
+        """
+        在当前连接上流水线发送请求, 最多 depth 个请求同时等待响应
+
+        :param requests: [(命令类, 参数元组), ...], 命令类为 pytdx 的命令类或上面的命令类
+        :return: 与 requests 顺序相同的结果列表, 出错时关闭连接
+        """
+        cmds = [_make_cmd(cmd_cls, params) for cmd_cls, params in requests]
+        results = []
+        sent = 0
+        try:
+            for i, cmd in enumerate(cmds):
+                while sent < len(cmds) and sent - i < max(1, depth):
+                    self.client.sendall(cmds[sent].send_pkg)
+                    sent += 1
+                header = _recv_exact(self.client, RSP_HEADER_LEN)
+                _, _, _, zipsize, unzipsize = _RSP_HEADER.unpack(header)
+                results.append(_parse_body(cmd, zipsize, unzipsize, _recv_exact(self.client, zipsize)))
+        except Exception:
+            # 连接上可能还有没读取的响应, 之后的请求会读到错位的数据, 需要重新连接
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+            raise
+        return results
+
+
+def _make_cmd(cmd_cls, params=()):
+    cmd = cmd_cls(None)
+    cmd.setParams(*params)
+    cmd.setup()
+    return cmd
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ResponseRecvFails('接收数据失败, 服务器断开连接')
+        buf.extend(chunk)
+    return buf
+
+
+def _parse_body(cmd, zipsize, unzipsize, body):
+    if zipsize != unzipsize:
+        body = zlib.decompress(body)
+    return cmd.parseResponse(body)
+
+
+class AsyncTdxClient:
+    """
+    asyncio 版本的TDX连接
+
+    call 可以被多个协程并发调用, 请求直接写入连接, 最多 depth 个请求同时等待响应, 由一个读取任务按顺序把响应交给对应的请求.
+    """
+    def __init__(self, host, port=7709, depth=8, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._depth = depth
+        self._sem = None
+        self._pending = deque()
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+
+    @property
+    def is_connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._sem = asyncio.Semaphore(self._depth)
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        for cmd_cls in (SetupCmd1, SetupCmd2, SetupCmd3):
+            await self.call(cmd_cls)
+        return self
+
+    async def close(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        self._fail_pending(TdxConnectionError('连接已关闭'))
+
+    async def call(self, cmd_cls, *params):
+        """发送一个请求并等待结果, 参数与命令类的 setParams 相同"""
+        cmd = _make_cmd(cmd_cls, params)
+        async with self._sem:
+            if not self.is_connected:
+                raise TdxConnectionError(f'未连接 {self.host}:{self.port}')
+            future = asyncio.get_running_loop().create_future()
+            # 写入和登记之间没有 await, 保证 _pending 的顺序与发送顺序一致
+            self._pending.append((cmd, future))
+            self._writer.write(cmd.send_pkg)
+            await self._writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(RSP_HEADER_LEN)
+                _, _, _, zipsize, unzipsize = _RSP_HEADER.unpack(header)
+                body = await self._reader.readexactly(zipsize)
+                if not self._pending:
+                    continue
+                cmd, future = self._pending.popleft()
+                if future.done():
+                    # 等待超时的请求, 丢弃其响应
+                    continue
+                try:
+                    future.set_result(_parse_body(cmd, zipsize, unzipsize, body))
+                except Exception as e:
+                    future.set_exception(e)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._fail_pending(TdxConnectionError(f'{self.host}:{self.port} 连接断开: {e}'))
+
+    def _fail_pending(self, exc):
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exc)
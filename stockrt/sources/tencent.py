@@ -2,8 +2,9 @@
 import re
 import json
 from datetime import datetime
+from functools import partial
 from typing import Optional
-from .rtbase import requestbase, logger
+from .rtbase import requestbase, LazyQuotes, logger
 
 """
 reference: https://stockapp.finance.qq.com/mstats/
@@ -29,10 +30,82 @@ https://stock.gtimg.cn/data/index.php?appn=detail&action=timeline&c=sz300503
 https://stock.gtimg.cn/data/index.php?appn=detail&action=data&c=sz300503&p=0
 """
 
+def _safe_acquire_float(stock: list, idx: int) -> Optional[float]:
+    """
+    There are some securities that only have 50 fields. See example below:
+    ['\nv_sh518801="1',
+    '国泰申赎',
+    '518801',
+    '2.229',
+    ......
+    '', '0.000', '2.452', '2.006', '"']
+    """
+    try:
+        return requestbase._safe_price(stock[idx])
+    except IndexError:
+        return None
+
+
 class Tencent(requestbase):
     quote_max_num = 60
     stocklist_page_size = 200
     grep_stock_code = re.compile(r"(?<=_)\w+")
+    # 行情字段及其转换, 只转换请求的字段
+    quote_fields = {
+        "name": lambda s: s[1],
+        "price": lambda s: float(s[3]),
+        "lclose": lambda s: float(s[4]),
+        "open": lambda s: float(s[5]),
+        # "volume": float(s[6]) * 100, # volume duplicated with 36
+        "bid_volume": lambda s: int(s[7]) * 100,
+        "ask_volume": lambda s: float(s[8]) * 100,
+        "bid1": lambda s: float(s[9]),
+        "bid1_volume": lambda s: int(s[10]) * 100,
+        "bid2": lambda s: float(s[11]),
+        "bid2_volume": lambda s: int(s[12]) * 100,
+        "bid3": lambda s: float(s[13]),
+        "bid3_volume": lambda s: int(s[14]) * 100,
+        "bid4": lambda s: float(s[15]),
+        "bid4_volume": lambda s: int(s[16]) * 100,
+        "bid5": lambda s: float(s[17]),
+        "bid5_volume": lambda s: int(s[18]) * 100,
+        "ask1": lambda s: float(s[19]),
+        "ask1_volume": lambda s: int(s[20]) * 100,
+        "ask2": lambda s: float(s[21]),
+        "ask2_volume": lambda s: int(s[22]) * 100,
+        "ask3": lambda s: float(s[23]),
+        "ask3_volume": lambda s: int(s[24]) * 100,
+        "ask4": lambda s: float(s[25]),
+        "ask4_volume": lambda s: int(s[26]) * 100,
+        "ask5": lambda s: float(s[27]),
+        "ask5_volume": lambda s: int(s[28]) * 100,
+        "最近逐笔成交": lambda s: s[29],
+        "date": lambda s: f"{s[30][0:4]}-{s[30][4:6]}-{s[30][6:8]}",
+        "time": lambda s: f"{s[30][8:10]}:{s[30][10:12]}:{s[30][12:14]}",
+        "change_px": lambda s: float(s[31]),
+        "change": lambda s: float(s[32]) / 100,
+        "high": lambda s: float(s[33]),
+        "low": lambda s: float(s[34]),
+        # "价格/成交量(手)/成交额": s[35],
+        "volume": lambda s: int(s[36]) if s[2].startswith("68") else int(s[36]) * 100,
+        "amount": lambda s: float(s[37]) * 10000,
+        "turnover": lambda s: requestbase._safe_price(s[38]) / 100,
+        "PE": lambda s: requestbase._safe_price(s[39]),
+        # "unknown": s[40],
+        # "high_2": float(s[41]),  # 意义不明
+        # "low_2": float(s[42]),  # 意义不明
+        "amplitude": lambda s: float(s[43]) / 100,
+        "cmc": lambda s: requestbase._safe_price(s[44]) * 1e8, # 流通市值
+        "mc": lambda s: requestbase._safe_price(s[45]) * 1e8, # 总市值
+        "PB": lambda s: float(s[46]),
+        "top_price": lambda s: float(s[47]), # 涨停价
+        "bottom_price": lambda s: float(s[48]), # 跌停价
+        "量比": lambda s: requestbase._safe_price(s[49]),
+        "委差": lambda s: _safe_acquire_float(s, 50),
+        "avg_price": lambda s: _safe_acquire_float(s, 51), # 均价
+        "TTM_PE": lambda s: _safe_acquire_float(s, 52),
+        "市盈(静)": lambda s: _safe_acquire_float(s, 53),
+    }
 
     @property
     def qtapi(self):
@@ -62,129 +135,91 @@ class Tencent(requestbase):
             # https://gu.qq.com/
         }
 
-    def get_quote_url(self, stocks):
+    def get_quote_url(self, stocks, fields=None):
         return self.qtapi % (','.join(stocks)), self._get_headers()
 
-    def parse_quote(self, stock):
-        def _safe_acquire_float(stock: list, idx: int) -> Optional[float]:
-            """
-            There are some securities that only have 50 fields. See example below:
-            ['\nv_sh518801="1',
-            '国泰申赎',
-            '518801',
-            '2.229',
-            ......
-            '', '0.000', '2.452', '2.006', '"']
-            """
-            try:
-                return self._safe_price(stock[idx])
-            except IndexError:
-                return None
-
+    def parse_quote(self, stock, fields=None):
         if float(stock[3]) == 0:
             logger.info("stock %s price is 0, %s" % (stock[1], stock))
-        qdt = datetime.strptime(stock[30], "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
-        qdate, qtime = qdt.split(" ")
-        return {
-            "name": stock[1],
-            "price": float(stock[3]),
-            "lclose": float(stock[4]),
-            "open": float(stock[5]),
-            # "volume": float(stock[6]) * 100, # volume duplicated with 36
-            "bid_volume": int(stock[7]) * 100,
-            "ask_volume": float(stock[8]) * 100,
-            "bid1": float(stock[9]),
-            "bid1_volume": int(stock[10]) * 100,
-            "bid2": float(stock[11]),
-            "bid2_volume": int(stock[12]) * 100,
-            "bid3": float(stock[13]),
-            "bid3_volume": int(stock[14]) * 100,
-            "bid4": float(stock[15]),
-            "bid4_volume": int(stock[16]) * 100,
-            "bid5": float(stock[17]),
-            "bid5_volume": int(stock[18]) * 100,
-            "ask1": float(stock[19]),
-            "ask1_volume": int(stock[20]) * 100,
-            "ask2": float(stock[21]),
-            "ask2_volume": int(stock[22]) * 100,
-            "ask3": float(stock[23]),
-            "ask3_volume": int(stock[24]) * 100,
-            "ask4": float(stock[25]),
-            "ask4_volume": int(stock[26]) * 100,
-            "ask5": float(stock[27]),
-            "ask5_volume": int(stock[28]) * 100,
-            "最近逐笔成交": stock[29],
-            "date": qdate,
-            "time": qtime, # "datetime": datetime.strptime(stock[30], "%Y%m%d%H%M%S"),
-            "change_px": float(stock[31]),
-            "change": float(stock[32]) / 100,
-            "high": float(stock[33]),
-            "low": float(stock[34]),
-            # "价格/成交量(手)/成交额": stock[35],
-            "volume": int(stock[36]) if stock[2].startswith("68") else int(stock[36]) * 100,
-            "amount": float(stock[37]) * 10000,
-            "turnover": self._safe_price(stock[38])/100,
-            "PE": self._safe_price(stock[39]),
-            # "unknown": stock[40],
-            # "high_2": float(stock[41]),  # 意义不明
-            # "low_2": float(stock[42]),  # 意义不明
-            "amplitude": float(stock[43])/100,
-            "cmc": self._safe_price(stock[44]) * 1e8, # 流通市值
-            "mc": self._safe_price(stock[45]) * 1e8, # 总市值
-            "PB": float(stock[46]),
-            "top_price": float(stock[47]), # 涨停价
-            "bottom_price": float(stock[48]), # 跌停价
-            "量比": self._safe_price(stock[49]),
-            "委差": _safe_acquire_float(stock, 50),
-            "avg_price": _safe_acquire_float(stock, 51), # 均价
-            "TTM_PE": _safe_acquire_float(stock, 52),
-            "市盈(静)": _safe_acquire_float(stock, 53),
-        }
+        if fields is None:
+            return {k: f(stock) for k, f in self.quote_fields.items()}
+        return {k: self.quote_fields[k](stock) for k in fields if k in self.quote_fields}
+
+    def parse_quote_detail(self, stock_detail, fields=None):
+        return self.parse_quote(stock_detail.split("~"), fields)
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, lazy=False, fields=None):
         stocks_detail = "".join([rsp for _, rsp in rep_data])
         codes = sum([c for c,_ in rep_data], [])
         stock_details = stocks_detail.split(";")
-        stock_dict = dict()
+        stock_dict = LazyQuotes() if lazy else dict()
+        parser = self.parse_quote_detail if fields is None else partial(self.parse_quote_detail, fields=fields)
         for stock_detail in stock_details:
+            if lazy:
+                # 只取出代码, 字段在访问时才切分和转换
+                if stock_detail.count("~") < 49:
+                    continue
+                s_code = self.grep_stock_code.search(stock_detail[:stock_detail.find("=")]).group()
+                code = s_code if s_code in codes else s_code[2:] if s_code[2:] in codes else s_code
+                stock_dict.add(code, parser, stock_detail)
+                continue
             stock = stock_detail.split("~")
             if len(stock) <= 49:
                 continue
             s_code = self.grep_stock_code.search(stock[0]).group()
             code = s_code if s_code in codes else s_code[2:] if s_code[2:] in codes else s_code
-            stock_dict[code] = self.parse_quote(stock)
+            stock_dict[code] = self.parse_quote(stock, fields)
         return stock_dict
 
     def get_tline_url(self, stock):
         return self.tlineapi % stock, self._get_headers()
 
-    def format_tline_response(self, rep_data):
+    tline_cols = ['time', 'price', 'volume', 'amount']
+
+    def _tline_rows(self, c, data, start=0):
+        ''' 接口返回的成交量/成交额是累计值, 转换为每分钟的值, 从第 start 个点开始时只需要前一个点的累计值 '''
+        scale = 1 if c.startswith(('68', 'sh68')) else 100
+        prev_volume = prev_amount = 0
+        if start > 0:
+            _, _, volume, amount = data[start - 1].split()
+            prev_volume, prev_amount = int(volume) * scale, float(amount)
+        tlobjs = []
+        for d in data[start:]:
+            time, price, volume, amount = d.split()
+            time = time[0:2] + ':' + time[2:]
+            volume = int(volume) * scale
+            amount = float(amount)
+            tlobjs.append([time, float(price), volume - prev_volume, amount - prev_amount])
+            prev_volume, prev_amount = volume, amount  # 更新前一个值
+        return tlobjs
+
+    def _tline_data(self, c, v):
+        return json.loads(v)['data'][self.get_fullcode(c)]['data']['data']
+
+    def format_tline_response(self, rep_data, fmt=None):
+        result = {}
+        for c, v in rep_data:
+            result[c] = self.format_array_list(self._tline_rows(c, self._tline_data(c, v)), self.tline_cols, fmt=fmt)
+        return result
+
+    def format_tline_updates(self, rep_data, known):
         result = {}
         for c, v in rep_data:
-            data = json.loads(v)['data'][self.get_fullcode(c)]['data']['data']
-            tlobjs = []
-            prev_volume = prev_amount = 0
-            for d in data:
-                time, price, volume, amount = d.split()
-                time = time[0:2] + ':' + time[2:]
-                volume = int(volume) if c.startswith(('68', 'sh68')) else int(volume) * 100
-                amount = float(amount)
-                tlobjs.append([time, float(price), volume - prev_volume, amount - prev_amount])
-                prev_volume, prev_amount = volume, amount  # 更新前一个值
-            result[c] = self.format_array_list(tlobjs, ['time', 'price', 'volume', 'amount'])
+            data = self._tline_data(c, v)
+            result[c] = self._tline_rows(c, data, self._tline_start(known.get(c, 0), len(data)))
         return result
 
-    def get_mkline_url(self, stock, kltype=1, length=320, fq=0):
+    def get_mkline_url(self, stock, kltype=1, length=320, fq=0, fields=None):
         return self.mklineapi % (stock, kltype, length), self._get_headers()
 
-    def get_dkline_url(self, stock, kltype=101, length=320, fq=1):
+    def get_dkline_url(self, stock, kltype=101, length=320, fq=1, fields=None):
         if kltype == 105:
             raise NotImplementedError('not available for half year in tencent source')
         kltype = {101: 'day', 102: 'week', 103: 'month', 104: 'season', 106: 'year'}[kltype]
         fqs = {0: '', 1: 'qfq', 2: 'hfq'}
         return self.dklineapi % (stock, kltype, length, fqs[fq]), self._get_headers()
 
-    def format_kline_response(self, rep_data, is_minute=False, withqt=False, **kwargs):
+    def format_kline_response(self, rep_data, is_minute=False, withqt=False, fields=None, fmt=None, **kwargs):
         result = {}
         for c, v in rep_data:
             kdata = json.loads(v)
@@ -203,7 +238,7 @@ class Tencent(requestbase):
                     float(x[1]), float(x[2]), float(x[3]), float(x[4]), int(float(x[5]) if fcode.startswith(('68', 'sh68')) else float(x[5]) * 100),
                     float(x[2]) * int(float(x[5]) * 100)
                 ] for x in kl]
-            klines = self.format_array_list(klines, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'])
+            klines = self.format_array_list(klines, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'], fields=fields, fmt=fmt)
             result[c] = {
                 'klines': klines,
                 'qt': self.parse_quote(kdata['data'][fcode]['qt'][fcode]) if withqt else None
@@ -211,7 +246,7 @@ class Tencent(requestbase):
 
         return result
 
-    def get_stock_list_url(self, page = 1, market = 'all'):
+    def get_stock_list_url(self, page = 1, market = 'all', fields=None):
         offset = (page - 1) * self.stocklist_page_size
         market = {'all': 'aStock', 'cyb': 'cyb', 'kcb':'ksh'}[market]
         return self.stocklistapi % (market, offset, self.stocklist_page_size), self._get_headers()
@@ -220,7 +255,7 @@ class Tencent(requestbase):
         data = json.loads(rep_data)['data']
         return data['total'], len(data['rank_list'])
 
-    def parse_stock_list(self, rep_data):
+    def parse_stock_list(self, rep_data, fields=None):
         data = json.loads(rep_data)['data']['rank_list']
         return [{
             'code': stock['code'],
@@ -237,7 +272,7 @@ class Tencent(requestbase):
         code, fcode, page = stock
         return f'https://stock.gtimg.cn/data/index.php?appn=detail&action=data&c={fcode}&p={page}', self._get_headers()
 
-    def format_transactions_response(self, rep_data, date=None, start=''):
+    def format_transactions_response(self, rep_data, date=None, start='', fmt=None):
         result = {}
         bsdic = {'B': 1, 'S': 2}
         for stock, v in rep_data:
@@ -258,10 +293,10 @@ class Tencent(requestbase):
             trades = []
             for page_trades in v:
                 trades.extend(page_trades)
-            result[c] = self.format_array_list(trades, ['time', 'price', 'volume', 'num', 'bs', 'amount'])
+            result[c] = self.format_array_list(trades, ['time', 'price', 'volume', 'num', 'bs', 'amount'], fmt=fmt)
         return result
 
-    def transactions(self, stocks, date=None, start=''):
+    def transactions(self, stocks, date=None, start='', fmt=None):
         if isinstance(stocks, str):
             stocks = [stocks]
         if isinstance(start, str):
@@ -278,6 +313,7 @@ class Tencent(requestbase):
         for c, s in zip(stocks, arr_start):
             fcode = self.get_fullcode(c)
             tlurl = f'https://stock.gtimg.cn/data/index.php?appn=detail&action=timeline&c={fcode}'
+            self.rate_budget.acquire()
             rsp = self.session.get(tlurl, headers=self._get_headers())
             rsp.raise_for_status()
             rtxt = rsp.text
@@ -288,4 +324,4 @@ class Tencent(requestbase):
                 if tldata[i][1] < s:
                     continue
                 stkpages.append((c, fcode, i))
-        return self._fetch_concurrently(stkpages, self.get_transactions_url, self.format_transactions_response, convert_code=False)
+        return self._fetch_concurrently(stkpages, self.get_transactions_url, self.format_transactions_response, convert_code=False, fmt_kwargs={'fmt': fmt})
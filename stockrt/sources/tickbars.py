@@ -0,0 +1,131 @@
+# coding:utf8
+'''
+由成交明细合成1分钟K线
+
+TickBars 把 transactions 返回的逐笔成交累加为1分钟K线, 除 OHLCV/成交额外还按 bs 统计主动买/主动卖成交量.
+update() 以上次最后一笔成交的时间作为 start 请求新的成交, 与已处理的成交重叠的部分
+(早于该时间的, 以及该时间上已处理的笔数)会被跳过, 只累加新的成交.
+
+分钟划分与 LiveBars/resample_klines 相同: 09:30 之前的集合竞价成交计入第一根, 15:00 的收盘集合竞价计入最后一根.
+'''
+import threading
+from typing import Any, Dict, List, Optional, Union
+from .rtbase import rtbase, _trading_day
+from .livebars import minute_bar_time
+
+
+class TickBars:
+    cols = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'buy_volume', 'sell_volume']
+
+    def __init__(self, source: Union[str, rtbase] = 'tdx', date: Optional[str] = None):
+        '''
+        :param source: 数据源名称或对象, 需要支持 transactions, 同一个对象中 bs 的含义才一致
+        :param date: 'YYYY-MM-DD' 历史日期, None 表示最新交易日(日期变化时自动清空)
+        '''
+        if isinstance(source, str):
+            from ..wrapper import rtsource
+            source = rtsource(source)
+        self.source = source
+        self.date = date
+        self._lock = threading.Lock()
+        self._bars: Dict[str, List[list]] = {}
+        # code -> [最后一笔成交的时间, 该时间已处理的笔数]
+        self._last: Dict[str, list] = {}
+        self._day = date or _trading_day()
+
+    def __contains__(self, code):
+        return code in self._bars
+
+    def __len__(self):
+        return len(self._bars)
+
+    def __getitem__(self, code) -> List[list]:
+        return self._bars[code]
+
+    def codes(self) -> List[str]:
+        return list(self._bars)
+
+    def bars(self, code: str, fmt: Optional[str] = None) -> Any:
+        ''' 全部1分钟K线, fmt 同 set_array_format '''
+        return rtbase.format_array_list(list(self._bars.get(code, [])), self.cols, fmt=fmt)
+
+    def reset(self, code: Optional[str] = None):
+        with self._lock:
+            if code is None:
+                self._bars.clear()
+                self._last.clear()
+            else:
+                self._bars.pop(code, None)
+                self._last.pop(code, None)
+
+    def start(self, code: str) -> str:
+        ''' 下次请求的 start 参数 '''
+        last = self._last.get(code)
+        return last[0] if last else ''
+
+    def add_ticks(self, code: str, ticks: List[Dict[str, Any]]) -> List[list]:
+        '''
+        累加成交明细
+
+        :param ticks: 按时间升序的成交 [{'time':..., 'price':..., 'volume':..., 'bs':..., ['amount':...]}, ...], 可以与已处理的成交重叠
+        :return: 被更新或新建的K线
+        '''
+        buy, sell = self.source.transaction_bs
+        bars = self._bars.setdefault(code, [])
+        last = self._last.setdefault(code, ['', 0])
+        skip = last[1]
+        changed = []
+        for tick in ticks:
+            t = tick['time']
+            if t < last[0]:
+                continue
+            if t == last[0]:
+                if skip:
+                    skip -= 1
+                    continue
+                last[1] += 1
+            else:
+                last[0], last[1] = t, 1
+            price, volume, bs = tick['price'], tick['volume'], tick.get('bs')
+            amount = tick.get('amount') or price * volume
+            label = f'{self._day} {minute_bar_time(1, int(t.replace(":", "")[:4]))}'
+            bar = bars[-1] if bars else None
+            if bar is None or bar[0] != label:
+                bar = [label, price, price, price, price, 0, 0.0, 0, 0]
+                bars.append(bar)
+            bar[2] = price
+            bar[3] = max(bar[3], price)
+            bar[4] = min(bar[4], price)
+            bar[5] += volume
+            bar[6] += amount
+            if bs == buy:
+                bar[7] += volume
+            elif bs == sell:
+                bar[8] += volume
+            if not changed or changed[-1] is not bar:
+                changed.append(bar)
+        return changed
+
+    def update(self, stocks: Union[str, List[str], None] = None) -> Dict[str, List[list]]:
+        '''
+        请求新的成交明细并累加到各股票的K线中
+
+        :param stocks: 股票代码或列表, None 表示已经跟踪的全部股票
+        :return: {code: 被更新或新建的K线}
+        '''
+        if stocks is None:
+            stocks = self.codes()
+        elif isinstance(stocks, str):
+            stocks = [stocks]
+        if self.date is None and _trading_day() != self._day:
+            self.reset()
+            self._day = _trading_day()
+        start = {c: self.start(c) for c in stocks}
+        data = self.source.transactions(stocks, date=self.date, start=start, fmt='dict') or {}
+        result = {}
+        with self._lock:
+            for code in stocks:
+                self._bars.setdefault(code, [])
+            for code, ticks in data.items():
+                result[code] = self.add_ticks(code, ticks or [])
+        return result
@@ -0,0 +1,233 @@
+# coding:utf8
+'''
+多日分时线的本地缓存
+
+已经收盘的交易日的分时数据保存在缓存目录的 tlines/ 下, 每个交易日一个 YYYY-MM-DD.npz 文件:
+codes 为股票代码, data 为 股票数 x 241分钟 x (price, volume, amount, avg_price), 缺少的分钟为 nan, 停牌的股票整天为 nan.
+calendar.json 记录见过的交易日, 用来判断最近 N 个交易日是哪几天.
+
+cached_tlines 只请求缓存中缺少的已收盘交易日及当天的数据, 与缓存拼接后返回.
+'''
+import os
+import json
+import threading
+from datetime import date, datetime, timedelta
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from .rtbase import get_cache_dir, logger, _trading_day, TLINE_TIMES
+
+
+_TIME_INDEX = {t: i for i, t in enumerate(TLINE_TIMES)}
+# 这个时间之后当天的数据视为已经收盘
+SESSION_CLOSED = '15:05'
+
+
+def rows_to_grid(rows: List[list]) -> np.ndarray:
+    ''' 分时数据 [[time, price, volume, amount, avg_price], ...] -> 241 x 4 数组, time 可以带日期 '''
+    grid = np.full((len(TLINE_TIMES), 4), np.nan)
+    for row in rows:
+        i = _TIME_INDEX.get(row[0][-5:])
+        if i is not None:
+            grid[i] = row[1:5]
+    return grid
+
+
+def grid_to_rows(day: str, grid: np.ndarray) -> List[list]:
+    ''' rows_to_grid 的逆运算, time 为 'YYYY-MM-DD HH:MM', 跳过没有数据的分钟 '''
+    return [[f'{day} {t}', price, int(volume), amount, avg_price]
+        for t, (price, volume, amount, avg_price) in zip(TLINE_TIMES, grid.tolist()) if price == price]
+
+
+def split_sessions(rows: List[list]) -> Dict[str, List[list]]:
+    ''' 按日期拆分带日期的分时数据 '''
+    sessions = {}
+    for row in rows:
+        sessions.setdefault(row[0][:10], []).append(row)
+    return sessions
+
+
+class TlineCache:
+    dir_name = 'tlines'
+    calendar_file = 'calendar.json'
+    # 内存中保留的交易日数
+    max_loaded_days = 10
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._days = OrderedDict()
+        self._calendar = None
+        self._checked = ''
+
+    @property
+    def path(self) -> str:
+        path = os.path.join(get_cache_dir(), self.dir_name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _load_calendar(self):
+        if self._calendar is not None:
+            return
+        self._calendar = set()
+        try:
+            with open(os.path.join(self.path, self.calendar_file), 'r') as f:
+                data = json.load(f)
+            self._calendar = set(data.get('days', []))
+            self._checked = data.get('checked', '')
+        except (OSError, ValueError):
+            pass
+
+    def calendar(self) -> List[str]:
+        ''' 见过的交易日 '''
+        with self._lock:
+            self._load_calendar()
+            return sorted(self._calendar)
+
+    @property
+    def checked(self) -> str:
+        ''' 最近一次请求多日数据时的交易日, 当天的日历是完整的 '''
+        with self._lock:
+            self._load_calendar()
+            return self._checked
+
+    def add_days(self, days, checked: Optional[str] = None):
+        with self._lock:
+            self._load_calendar()
+            self._calendar.update(days)
+            if checked:
+                self._checked = checked
+            data = {'days': sorted(self._calendar), 'checked': self._checked}
+        self._write(self.calendar_file, lambda f: f.write(json.dumps(data).encode()))
+
+    def _write(self, name, writer):
+        path = os.path.join(self.path, name)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                writer(f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.debug('save tline cache %s failed: %s', name, e)
+
+    def _load_day(self, day: str):
+        ''' (代码 -> 行号, data), 没有缓存时为 ({}, None) '''
+        with self._lock:
+            if day in self._days:
+                self._days.move_to_end(day)
+                return self._days[day]
+            entry = ({}, None)
+            try:
+                with np.load(os.path.join(self.path, f'{day}.npz')) as npz:
+                    entry = ({c: i for i, c in enumerate(npz['codes'].tolist())}, npz['data'])
+            except (OSError, ValueError, KeyError):
+                pass
+            self._days[day] = entry
+            while len(self._days) > self.max_loaded_days:
+                self._days.popitem(last=False)
+            return entry
+
+    def reset(self):
+        ''' 丢弃内存中的数据, 下次使用时重新从缓存目录加载 '''
+        with self._lock:
+            self._days.clear()
+            self._calendar = None
+            self._checked = ''
+
+    def has(self, day: str, code: str) -> bool:
+        return code in self._load_day(day)[0]
+
+    def get(self, day: str, code: str) -> Optional[np.ndarray]:
+        index, data = self._load_day(day)
+        i = index.get(code)
+        return None if i is None else data[i]
+
+    def put(self, day: str, grids: Dict[str, np.ndarray]):
+        ''' 保存一个已收盘交易日的数据, 已有的股票会被覆盖 '''
+        if not grids:
+            return
+        with self._lock:
+            index, data = self._load_day(day)
+            index = dict(index)
+            data = np.empty((0, len(TLINE_TIMES), 4)) if data is None else data
+            new = [c for c in grids if c not in index]
+            data = np.concatenate([data, np.empty((len(new), len(TLINE_TIMES), 4))])
+            for c in new:
+                index[c] = len(index)
+            for c, grid in grids.items():
+                data[index[c]] = grid
+            self._days[day] = (index, data)
+            codes = np.array(sorted(index, key=index.get))
+        self._write(f'{day}.npz', lambda f: np.savez(f, codes=codes, data=data))
+
+
+_tline_cache = TlineCache()
+
+def get_tline_cache() -> TlineCache:
+    return _tline_cache
+
+
+def cached_tlines(
+    fetch: Callable[[List[str], int], Dict[str, List[list]]],
+    stocks: List[str], days: int, now: Optional[datetime] = None
+) -> Dict[str, List[list]]:
+    '''
+    最近 days 个交易日的分时数据, 已收盘的交易日从缓存读取
+
+    :param fetch: fetch(stocks, n) 请求最近 n 个交易日的分时数据, 返回 {code: [[time('YYYY-MM-DD HH:MM'), price, volume, amount, avg_price], ...]}
+    :return: 与 fetch 相同的格式, 各交易日按时间顺序连接
+    '''
+    now = now or datetime.now()
+    today = now.date().isoformat()
+    live = _trading_day(now.date())
+    cache = get_tline_cache()
+    fetched = {}
+
+    def fetch_and_store(codes, n):
+        data = (fetch(codes, n) or {}) if codes else {}
+        seen = set()
+        for code, rows in data.items():
+            fetched[code] = split_sessions(rows or [])
+            seen.update(fetched[code])
+        if not seen:
+            return
+        latest = max(seen)
+        closed = latest < today or now.strftime('%H:%M') >= SESSION_CLOSED
+        complete = [d for d in sorted(seen)[-n:] if d < latest or closed]
+        for day in complete:
+            # 请求范围内没有数据的股票(停牌)记为全天 nan, 避免重复请求
+            cache.put(day, {c: rows_to_grid(sessions.get(day, [])) for c, sessions in fetched.items() if c in data and sessions})
+        cache.add_days(seen, checked=live if n > 1 else None)
+
+    # 日历不包含上一个交易日时(第一次使用或者节假日之后), 先用一只股票请求多日数据更新日历
+    prev = _trading_day(date.fromisoformat(live) - timedelta(days=1))
+    if stocks and cache.checked != live and not any(prev <= d < live for d in cache.calendar()):
+        fetch_and_store(stocks[:1], days)
+
+    # 每只股票只请求从最早缺少的交易日到当天的数据, 按请求天数分组
+    completed = [d for d in cache.calendar() if d < live][-(days - 1):] if days > 1 else []
+    groups = {}
+    for code in stocks:
+        if code in fetched:
+            continue
+        if len(completed) < days - 1:
+            n = days
+        else:
+            missing = [i for i, d in enumerate(completed) if not cache.has(d, code)]
+            n = len(completed) - missing[0] + 1 if missing else 1
+        groups.setdefault(n, []).append(code)
+    for n, codes in sorted(groups.items(), reverse=True):
+        fetch_and_store(codes, n)
+
+    # 多取一天, 节假日时当天请求到的是上一个交易日
+    window = [d for d in cache.calendar() if d < live][-days:]
+    result = {}
+    for code in stocks:
+        sessions = {}
+        for day in window:
+            grid = cache.get(day, code)
+            if grid is not None:
+                sessions[day] = grid_to_rows(day, grid)
+        sessions.update(fetched.get(code, {}))
+        rows = [row for day in sorted(sessions)[-days:] for row in sessions[day]]
+        if rows:
+            result[code] = rows
+    return result
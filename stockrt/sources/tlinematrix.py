@@ -0,0 +1,102 @@
+# coding:utf8
+'''
+全市场分时矩阵
+
+TlineMatrix 为一组股票预先分配 股票数 x 241分钟 的价格/每分钟成交量矩阵, 列与 rtbase.TLINE_TIMES 对齐, 没有数据的分钟为 nan.
+数据来自财联社的批量分时接口(一次请求 tline_max_num 只股票, 各组并发请求),
+refresh() 只解析并写入每只股票上次之后的新分钟(最后一分钟会被更新), 适合盘中按分钟做截面分析.
+'''
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Union
+import numpy as np
+from .rtbase import rtbase, logger, TLINE_TIMES
+
+
+# HHMM -> 列号, 不是交易分钟的为 -1
+_MINUTE_COLUMN = np.full(1501, -1, dtype=np.int64)
+for _i, _t in enumerate(TLINE_TIMES):
+    _MINUTE_COLUMN[int(_t[:2]) * 100 + int(_t[3:])] = _i
+
+
+class TlineMatrix:
+    def __init__(self, codes: List[str], source: Union[str, rtbase] = 'cls'):
+        '''
+        :param codes: 股票代码列表, 矩阵的行顺序与之相同
+        :param source: 数据源名称或对象, 需要支持 tline_points (财联社)
+        '''
+        if isinstance(source, str):
+            from ..wrapper import rtsource
+            source = rtsource(source)
+        self.source = source
+        self.codes = list(codes)
+        self.index = {c: i for i, c in enumerate(self.codes)}
+        self.times = TLINE_TIMES
+        self.price = np.full((len(self.codes), len(TLINE_TIMES)), np.nan)
+        self.volume = np.full((len(self.codes), len(TLINE_TIMES)), np.nan)
+        self._known = [0] * len(self.codes)
+        self._last = -1
+        self._lock = threading.Lock()
+        self._date = date.today()
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def last(self) -> int:
+        ''' 已有数据的最后一列, 没有数据时为 -1 '''
+        return self._last
+
+    def row(self, code: str) -> int:
+        return self.index[code]
+
+    def reset(self):
+        with self._lock:
+            self.price.fill(np.nan)
+            self.volume.fill(np.nan)
+            self._known = [0] * len(self.codes)
+            self._last = -1
+
+    def _write(self, i: int, total: int, points: List[list]) -> int:
+        ''' 写入一只股票的增量数据, 返回写入的最后一列 '''
+        if self._known[i] > 1 and rtbase._tline_start(self._known[i], total) == 0:
+            # 数据源从头返回(新的交易日)
+            self.price[i] = np.nan
+            self.volume[i] = np.nan
+        self._known[i] = total
+        if not points:
+            return -1
+        arr = np.array(points, dtype=float)
+        cols = _MINUTE_COLUMN[np.clip(arr[:, 0].astype(np.int64), 0, len(_MINUTE_COLUMN) - 1)]
+        valid = cols >= 0
+        cols = cols[valid]
+        self.price[i, cols] = arr[valid, 1]
+        self.volume[i, cols] = arr[valid, 2]
+        return int(cols.max()) if len(cols) else -1
+
+    def refresh(self) -> int:
+        '''
+        请求全部股票的新分时数据并写入矩阵
+
+        :return: 已有数据的最后一列, 即 last
+        '''
+        if date.today() != self._date:
+            self.reset()
+            self._date = date.today()
+        known = dict(zip(self.codes, self._known))
+        data = self.source.tline_points(self.codes, known) or {}
+        with self._lock:
+            last = -1
+            for code, (total, points) in data.items():
+                i = self.index.get(code)
+                if i is None:
+                    logger.debug('tline matrix unknown code: %s', code)
+                    continue
+                last = max(last, self._write(i, total, points))
+            self._last = max(self._last, last)
+            return self._last
+
+    def columns(self, start: int = 0, end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        ''' [start, end) 列的视图, end 默认到 last(含) '''
+        end = self._last + 1 if end is None else end
+        return {'time': np.array(self.times[start:end]), 'price': self.price[:, start:end], 'volume': self.volume[:, start:end]}
@@ -0,0 +1,101 @@
+# coding:utf8
+'''
+分时线跟踪
+
+TlineTracker 保存每只股票当天的分时数据, update() 只解析上次之后的新数据并追加(最后一分钟的数据会被替换),
+适合按分钟轮询大量股票的分时线. 日期变化时自动清空.
+'''
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Union
+from .rtbase import rtbase, logger
+
+
+class TlineTracker:
+    def __init__(self, source: Union[str, rtbase] = 'eastmoney'):
+        '''
+        :param source: 数据源名称(同 rtsource)或数据源对象
+        '''
+        if isinstance(source, str):
+            from ..wrapper import rtsource
+            source = rtsource(source)
+        self.source = source
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[list]] = {}
+        self._date = date.today()
+
+    @property
+    def cols(self) -> List[str]:
+        return self.source.tline_cols
+
+    def __contains__(self, code):
+        return code in self._series
+
+    def __len__(self):
+        return len(self._series)
+
+    def __getitem__(self, code) -> List[list]:
+        return self._series[code]
+
+    def codes(self) -> List[str]:
+        return list(self._series)
+
+    def series(self, code: str, fmt: Optional[str] = None) -> Any:
+        ''' 当天全部的分时数据, fmt 同 set_array_format '''
+        return rtbase.format_array_list(list(self._series.get(code, [])), self.cols, fmt=fmt)
+
+    def reset(self, code: Optional[str] = None):
+        with self._lock:
+            if code is None:
+                self._series.clear()
+            else:
+                self._series.pop(code, None)
+
+    def _merge(self, code: str, known: int, rows: List[list]) -> bool:
+        ''' 合并增量数据, 数据与已有的对不上时返回 False '''
+        series = self._series.setdefault(code, [])
+        if not rows:
+            return True
+        start = known - 1 if 0 < known <= len(series) else 0
+        if start > 0 and rows[0][0] != series[start][0]:
+            if rows[0][0] != series[0][0]:
+                return False
+            # 数据源从头返回(新的交易日)
+            start = 0
+        del series[start:]
+        series.extend(rows)
+        return True
+
+    def update(self, stocks: Union[str, List[str], None] = None) -> Dict[str, List[list]]:
+        '''
+        获取新的分时数据并追加到各股票的序列中
+
+        :param stocks: 股票代码或列表, None 表示已经跟踪的全部股票
+        :return: {code: 新的数据(包括被更新的最后一分钟), list 格式}
+        '''
+        if stocks is None:
+            stocks = self.codes()
+        elif isinstance(stocks, str):
+            stocks = [stocks]
+        if date.today() != self._date:
+            self.reset()
+            self._date = date.today()
+        known = {c: len(self._series.get(c, ())) for c in stocks}
+        data = self.source.tline_updates(stocks, known) or {}
+        result = {}
+        retry = []
+        with self._lock:
+            for code, rows in data.items():
+                if self._merge(code, known.get(code, 0), rows):
+                    result[code] = rows
+                else:
+                    self._series.pop(code, None)
+                    retry.append(code)
+        if retry:
+            logger.debug('tline tracker reload: %s', retry)
+            data = self.source.tline_updates(retry, {}) or {}
+            with self._lock:
+                for code, rows in data.items():
+                    self._series[code] = list(rows)
+                    result[code] = rows
+        return result
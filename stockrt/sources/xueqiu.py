@@ -75,10 +75,10 @@ class Xueqiu(requestbase):
             'Accept': 'application/json'
         }
 
-    def get_quote_url(self, stocks):
+    def get_quote_url(self, stocks, fields=None):
         return self.qtapi % (','.join([self.get_fullcode(s).upper() for s in stocks])), self._get_headers()
 
-    def format_quote_response(self, rep_data):
+    def format_quote_response(self, rep_data, **kwargs):
         stock_dict = dict()
         codes = sum([c for c,_ in rep_data], [])
         items = sum([json.loads(v)['data']['items'] for _,v in rep_data], [])
@@ -108,8 +108,8 @@ class Xueqiu(requestbase):
     def get_quote5_url(self, stock):
         return self.qt5api % self.get_fullcode(stock).upper(), self._get_headers()
 
-    def quotes5(self, stocks):
-        return self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response)
+    def quotes5(self, stocks, lazy=False, fields=None, fmt=None):
+        return self.format_quotes(self._fetch_concurrently(stocks, self.get_quote5_url, self.format_quote5_response), fields, fmt)
 
     def format_quote5_response(self, rep_data):
         stock_dict = dict()
@@ -129,28 +129,48 @@ class Xueqiu(requestbase):
             }
         return stock_dict
 
-    def get_tline_url(self, stock):
-        return self.tlineapi % self.get_fullcode(stock).upper(), self._get_headers()
+    def get_tline_url(self, stock, days=1):
+        url = self.tlineapi % self.get_fullcode(stock).upper()
+        if days > 1:
+            url = url.replace('period=1d', 'period=5d')
+        return url, self._get_headers()
 
-    def format_tline_response(self, rep_data):
+    def format_tline_response(self, rep_data, fmt=None, days=None):
         result = {}
+        tfmt = '%Y-%m-%d %H:%M' if days else '%H:%M'
         for c, v in rep_data:
             data = json.loads(v)['data']['items']
-            tldata = [[datetime.fromtimestamp(d['timestamp'] / 1000).strftime('%H:%M'), d['current'], d['volume'], d['amount'], d['avg_price']] for d in data]
-            for mt in ('09:30', '13:00'):
-                idmt = next((i for i, d in enumerate(tldata) if d[0].endswith(mt)), -1)
-                if idmt >= 0 and idmt + 1 < len(tldata):
-                    tldata[idmt+1][2] += tldata[idmt][2]
-                    tldata[idmt+1][3] += tldata[idmt][3]
-                    tldata.pop(idmt)
-            result[c] = self.format_array_list(tldata, ['time', 'price', 'volume', 'amount', 'avg_price'])
+            tldata = [[datetime.fromtimestamp(d['timestamp'] / 1000).strftime(tfmt), d['current'], d['volume'], d['amount'], d['avg_price']] for d in data]
+            for i in range(len(tldata) - 2, -1, -1):
+                # 同一天的 09:30 / 13:00 合并到下一分钟
+                if tldata[i][0][-5:] in ('09:30', '13:00') and tldata[i][0][:-5] == tldata[i+1][0][:-5]:
+                    tldata[i+1][2] += tldata[i][2]
+                    tldata[i+1][3] += tldata[i][3]
+                    tldata.pop(i)
+            if days:
+                keep = set(sorted({d[0][:10] for d in tldata})[-days:])
+                tldata = [d for d in tldata if d[0][:10] in keep]
+            result[c] = self.format_array_list(tldata, ['time', 'price', 'volume', 'amount', 'avg_price'], fmt=fmt)
         return result
 
-    def get_mkline_url(self, stock, kltype='1', length=320, fq=0):
+    def tlines_days(self, stocks, days=5, fmt=None):
+        ''' period=5d, 最多5天 '''
+        return self._fetch_concurrently(stocks, self.get_tline_url, self.format_tline_response,
+            url_kwargs={'days': days}, fmt_kwargs={'fmt': fmt, 'days': days})
+
+    # K线可以附带的估值指标, 只有在 fields 中指定时才请求
+    kline_indicators = ('pe', 'pb', 'ps', 'pcf', 'market_capital')
+
+    def _kline_indicators(self, fields):
+        return [] if fields is None else [i for i in self.kline_indicators if i in fields]
+
+    def get_mkline_url(self, stock, kltype='1', length=320, fq=0, fields=None):
         fqs = {0: 'normal', 1: 'before', 2: 'after'}
-        return self.mklineapi % (self.get_fullcode(stock).upper(), int(time.time()*1000), f'{kltype}m', fqs[fq], length), self._get_headers()
+        url = self.mklineapi % (self.get_fullcode(stock).upper(), int(time.time()*1000), f'{kltype}m', fqs[fq], length)
+        return url + ''.join(f',{i}' for i in self._kline_indicators(fields)), self._get_headers()
 
-    def format_kline_response(self, rep_data, **kwargs):
+    def format_kline_response(self, rep_data, fields=None, fmt=None, **kwargs):
+        indicators = self._kline_indicators(fields)
         result = {}
         for code, rsp in rep_data:
             data = json.loads(rsp)['data']
@@ -171,24 +191,27 @@ class Xueqiu(requestbase):
                     x[cols['amount']],
                     x[cols['percent']] / 100,
                     x[cols['chg']],
-                    x[cols['turnoverrate']] / 100
+                    x[cols['turnoverrate']] / 100,
+                    *[x[cols[i]] if i in cols else None for i in indicators]
                 ])
             result[code] = self.format_array_list(
-                karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'change', 'change_px', 'turnover']
+                karr, ['time', 'open', 'close', 'high', 'low', 'volume', 'amount', 'change', 'change_px', 'turnover', *indicators],
+                fields=fields, fmt=fmt
             )
         return result
 
-    def get_dkline_url(self, stock, kltype='101', length=320, fq=1):
+    def get_dkline_url(self, stock, kltype='101', length=320, fq=1, fields=None):
         kltype = self.to_int_kltype(kltype)
         if kltype < 100 or kltype % 15 == 0:
-            return self.get_mkline_url(stock, kltype, length)
+            return self.get_mkline_url(stock, kltype, length, fields=fields)
         period = {
             101: 'day', 102: 'week', 103: 'month', 104: 'quarter', 106: 'year'
         }
         fqs = {0: 'normal', 1: 'before', 2: 'after'}
-        return self.dklineapi % (self.get_fullcode(stock).upper(), int(time.time()*1000), period[kltype], fqs[fq], length), self._get_headers()
+        url = self.dklineapi % (self.get_fullcode(stock).upper(), int(time.time()*1000), period[kltype], fqs[fq], length)
+        return url + ''.join(f',{i}' for i in self._kline_indicators(fields)), self._get_headers()
 
-    def get_stock_list_url(self, page = 1, market = 'all'):
+    def get_stock_list_url(self, page = 1, market = 'all', fields=None):
         market = {'all': '', 'sha': 'sha', 'kcb': 'kcb', 'sza': 'sza', 'cyb': 'cyb'}.get(market, '')
         return self.stocklistapi % (page, self.stocklist_page_size, market), self._get_headers()
 
@@ -196,7 +219,7 @@ class Xueqiu(requestbase):
         data = json.loads(rep_data)['data']
         return data['count'], len(data['list'])
 
-    def parse_stock_list(self, rep_data):
+    def parse_stock_list(self, rep_data, fields=None):
         data = json.loads(rep_data)['data']['list']
         return [{
             'code': stock['symbol'].lower(),
@@ -1,11 +1,12 @@
 # coding:utf8
 import math
 import inspect
+import importlib.util
 import traceback
 from functools import lru_cache
 from typing import List, Dict, Any, Optional, Union
 
-from .sources.rtbase import logger, rtbase
+from .sources.rtbase import logger, rtbase, LazyQuotes
 from .sources.sina import Sina
 from .sources.tencent import Tencent
 from .sources.eastmoney import EastMoney
@@ -15,6 +16,13 @@ from .sources.sohu import Sohu
 from .sources.taogb import Taogb
 from .sources.pymtdx import SrcTdx
 from .sources.pymths import SrcThs
+from .sources.secmaster import get_security_master
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+if HAS_NUMPY:
+    from .sources.tlinecache import cached_tlines
+    from .sources.tlinematrix import TlineMatrix
+    from .sources.resample import resample
+TLINE_COLS = ['time', 'price', 'volume', 'amount', 'avg_price']
 
 
 class FetchWrapper(object):
@@ -104,7 +112,8 @@ class FetchWrapper(object):
         # 而quotes/quotes5大部分source都可以一次请求获取多只股票的信息，一般不需要轮换source
         'quotes': ['qtapi', ('tencent', 'cls', 'tgb', 'ths', 'sina', 'xueqiu', 'eastmoney', 'sohu'), False],
         'quotes5': ['qt5api', ('sina', 'tencent', 'ths', 'eastmoney', 'cls', 'sohu', 'tgb'), False],
-        'tlines': ['tlineapi', ('cls', 'sina', 'tencent', 'eastmoney', 'sohu', 'tgb'), False],
+        'tlines': ['tlineapi', ('cls', 'sina', 'tencent', 'eastmoney', 'tdx', 'sohu', 'tgb'), False],
+        'tlines_days': ['tlineapi', ('eastmoney', 'xueqiu'), False],
         'mklines': ['mklineapi', ('tencent', 'ths', 'eastmoney', 'sina'), True],
         'q_mklines': ['mklineapi', ('tencent',),  False], # 只有tencent可以同时获取quotes和kline
         'dklines': ['dklineapi', ('eastmoney', 'tdx', 'xueqiu', 'cls', 'sohu', 'ths', 'tencent'), True],
@@ -155,7 +164,7 @@ class FetchWrapper(object):
             stocks_rem = stocks_list.copy()
             paresult = {}
             while stocks_rem and retry_count < max_retries and len(self._current_sources) > 1:
-                paresult.update(self._parallel_fetch(stocks_rem, *args, **kwargs))
+                paresult = self._merge_result(paresult, self._parallel_fetch(stocks_rem, *args, **kwargs))
                 stocks_rem = [s for s in stocks_rem if s not in paresult]
                 if not stocks_rem:
                     return paresult
@@ -167,7 +176,7 @@ class FetchWrapper(object):
             return paresult
 
         result = {}
-        remaining_sources = self._current_sources.copy()
+        remaining_sources = self._by_budget(self._current_sources)
         while remaining_sources:
             source = remaining_sources.pop(0)
             try:
@@ -184,7 +193,7 @@ class FetchWrapper(object):
                     self._handle_empty_result(source)
                     continue
 
-                result.update(data)
+                result = self._merge_result(result, data)
 
                 # 检查是否已获取全部所需数据
                 if isinstance(stocks, str):
@@ -217,11 +226,12 @@ class FetchWrapper(object):
                 sources = self._current_sources.copy()
             if source_id >= len(sources):
                 source_id = 0
-            source = sources[source_id]
+            # 按轮换顺序, 但跳过预算不足以完成这一批请求的数据源
+            source = self._by_budget(sources[source_id:] + sources[:source_id], self._chunk_size)[0]
             try:
                 data = self._fetch_from_source(source, stocks_list[i:i + self._chunk_size], *args, **kwargs)
                 if data:
-                    result.update(data)
+                    result = self._merge_result(result, data)
             except Exception as e:
                 logger.warning(
                     "Data source %s encountered an exception: %s",
@@ -231,6 +241,27 @@ class FetchWrapper(object):
             source_id += 1
         return result
 
+    def _by_budget(self, sources: List[str], n: int = 1) -> List[str]:
+        '''
+        按请求预算调整数据源顺序: 能立即完成 n 次请求的数据源保持原顺序在前, 其余按需要等待的时间排在后面
+
+        :param n: 预计的请求次数
+        '''
+        def wait_time(source):
+            try:
+                return self.get_data_source(source).rate_budget.wait_time(n)
+            except Exception:
+                return 0
+        return sorted(sources, key=wait_time)
+
+    @staticmethod
+    def _merge_result(result: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        """合并多个数据源的结果, LazyQuotes 之间合并不会触发解析"""
+        if isinstance(data, LazyQuotes) and not isinstance(result, LazyQuotes):
+            result = LazyQuotes(result, converter=data.converter)
+        result.update(data)
+        return result
+
     def _fetch_from_source(self, source: str, stocks: List[str], *args, **kwargs) -> Dict[str, Any]:
         """
         Helper method to fetch data from a single source, used in parallel fetching.
@@ -312,62 +343,116 @@ def set_default_sources(key, func_name, sources, parrallel=False):
     '''
     FetchWrapper.api_default_sources[key] = (func_name, sources, parrallel)
 
-def quotes(stocks: Union[str, List[str]]) -> Dict[str, Any]:
+def set_rate_limits(source: str, limits: Optional[List[tuple]]):
+    '''
+    设置数据源的请求频率限制, 设置会保存在缓存目录中.
+    请求前按限制排队等待; 轮换数据源时优先使用预算充足的数据源.
+
+    Args:
+        source (str): 数据源名称, 同 rtsource
+        limits (List[tuple]): [(次数, 秒数), ...], 如 [(1000, 300), (50000, 86400)] 表示5分钟1000次且24小时50000次.
+            空列表表示不限制, None 表示恢复为数据源声明的默认限制
+    '''
+    FetchWrapper.get_data_source(source).set_rate_limits(limits)
+
+def quotes(stocks: Union[str, List[str]], lazy: bool = False, fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
     """获取行情数据, 根据数据源不同, 有的带有5档买卖信息数据, 有的不带. 可以获取指数的行情数据
 
     Args:
         stocks (Union[str, List[str]]): 股票代码或代码列表, 股票代码可以是6位纯数字代码或者带前缀的代码(sh/sz/bj + code),
             获取指数行情数据需传入前缀，如 sh000001 为上证指数, 而000001则默认为股票即:sz000001平安银行
+        lazy (bool, optional): 是否按需解析. Defaults to False.
+            为True时支持的数据源(sina/tencent)返回 LazyQuotes, 每只股票的数据在第一次访问时才解析,
+            适合请求大量股票但只读取其中少量股票的情况
+        fields (List[str], optional): 需要返回的字段, 如 ['price', 'volume']. Defaults to None 返回全部字段.
+            支持的数据源(eastmoney/cls)只向服务器请求这些字段, 其余数据源在解析后筛选
+        fmt (str, optional): 每只股票行情的格式, 'dict' | 'record'. Defaults to None 使用 set_quote_format 设置的格式.
 
     Returns:
         - Dict[str, Any]: 行情数据
     """
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name)
-    return wrapper.fetch(stocks)
+    return wrapper.fetch(stocks, lazy=lazy, fields=fields, fmt=fmt)
 
-def quotes5(stocks: Union[str, List[str]]) -> Dict[str, Any]:
+def quotes5(stocks: Union[str, List[str]], lazy: bool = False, fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
     '''获取带有5档买卖信息的行情数据, 根据数据源不同, 有的一次只能请求一只股票. 对于指数不建议使用该接口
 
     Args:
         stocks (Union[str, List[str]]): 股票代码或代码列表, 股票代码可以是6位纯数字代码或者带前缀的代码(sh/sz/bj + code)
+        lazy (bool, optional): 是否按需解析, 同 quotes. Defaults to False.
+        fields (List[str], optional): 需要返回的字段, 同 quotes. Defaults to None.
+        fmt (str, optional): 每只股票行情的格式, 同 quotes. Defaults to None.
 
     Returns:
         - Dict[str, Any]: 带有5档买卖信息的行情数据
     '''
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name)
-    return wrapper.fetch(stocks)
+    return wrapper.fetch(stocks, lazy=lazy, fields=fields, fmt=fmt)
 
-def tlines(stocks: Union[str, List[str]]) -> Dict[str, Any]:
+def tlines(stocks: Union[str, List[str]], fmt: Optional[str] = None, days: int = 1) -> Dict[str, Any]:
     '''获取分时线数据, 可以获取指数的分时数据
 
     Args:
         stocks (Union[str, List[str]]): 股票代码或代码列表, 股票代码可以是6位纯数字代码或者带前缀的代码(sh/sz/bj + code),
             获取指数分时数据需传入前缀，如 sh000001 为上证指数，而000001则默认为股票即sz000001平安银行
+        fmt (str, optional): 返回格式, 同 set_array_format. Defaults to None 使用 set_array_format 设置的格式.
+        days (int, optional): 最近的交易日数(数据源最多提供5天). Defaults to 1.
+            大于1时 time 为 'YYYY-MM-DD HH:MM', 各交易日按时间顺序连接在一起. 已收盘的交易日保存在缓存目录中(需要numpy),
+            之后只请求当天的数据
 
     Returns:
         - Dict[str, Any]: 分时线数据
     '''
+    if days > 1:
+        return _tlines_days(stocks, days, fmt)
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name)
-    return wrapper.fetch(stocks)
+    return wrapper.fetch(stocks, fmt=fmt)
+
+def _tlines_days(stocks: Union[str, List[str]], days: int, fmt: Optional[str] = None) -> Dict[str, Any]:
+    wrapper = FetchWrapper.get_wrapper('tlines_days')
+    stocks_list = [stocks] if isinstance(stocks, str) else list(stocks)
+    fetch = lambda codes, n: wrapper.fetch(codes, days=n, fmt='list')
+    if HAS_NUMPY:
+        data = cached_tlines(fetch, stocks_list, days)
+    else:
+        data = fetch(stocks_list, days) or {}
+    return {c: rtbase.format_array_list(rows, TLINE_COLS, fmt=fmt) for c, rows in data.items()}
+
+def tline_matrix(stocks: List[str], source: str = 'cls') -> 'TlineMatrix':
+    '''
+    全市场分时矩阵, 需要 numpy
 
-def mklines(stocks: Union[str, List[str]], kltype=1, length=320, fq=1, withqt=False) -> Dict[str, Any]:
+    Args:
+        stocks (List[str]): 股票代码列表, 矩阵的行顺序与之相同
+        source (str): 数据源, 需要支持批量分时请求, 目前只有 'cls'
+
+    Returns:
+        - TlineMatrix: 已经请求过一次的矩阵, price/volume 为 股票数 x 241 的数组, 之后调用 refresh() 只更新最新的几列
+    '''
+    if not HAS_NUMPY:
+        raise ImportError('tline_matrix requires numpy')
+    matrix = TlineMatrix(stocks, source)
+    matrix.refresh()
+    return matrix
+
+def mklines(stocks: Union[str, List[str]], kltype=1, length=320, fq=1, withqt=False, fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name, withqt)
-    return wrapper.fetch(stocks, kltype=kltype, length=length, fq=fq, withqt=withqt)
+    return wrapper.fetch(stocks, kltype=kltype, length=length, fq=fq, withqt=withqt, fields=fields, fmt=fmt)
 
-def dklines(stocks: Union[str, List[str]], kltype=101, length=320, fq=1, withqt=False) -> Dict[str, Any]:
+def dklines(stocks: Union[str, List[str]], kltype=101, length=320, fq=1, withqt=False, fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name, withqt)
-    return wrapper.fetch(stocks, kltype=kltype, length=length, fq=fq, withqt=withqt)
+    return wrapper.fetch(stocks, kltype=kltype, length=length, fq=fq, withqt=withqt, fields=fields, fmt=fmt)
 
-def fklines(stocks: Union[str, List[str]], kltype: Union[int,str]=101, fq=0) -> Dict[str, Any]:
+def fklines(stocks: Union[str, List[str]], kltype: Union[int,str]=101, fq=0, fmt: Optional[str] = None) -> Dict[str, Any]:
     ''' 获取全部K线数据, 一般用在日线及更大的周期，小的周期不保证能获取完整数据
 
     Returns:
         - Dict[str, Any]: {code1: [], code2: [] ...}
     '''
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name)
-    return wrapper.fetch(stocks, kltype=kltype, fq=fq)
+    return wrapper.fetch(stocks, kltype=kltype, fq=fq, fmt=fmt)
 
-def klines(stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+def klines(stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
     ''' 获取K线数据, 可以获取指数的K线数据
 
     Args:
@@ -386,16 +471,37 @@ def klines(stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320,
             - 0: 不复权
             - 1: 前复权 Default.
             - 2: 后复权
+        fields (List[str], optional): 需要返回的K线列, 'time' 总是返回. Defaults to None 返回全部列.
+            雪球数据源还支持 'pe', 'pb', 'ps', 'pcf', 'market_capital' 估值指标列
+        fmt (str, optional): 返回格式, 同 set_array_format. Defaults to None 使用 set_array_format 设置的格式.
 
     Returns:
         - Dict[str, Any]: {code1: [], code2: [] ...}
     '''
     kltype = rtbase.to_int_kltype(kltype)
     if kltype in [101, 102, 103, 104, 105, 106]:
-        return dklines(stocks, kltype=kltype, length=length, fq=fq)
-    return mklines(stocks, kltype=kltype, length=length, fq=fq)
+        return dklines(stocks, kltype=kltype, length=length, fq=fq, fields=fields, fmt=fmt)
+    return mklines(stocks, kltype=kltype, length=length, fq=fq, fields=fields, fmt=fmt)
+
+def resample_klines(klines: Dict[str, Any], kltype: Union[int, str], cols: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
+    ''' 在本地将K线转换为更大的周期, 需要 numpy
+
+    Args:
+        klines (Dict[str, Any]): klines 的返回值, 任意返回格式
+            - 1分钟(或能整除目标周期的分钟)K线: 转换为 5/15/30/60/120/240 分钟K线, 按A股交易时段分组, 09:30 的K线并入第一根
+            - 日K线: 转换为 周/月/季/半年/年K线
+        kltype (Union[int,str]): 目标周期, 同 klines 的 kltype
+        cols (List[str], optional): K线为 list/tuple 格式时的列名. Defaults to None 即 ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'].
+        fmt (str, optional): 返回格式, 同 set_array_format.
+
+    Returns:
+        - Dict[str, Any]: {code1: [], code2: [] ...}, 只有 time/open/close/high/low/volume/amount 列
+    '''
+    if not HAS_NUMPY:
+        raise ImportError('resample_klines requires numpy')
+    return resample(klines, kltype, cols=cols, fmt=fmt)
 
-def qklines(stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1) -> Dict[str, Any]:
+def qklines(stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320, fq=1, fields: Optional[List[str]] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
     ''' 获取带有行情信息的K线数据, 有的数据源获取K线数据时会同时返回行情数据, 如果没有同时返回行情数据，
     即使调用该接口也不会包含行情数据, 参数与klines一样, 返回值格式有区别
 
@@ -404,10 +510,10 @@ def qklines(stocks: Union[str, List[str]], kltype: Union[int,str]=1, length=320,
     '''
     kltype = rtbase.to_int_kltype(kltype)
     if kltype in [101, 102, 103, 104, 105, 106]:
-        return dklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True)
-    return mklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True)
+        return dklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True, fields=fields, fmt=fmt)
+    return mklines(stocks, kltype=kltype, length=length, fq=fq, withqt=True, fields=fields, fmt=fmt)
 
-def stock_list(market: str = 'all') -> Dict[str, Any]:
+def stock_list(market: str = 'all', fields: Optional[List[str]] = None, cached: bool = False) -> Dict[str, Any]:
     '''获取股票列表
 
     Args:
@@ -418,14 +524,20 @@ def stock_list(market: str = 'all') -> Dict[str, Any]:
             - 'bjs': 北京市场
             - 'cyb': 创业板
             - 'kcb': 科创板
+        fields (List[str], optional): 需要返回的字段, 'code' 总是返回. Defaults to None 返回全部字段.
+        cached (bool, optional): 使用缓存目录中的证券主表(只有 'name', 'listing_date' 字段), 每个交易日最多更新一次. Defaults to False.
 
     Returns:
         - List[Dict[str, Any]]: 股票列表
     '''
+    if cached:
+        master = get_security_master()
+        master.refresh()
+        return master.stock_list(market, fields)
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name)
-    return wrapper.fetch(market)
+    return wrapper.fetch(market, fields=fields)
 
-def transactions(stocks: Union[str, List[str]], date: str=None, start: Union[str, List[str], Dict[str, str]]='') -> Dict[str, Any]:
+def transactions(stocks: Union[str, List[str]], date: str=None, start: Union[str, List[str], Dict[str, str]]='', fmt: Optional[str] = None) -> Dict[str, Any]:
     '''获取指定日期的交易数据
 
     Args:
@@ -435,9 +547,10 @@ def transactions(stocks: Union[str, List[str]], date: str=None, start: Union[str
             - '09:30': 所有stock的start都是'09:30'
             - ['09:30', '10:30']: 与stocks一一对应, 如果不足则为''
             - {code1: '9:30', code2: '10:30'}: 指定每个stock的start, 没指定则为''
+        fmt (str, optional): 返回格式, 同 set_array_format. Defaults to None 使用 set_array_format 设置的格式.
 
     Returns:
         - Dict[str, Any]: {code1: [], code2: [] ...}
     '''
     wrapper = FetchWrapper.get_wrapper(inspect.currentframe().f_code.co_name)
-    return wrapper.fetch(stocks, date=date, start=start)
+    return wrapper.fetch(stocks, date=date, start=start, fmt=fmt)
@@ -42,6 +42,13 @@ class TestClsFunctions(unittest.TestCase):
         result = self.source.tlines(stock_codes)
         self.assertIsInstance(result, dict)
 
+    def test_tline_points_volume(self):
+        result = self.source.tline_points(['600030', '000001'], {})
+        self.assertEqual(set(result), {'600030', '000001'})
+        for total, points in result.values():
+            self.assertGreater(total, 0)
+            self.assertTrue(any(p[2] == p[2] for p in points))
+
     def test_single_stock_mklines(self):
         stock_code = '600030'
         result = self.source.mklines(stock_code, 1, 10)
@@ -80,6 +87,12 @@ class TestClsFunctions(unittest.TestCase):
             self.assertIn('name', stock)
             self.assertIn('close', stock)
 
+    def test_quote_url_fields(self):
+        url, _ = self.source.get_quote_url(['sh600030'], fields=['date', 'time'])
+        self.assertIn('&fields=secu_code&', url)
+        url, _ = self.source.get_quote_url(['sh600030'], fields=['price'])
+        self.assertIn('&fields=secu_code,last_px&', url)
+
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(TestClsFunctions('test_stock_list_retrieval'))
@@ -1,8 +1,13 @@
 import unittest
 import time
-from stockrt import rtsource
+import tempfile
+import requests
+from stockrt import rtsource, set_rate_limits
 from unittest.mock import patch
-from stockrt.sources.eastmoney import Em
+from stockrt.sources.eastmoney import Em, EmMirrors, _EmMirrorAdapter, EastMoney, _em_fields
+import json
+from urllib.parse import urlsplit, parse_qs
+from stockrt.sources.rtbase import set_cache_dir, _rate_budgets
 
 
 class TestEmFunctions(unittest.TestCase):
@@ -44,6 +49,11 @@ class TestEmFunctions(unittest.TestCase):
         result = self.source.tlines(stock_codes)
         self.assertIsInstance(result, dict)
 
+    def test_tlines_days(self):
+        result = self.source.tlines_days(['000001'], 3)
+        self.assertIsInstance(result, dict)
+        self.assertEqual(len({t[0][:10] for t in result['000001']}), 3)
+
     def test_single_stock_mklines(self):
         stock_codes = '000001'
         result = self.source.mklines(stock_codes, 1, 10)
@@ -89,10 +99,30 @@ class TestEmFunctions(unittest.TestCase):
             self.assertIn('name', data)
             self.assertIn('close', data)
 
+    def test_quote_fields_narrowing(self):
+        with patch.object(Em, 'get_cookie', return_value=''):
+            url, _ = self.source.get_quote_url(['sh600000'], fields=['price', 'volume'])
+        self.assertTrue(url.endswith('&fields=f12,f13,f2,f5'))
+        rsp = '{"data": {"diff": [{"f12": "600000", "f13": 1, "f2": 10.5, "f5": 12}]}}'
+        result = self.source.format_quote_response([(['sh600000'], rsp)], fields=['price', 'volume'])
+        self.assertEqual(result, {'sh600000': {'price': 10.5, 'volume': 1200}})
+
+    def test_kline_fields_narrowing(self):
+        with patch.object(Em, 'get_cookie', return_value=''):
+            url, _ = self.source.get_mkline_url('sh600000', 1, 10, 1, fields=['close'])
+        self.assertIn('&fields2=f51,f53', url)
+        rsp = '{"data": {"klines": ["2025-01-02 09:31,10.5"]}}'
+        result = self.source.format_kline_response([('sh600000', rsp)], fields=['close'])
+        self.assertEqual(result['sh600000'][0][1], 10.5)
+
 
 class TestEmCookie(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.old_cache_dir = set_cache_dir(cls.cache_dir.name)
+        cls.old_min_spare = Em.min_spare
+        Em.min_spare = 0
         cls.cookie_data = [
             {'cookie': 'cookie1', 'timestamp': time.time(), 'used': 0, 'total_used': 0},
             {'cookie': 'cookie2', 'timestamp': time.time() - 600, 'used': 0, 'total_used': 0},
@@ -103,6 +133,9 @@ class TestEmCookie(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         Em.cookies = []
+        Em.min_spare = cls.old_min_spare
+        set_cache_dir(cls.old_cache_dir)
+        cls.cache_dir.cleanup()
 
     def test_get_cookie_with_available_cookie(self):
         cookie = Em.get_cookie()
@@ -146,6 +179,168 @@ class TestEmCookie(unittest.TestCase):
         self.assertNotIn(cookie, old_cookies)
 
 
+
+class TestEmCookiePool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.old_cache_dir = set_cache_dir(cls.cache_dir.name)
+        cls.old_min_spare = Em.min_spare
+        Em.min_spare = 0
+
+    @classmethod
+    def tearDownClass(cls):
+        Em.cookies = []
+        Em.min_spare = cls.old_min_spare
+        set_cache_dir(cls.old_cache_dir)
+        cls.cache_dir.cleanup()
+
+    def setUp(self):
+        Em.cookies = []
+        Em._cookies_loaded = False
+
+    def test_cookie_persistence(self):
+        Em.cookies = [{'cookie': 'saved', 'timestamp': time.time(), 'created': time.time(), 'used': 3, 'total_used': 30}]
+        Em.get_cookie()
+        Em.save_cookies(True)
+        Em.cookies = []
+        Em._cookies_loaded = False
+        self.assertEqual(Em.get_cookie(), 'saved')
+        self.assertEqual(Em.cookies[0]['total_used'], 32)
+
+    def test_expired_cookie_dropped(self):
+        Em.cookies = [{'cookie': 'old', 'timestamp': time.time(), 'created': time.time() - Em.cookie_lifetime - 1, 'used': 0, 'total_used': 0}]
+        with patch('stockrt.sources.eastmoney.Em.generate_cookie', return_value='fresh'):
+            self.assertEqual(Em.get_cookie(), 'fresh')
+
+    def test_over_used_response(self):
+        Em.cookies = [{'cookie': 'limited', 'timestamp': time.time(), 'used': 0, 'total_used': 0}]
+        response = requests.models.Response()
+        response.status_code = 403
+        response.url = 'https://push2his.eastmoney.com/api/qt/stock/kline/get'
+        response.request = requests.Request('GET', response.url, headers={'Cookie': 'limited'}).prepare()
+        Em._check_response(response)
+        self.assertEqual(Em.cookies[0]['used'], Em.max_used)
+
+    @patch('stockrt.sources.eastmoney.Em.generate_cookie', return_value='spare')
+    def test_background_replenish(self, mock_generate):
+        Em.cookies = [{'cookie': 'last', 'timestamp': time.time(), 'used': Em.max_used - 1, 'total_used': 0}]
+        Em.min_spare = 1
+        try:
+            self.assertEqual(Em.get_cookie(), 'last')
+            Em._replenish_thread.join(5)
+        finally:
+            Em.min_spare = 0
+        self.assertEqual([c['cookie'] for c in Em.cookies], ['last', 'spare'])
+
+
+class TestEmMirrors(unittest.TestCase):
+    def test_spread_over_mirrors(self):
+        mirrors = EmMirrors()
+        hosts = mirrors.hosts('push2.eastmoney.com')
+        picked = {mirrors.pick('push2.eastmoney.com') for _ in range(500)}
+        self.assertEqual(picked, set(hosts))
+        self.assertEqual(mirrors.base('48.push2.eastmoney.com'), 'push2.eastmoney.com')
+        self.assertIsNone(mirrors.base('hsmarketwg.eastmoney.com'))
+
+    def test_evict_and_readmit(self):
+        mirrors = EmMirrors()
+        mirrors.evict_time = 0.2
+        bad = '7.push2his.eastmoney.com'
+        for _ in range(mirrors.max_errors):
+            mirrors.record(bad, 1, False)
+        self.assertNotIn(bad, {mirrors.pick('push2his.eastmoney.com') for _ in range(200)})
+        time.sleep(0.3)
+        self.assertIn(bad, {mirrors.pick('push2his.eastmoney.com') for _ in range(500)})
+        # 重新启用后再失败一次即再次剔除
+        mirrors.record(bad, 1, False)
+        self.assertNotIn(bad, {mirrors.pick('push2his.eastmoney.com') for _ in range(200)})
+
+    def test_adapter_failover(self):
+        mirrors = EmMirrors()
+        mirrors.mirrors = {'push2.eastmoney.com': ['', '2.']}
+        mirrors._bases = {'push2.eastmoney.com': 'push2.eastmoney.com', '2.push2.eastmoney.com': 'push2.eastmoney.com'}
+        sent = []
+
+        def fake_send(adapter, request, **kwargs):
+            sent.append((request.url, request.headers['Host']))
+            if request.url.startswith('https://push2.'):
+                raise requests.exceptions.ConnectionError('down')
+            response = requests.models.Response()
+            response.status_code = 200
+            return response
+
+        request = requests.Request('GET', 'https://push2.eastmoney.com/api/qt/ulist.np/get?secids=1.600000',
+            headers={'Host': 'push2.eastmoney.com'}).prepare()
+        with patch('requests.adapters.HTTPAdapter.send', fake_send):
+            for _ in range(20):
+                self.assertEqual(_EmMirrorAdapter(mirrors).send(request).status_code, 200)
+        self.assertEqual(sent[-1], ('https://2.push2.eastmoney.com/api/qt/ulist.np/get?secids=1.600000', '2.push2.eastmoney.com'))
+        stats = mirrors.stats()
+        self.assertGreater(stats['push2.eastmoney.com']['evicted_until'], time.time())
+        self.assertEqual(stats['2.push2.eastmoney.com']['ok'], 20)
+
+
+class TestEmFields(unittest.TestCase):
+    def test_local_only_fields(self):
+        # date/time 不需要请求, fields 参数中只有代码字段, 不能有多余的逗号
+        self.assertEqual(_em_fields(EastMoney.quote_fields, ['date', 'time'], prefix=('f12', 'f13'))[1], 'f12,f13')
+        names, efields = _em_fields(EastMoney.quote_fields, ['price', 'name'], prefix=('f12', 'f13'))
+        self.assertEqual(names, ['name', 'price'])
+        self.assertEqual(efields, 'f12,f13,f2,f14')
+
+
+class TestEmClist(unittest.TestCase):
+    total = 1234
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.old_cache_dir = set_cache_dir(self.cache_dir.name)
+        _rate_budgets.reset()
+        self.requested = []
+
+    def tearDown(self):
+        _rate_budgets.reset()
+        set_cache_dir(self.old_cache_dir)
+        self.cache_dir.cleanup()
+
+    def fake_get(self, url, headers=None):
+        query = parse_qs(urlsplit(url).query)
+        pn, pz = int(query['pn'][0]), min(int(query['pz'][0]), 50)
+        self.requested.append(pn)
+        time.sleep(0.01)
+        diff = [{'f12': str(i)} for i in range((pn - 1) * pz, min(pn * pz, self.total))]
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = json.dumps({'data': {'total': self.total, 'diff': diff}}).encode()
+        return response
+
+    def clist(self, qtcb=None):
+        with patch.object(Em.session, 'get', self.fake_get), patch.object(Em, 'get_cookie', return_value='c'):
+            return Em.qt_clist(None, qtcb=qtcb)
+
+    def test_all_pages_in_order(self):
+        data = self.clist()
+        self.assertEqual([d['f12'] for d in data], [str(i) for i in range(self.total)])
+
+    def test_early_stop(self):
+        pages = []
+        def qtcb(page):
+            pages.append(page)
+            return len(pages) == 3
+        data = self.clist(qtcb)
+        self.assertEqual([d['f12'] for d in data], [str(i) for i in range(150)])
+        self.assertLess(len(self.requested), self.total // 50)
+
+    def test_unlimited_budget(self):
+        set_rate_limits('eastmoney', [])
+        try:
+            data = self.clist()
+        finally:
+            set_rate_limits('eastmoney', None)
+        self.assertEqual([d['f12'] for d in data], [str(i) for i in range(self.total)])
+
+
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(TestEmFunctions('test_single_stock_dklines'))
@@ -0,0 +1,84 @@
+import unittest
+from stockrt.sources.rtbase import NoneSourcePy
+from stockrt.sources.livebars import LiveBars, minute_bar_time
+
+
+class FakeSource(NoneSourcePy):
+    ''' 历史K线到 2025-01-02 09:35, 最后一根K线尚未完成 '''
+    def __init__(self):
+        self.kline_calls = 0
+
+    def klines(self, stocks, kltype=1, length=320, fq=1, fields=None, fmt=None):
+        self.kline_calls += 1
+        if kltype == 102:
+            bars = [['2024-12-27', 9.5, 9.8, 9.9, 9.4, 5000, 50000.0], ['2025-01-02', 9.8, 10.0, 10.1, 9.7, 3000, 30000.0]]
+        else:
+            bars = [['2025-01-01 15:00', 9.9, 10.0, 10.0, 9.9, 100, 1000.0]]
+            bars += [[f'2025-01-02 09:{m:02d}', 10.0, 10.0, 10.0, 10.0, 100, 1000.0] for m in range(31, 36)]
+        return {c: [list(b) for b in bars] for c in stocks}
+
+
+def quote(tm, price, volume, amount, day='2025-01-02'):
+    return {'price': price, 'volume': volume, 'amount': amount, 'date': day, 'time': tm}
+
+
+class TestLiveBars(unittest.TestCase):
+    def test_minute_bar_time(self):
+        self.assertEqual(minute_bar_time(1, 925), '09:31')
+        self.assertEqual(minute_bar_time(1, 931), '09:32')
+        self.assertEqual(minute_bar_time(5, 934), '09:35')
+        self.assertEqual(minute_bar_time(30, 1200), '11:30')
+        self.assertEqual(minute_bar_time(60, 1300), '14:00')
+        self.assertEqual(minute_bar_time(120, 1459), '15:00')
+        self.assertEqual(minute_bar_time(1, 1505), '15:00')
+
+    def test_minutes(self):
+        source = FakeSource()
+        live = LiveBars('sh600000', 1, source=source)
+        # 当天历史K线累计 500 股, 当前行情累计 520 股, 仍在 09:35 这根K线内
+        live.update({'sh600000': quote('09:34:30', 10.2, 520, 5200.0)})
+        self.assertEqual(live.last('sh600000'), ['2025-01-02 09:35', 10.0, 10.2, 10.2, 10.0, 120, 1200.0])
+        live.update({'sh600000': quote('09:34:50', 9.8, 550, 5500.0)})
+        self.assertEqual(live.last('sh600000'), ['2025-01-02 09:35', 10.0, 9.8, 10.2, 9.8, 150, 1500.0])
+        # 跨过边界, 新的K线从上次行情的累计值开始
+        live.update({'sh600000': quote('09:35:10', 9.9, 600, 6000.0)})
+        self.assertEqual(live.last('sh600000'), ['2025-01-02 09:36', 9.9, 9.9, 9.9, 9.9, 50, 500.0])
+        self.assertEqual(len(live['sh600000']), 7)
+        # 过期的行情不改变K线
+        live.update({'sh600000': quote('09:34:59', 9.0, 560, 5600.0)})
+        self.assertEqual(live.last('sh600000')[2], 9.9)
+        # 新的交易日
+        live.update({'sh600000': quote('09:30:05', 10.5, 80, 840.0, day='2025-01-03')})
+        self.assertEqual(live.last('sh600000'), ['2025-01-03 09:31', 10.5, 10.5, 10.5, 10.5, 80, 840.0])
+        self.assertEqual(source.kline_calls, 1)
+
+    def test_new_bar_after_load(self):
+        live = LiveBars(['sz000001'], 5, source=FakeSource())
+        live.update({'sz000001': quote('09:36:00', 10.1, 700, 7000.0)})
+        self.assertEqual(live.last('sz000001'), ['2025-01-02 09:40', 10.1, 10.1, 10.1, 10.1, 200, 2000.0])
+
+    def test_week(self):
+        live = LiveBars(['sz000001'], 'w', source=FakeSource())
+        live.update({'sz000001': quote('10:00:00', 10.3, 1000, 10000.0, day='2025-01-03')})
+        self.assertEqual(live.last('sz000001'), ['2025-01-03', 9.8, 10.3, 10.3, 9.7, 3000, 30000.0])
+        live.update({'sz000001': quote('11:00:00', 9.6, 1500, 15000.0, day='2025-01-03')})
+        self.assertEqual(live.last('sz000001'), ['2025-01-03', 9.8, 9.6, 10.3, 9.6, 3500, 35000.0])
+        live.update({'sz000001': quote('09:40:00', 9.7, 200, 2000.0, day='2025-01-06')})
+        self.assertEqual(live.last('sz000001'), ['2025-01-06', 9.7, 9.7, 9.7, 9.7, 200, 2000.0])
+        self.assertEqual(len(live['sz000001']), 3)
+
+    def test_week_multi_day(self):
+        live = LiveBars(['sz000001'], 'w', source=FakeSource())
+        live.update({'sz000001': quote('10:00:00', 10.3, 1000, 10000.0)})
+        live.update({'sz000001': quote('15:00:00', 10.2, 2000, 20000.0)})
+        self.assertEqual(live.last('sz000001'), ['2025-01-02', 9.8, 10.2, 10.3, 9.7, 4000, 40000.0])
+        # 同一周的下一个交易日, 累计值从 0 开始
+        live.update({'sz000001': quote('09:31:00', 10.4, 100, 1000.0, day='2025-01-03')})
+        self.assertEqual(live.last('sz000001'), ['2025-01-03', 9.8, 10.4, 10.4, 9.7, 4100, 41000.0])
+        live.update({'sz000001': quote('10:00:00', 10.5, 300, 3000.0, day='2025-01-03')})
+        self.assertEqual(live.last('sz000001'), ['2025-01-03', 9.8, 10.5, 10.5, 9.7, 4300, 43000.0])
+        self.assertEqual(len(live['sz000001']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
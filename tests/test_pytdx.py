@@ -43,6 +43,18 @@ class TestTdxFunctions(unittest.TestCase):
         result = self.source.tlines(stock_codes)
         self.assertIsInstance(result, dict)
 
+    def test_tlines_columns(self):
+        result = self.source.tlines('600530', fmt='list')
+        tline = result['600530']
+        self.assertEqual(tline[0][0], '09:31')
+        self.assertEqual(len(tline[0]), len(self.source.tline_cols))
+        self.assertAlmostEqual(tline[0][3], tline[0][1] * tline[0][2])
+
+    def test_history_tlines(self):
+        result = self.source.tlines(['000001', 'sh000001'], date='2025-12-01')
+        self.assertEqual(len(result['000001']), 240)
+        self.assertEqual(result['000001'][-1][0], '15:00')
+
     def test_single_stock_mklines(self):
         stock_codes = '000001'
         result = self.source.mklines(stock_codes, 1, 10)
@@ -63,6 +75,15 @@ class TestTdxFunctions(unittest.TestCase):
         result = self.source.dklines(stock_codes, 'd', 10)
         self.assertIsInstance(result, dict)
 
+    def test_paged_dklines(self):
+        result = self.source.dklines('000001', 'd', 2000)
+        self.assertEqual(len(result['000001']), 2000)
+
+    def test_fklines(self):
+        result = self.source.fklines(['000001', 'sh000001'], 'd')
+        self.assertIsInstance(result, dict)
+        self.assertGreater(len(result['000001']), self.source.bars_page_size)
+
     def test_single_stock_transactions(self):
         stock_codes = '162411'
         result = self.source.transactions(stock_codes, None)
@@ -73,6 +94,15 @@ class TestTdxFunctions(unittest.TestCase):
         result = self.source.transactions(stock_codes, '2025-12-01')
         self.assertIsInstance(result, dict)
 
+    def test_iter_transactions(self):
+        stock_codes = ['000001', '601398']
+        pages = {}
+        for code, page in self.source.iter_transactions(stock_codes, '2025-12-01'):
+            pages.setdefault(code, []).insert(0, page)
+        result = self.source.transactions(stock_codes, '2025-12-01')
+        for code, v in pages.items():
+            self.assertEqual(sum(v, []), result[code])
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
@@ -68,6 +68,12 @@ class TestThsFunctions(unittest.TestCase):
         result = self.source.dklines(stock_codes, 'd', 10)
         self.assertIsInstance(result, dict)
 
+    def test_concurrent_sessions(self):
+        stock_codes = ['000001', '600000', '601398', '300750', 'sh000001', '518880']
+        self.assertEqual(self.source.connect(), self.source.pool.size)
+        result = self.source.dklines(stock_codes, 'd', 10)
+        self.assertEqual(set(result), set(stock_codes))
+
 
 if __name__ == '__main__':
     # suite = unittest.TestSuite()
@@ -0,0 +1,85 @@
+import random
+import unittest
+import importlib.util
+from datetime import date, timedelta
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+if HAS_NUMPY:
+    from stockrt.sources.resample import resample
+
+
+def day_minutes(day):
+    ''' 一天的1分钟K线时间, 包括 09:30 的集合竞价K线 '''
+    minutes = [570] + list(range(571, 691)) + list(range(781, 901))
+    return [f'{day} {t // 60:02d}:{t % 60:02d}' for t in minutes]
+
+
+def random_bars(rnd, times):
+    bars = []
+    for t in times:
+        o, c = rnd.randint(900, 1100) / 100, rnd.randint(900, 1100) / 100
+        bars.append([t, o, c, max(o, c) + 0.01, min(o, c) - 0.01, rnd.randint(1, 1000) * 100, rnd.randint(1, 10000) / 10])
+    return bars
+
+
+def merge(group, time):
+    return [time, group[0][1], group[-1][2], max(b[3] for b in group), min(b[4] for b in group),
+            sum(b[5] for b in group), round(sum(b[6] for b in group), 2)]
+
+
+@unittest.skipUnless(HAS_NUMPY, 'numpy not installed')
+class TestResample(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(3)
+
+    def test_minutes(self):
+        klines = {c: random_bars(self.rnd, day_minutes('2025-01-02') + day_minutes('2025-01-03')[:100]) for c in ('sh600000', 'sz000001')}
+        for n in (5, 15, 30, 60, 120):
+            result = resample(klines, n, fmt='list')
+            for code, bars in klines.items():
+                expected = []
+                for day in ('2025-01-02', '2025-01-03'):
+                    rows = [b for b in bars if b[0].startswith(day)]
+                    # 09:30 并入第一根
+                    rows = [rows[0:2]] + [[r] for r in rows[2:]]
+                    for i in range(0, len(rows), n):
+                        group = [b for g in rows[i:i + n] for b in g]
+                        end = (i // n + 1) * n - 1
+                        t = 571 + end if end < 120 else 781 + end - 120
+                        expected.append(merge(group, f'{day} {t // 60:02d}:{t % 60:02d}'))
+                self.assertEqual(result[code], expected, (code, n))
+        self.assertEqual([b[0][-5:] for b in resample(klines, 60, fmt='list')['sh600000'][:4]], ['10:30', '11:30', '14:00', '15:00'])
+
+    def test_calendar(self):
+        days = [date(2024, 1, 1) + timedelta(days=i) for i in range(800)]
+        days = [d.isoformat() for d in days if d.weekday() < 5]
+        klines = {'sh600000': random_bars(self.rnd, days), 'sz000001': random_bars(self.rnd, days[300:])}
+        keys = {
+            'w': lambda d: date.fromisoformat(d).isocalendar()[:2],
+            'm': lambda d: d[:7],
+            'q': lambda d: (d[:4], (int(d[5:7]) - 1) // 3),
+            'h': lambda d: (d[:4], (int(d[5:7]) - 1) // 6),
+            'y': lambda d: d[:4],
+        }
+        for kltype, key in keys.items():
+            result = resample(klines, kltype, fmt='list')
+            for code, bars in klines.items():
+                groups = {}
+                for b in bars:
+                    groups.setdefault(key(b[0]), []).append(b)
+                self.assertEqual(result[code], [merge(g, g[-1][0]) for g in groups.values()], (code, kltype))
+
+    def test_formats(self):
+        bars = random_bars(self.rnd, day_minutes('2025-01-02'))
+        expected = resample({'sh600000': bars}, 15, fmt='dict')
+        cols = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount']
+        self.assertEqual(resample({'sh600000': [dict(zip(cols, b)) for b in bars]}, 15, fmt='dict'), expected)
+        # 没有 amount 列的数据源
+        result = resample({'sh600000': [b[:6] for b in bars]}, '30', cols=cols[:6], fmt='list')
+        self.assertEqual(result['sh600000'], [r[:6] for r in resample({'sh600000': bars}, 30, fmt='list')['sh600000']])
+        with self.assertRaises(ValueError):
+            resample({'sh600000': bars}, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,12 @@
 import unittest
-from stockrt.sources.rtbase import rtbase
+import os
+import tempfile
+import time
+from unittest.mock import patch
+from stockrt.sources.rtbase import rtbase, set_array_format, set_quote_format, LazyQuotes, set_cache_dir, get_cache_dir
+from stockrt.sources.rtbase import RateBudget, get_rate_budget, _rate_budgets
+from stockrt.sources.records import Quote, Bar, MISSING
+from stockrt.sources.secmaster import SecurityMaster
 
 class TestGetFullcodeFunction(unittest.TestCase):
 
@@ -25,6 +32,14 @@ class TestGetFullcodeFunction(unittest.TestCase):
         with self.assertRaises(AssertionError):
             rtbase.get_fullcode(123456)
 
+    def test_batch_fullcodes(self):
+        codes = ['600000', 'SZ000001', '830946', '510300', '123456', 'sh000001', '920001']
+        self.assertEqual(rtbase.get_fullcodes(codes), [rtbase.get_fullcode(c) for c in codes])
+        many = [f'{i:06d}' for i in range(0, 1000000, 331)] + ['sh000001']
+        self.assertEqual(rtbase.get_fullcodes(many), [rtbase.get_fullcode(c) for c in many])
+        with self.assertRaises(AssertionError):
+            rtbase.get_fullcodes(['600000', '12345'])
+
     def test_stock_code_with_valid_bj_head(self):
         self.assertEqual(rtbase.get_fullcode("412345"), "bj412345")
         self.assertEqual(rtbase.get_fullcode("830946"), "bj830946")
@@ -73,6 +88,171 @@ class TestToIntKltype(unittest.TestCase):
             rtbase.to_int_kltype(True)
 
 
+class TestRecords(unittest.TestCase):
+    def test_quote_from_dict_roundtrip(self):
+        qd = {'name': 'abc', 'price': 10.1, 'bid1': 10.0, 'bid1_volume': 100, '量比': 1.2}
+        q = Quote.from_dict(qd)
+        self.assertEqual(q.price, 10.1)
+        self.assertIs(q.ask1, MISSING)
+        self.assertEqual(q['量比'], 1.2)
+        self.assertNotIn('ask1', q)
+        self.assertEqual(q.to_dict(), qd)
+
+    def test_bar_array_format(self):
+        old = set_array_format('record')
+        try:
+            bars = rtbase.format_array_list(
+                [['2025-01-02', 1.0, 1.1, 1.2, 0.9, 100, 110.0]],
+                ['time', 'open', 'close', 'high', 'low', 'volume', 'amount'])
+        finally:
+            set_array_format(old)
+        self.assertIsInstance(bars[0], Bar)
+        self.assertEqual(bars[0].close, 1.1)
+        self.assertIs(bars[0].turnover, MISSING)
+
+    def test_per_call_format(self):
+        rows = [['2025-01-02', 1.0, 1.1, 1.2, 0.9, 100, 110.0]]
+        cols = ['time', 'open', 'close', 'high', 'low', 'volume', 'amount']
+        bars = rtbase.format_array_list(rows, cols, fmt='dict')
+        self.assertEqual(bars[0]['close'], 1.1)
+        self.assertIs(rtbase.format_array_list(rows, cols), rows)
+        quotes = rtbase.format_quotes({'sh600000': {'price': 10.1}}, fmt='record')
+        self.assertIsInstance(quotes['sh600000'], Quote)
+        with self.assertRaises(ValueError):
+            rtbase.format_quotes({'sh600000': {'price': 10.1}}, fmt='np')
+
+    def test_record_quote_format_lazy(self):
+        lazy = LazyQuotes()
+        lazy.add('600000', lambda raw: {'price': raw}, 10.5)
+        old = set_quote_format('record')
+        try:
+            quotes = rtbase.format_quotes(lazy)
+        finally:
+            set_quote_format(old)
+        self.assertIsInstance(quotes['600000'], Quote)
+        self.assertEqual(quotes['600000'].price, 10.5)
+
+
+class TestSecurityMaster(unittest.TestCase):
+    def test_ids_and_codes(self):
+        sm = SecurityMaster()
+        sm.load({'all': [{'code': 'sh600000', 'name': '浦发银行'}, {'code': 'sz000001', 'name': '平安银行'}]})
+        self.assertEqual(sm.id('600000'), sm.id('sh600000'))
+        self.assertIs(sm.fullcode('SH600000'), sm.code(sm.id('600000')))
+        self.assertEqual(sm.name('000001'), '平安银行')
+        self.assertEqual(sm.market('000001'), 'sz')
+        # 指数不占用6位代码
+        self.assertNotEqual(sm.id('sh000001'), sm.id('000001'))
+        self.assertEqual(sm.codes(sm.ids(['600000', 'sh000001'])), ['sh600000', 'sh000001'])
+        self.assertEqual(sm.index_by_id({'sh600000': 1}), {sm.id('sh600000'): 1})
+
+    def test_source_codes(self):
+        sm = SecurityMaster()
+        sm.register_source('em', lambda c: c.replace('sh', '1.').replace('sz', '0.'), lambda s: ('sh' if s.startswith('1.') else 'sz') + s[2:])
+        self.assertEqual(sm.source_code('em', '600000'), '1.600000')
+        self.assertEqual(sm.from_source_code('em', '1.600000'), 'sh600000')
+        self.assertEqual(sm.from_source_code('em', '0.300750'), 'sz300750')
+
+    def test_cached_refresh(self):
+        listing = [
+            {'code': 'sh600000', 'name': '浦发银行', 'listing_date': '19991110'},
+            {'code': 'sz301000', 'name': '肇民科技', 'listing_date': '20210728'},
+        ]
+        calls = []
+        def fetch(since=None):
+            calls.append(since)
+            return [s for s in listing if since is None or s['listing_date'] >= since]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            old = set_cache_dir(tmp)
+            try:
+                with patch.object(SecurityMaster, '_fetch_listing', side_effect=fetch):
+                    sm = SecurityMaster()
+                    self.assertEqual(sm.refresh(), 2)
+                    self.assertEqual(sm.refresh(), 0)
+                    self.assertEqual(calls, [None])
+                    self.assertEqual(sm.listing_date('301000'), '20210728')
+                    # force 只能用关键字传入
+                    with self.assertRaises(TypeError):
+                        sm.refresh('sha')
+
+                    # 其他进程直接加载缓存
+                    sm2 = SecurityMaster()
+                    self.assertEqual(sm2.refresh(), 0)
+                    self.assertEqual(calls, [None])
+                    self.assertEqual(sm2.stock_list('cyb'), {'cyb': [{'code': 'sz301000', 'name': '肇民科技', 'listing_date': '20210728'}]})
+                    self.assertEqual(sm2.listed('sha'), ['sh600000'])
+
+                    # 下一个交易日只请求新上市的股票
+                    listing.append({'code': 'bj920001', 'name': '新股', 'listing_date': '20260105'})
+                    sm2._updated = '2000-01-01'
+                    self.assertEqual(sm2.refresh(), 2)
+                    self.assertEqual(calls, [None, '20210728'])
+                    self.assertEqual(sm2.stock_list('all', ['name'])['all'][-1], {'code': 'bj920001', 'name': '新股'})
+            finally:
+                set_cache_dir(old)
+
+
+class TestCacheDir(unittest.TestCase):
+    def test_set_cache_dir(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stockrt')
+            old = set_cache_dir(path)
+            try:
+                self.assertEqual(get_cache_dir(), path)
+                self.assertTrue(os.path.isdir(path))
+            finally:
+                set_cache_dir(old)
+
+
+class TestRateBudget(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_dir = set_cache_dir(self.tmp.name)
+        _rate_budgets.reset()
+
+    def tearDown(self):
+        _rate_budgets.reset()
+        set_cache_dir(self.old_dir)
+        self.tmp.cleanup()
+
+    def test_unlimited(self):
+        budget = RateBudget('test')
+        self.assertTrue(budget.acquire(1000))
+        self.assertEqual(budget.wait_time(), 0)
+        self.assertEqual(budget.remaining(), 1.0)
+
+    def test_acquire_and_wait(self):
+        budget = RateBudget('test', [(5, 0.5), (100, 3600)])
+        for _ in range(5):
+            self.assertTrue(budget.acquire(timeout=0))
+        self.assertFalse(budget.acquire(timeout=0))
+        self.assertGreater(budget.wait_time(), 0)
+        self.assertLess(budget.remaining(), 0.1)
+        start = time.time()
+        self.assertTrue(budget.acquire())
+        self.assertGreater(time.time() - start, 0.05)
+        self.assertAlmostEqual(budget.available(), 0, delta=0.5)
+
+    def test_persist(self):
+        budget = get_rate_budget('test', [(10, 3600)])
+        for _ in range(8):
+            budget.acquire()
+        _rate_budgets.save()
+        _rate_budgets.reset()
+        self.assertAlmostEqual(get_rate_budget('test', [(10, 3600)]).available(), 2, delta=0.1)
+        # 默认限制改变后旧的预算作废
+        _rate_budgets.reset()
+        self.assertAlmostEqual(get_rate_budget('test', [(20, 3600)]).available(), 20, delta=0.1)
+
+    def test_configured_limits(self):
+        _rate_budgets.configure('test', [(3, 60)])
+        _rate_budgets.reset()
+        self.assertEqual(get_rate_budget('test', [(10, 60)]).limits, [(3, 60.0)])
+        _rate_budgets.configure('test', None)
+        self.assertEqual(get_rate_budget('test', [(10, 60)]).limits, [(10, 60.0)])
+
+
 if __name__ == '__main__':
     unittest.main()
 
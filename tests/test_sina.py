@@ -1,5 +1,6 @@
 import unittest
 from stockrt import rtsource
+from stockrt.sources.rtbase import LazyQuotes
 
 class TestSinaFunctions(unittest.TestCase):
     source = rtsource('sina')
@@ -82,6 +83,19 @@ class TestSinaFunctions(unittest.TestCase):
             self.assertIsInstance(entry[2], int)
             self.assertIsInstance(entry[3], int)
 
+    def test_lazy_quotes_match_eager(self):
+        rsp = ('var hq_str_sh600000="浦发银行,10.0,9.9,10.1,10.2,9.8,10.1,10.11,1000000,10100000,'
+               '100,10.1,200,10.09,300,10.08,400,10.07,500,10.06,100,10.11,200,10.12,300,10.13,400,10.14,500,10.15,'
+               '2025-01-02,15:00:00,00,";\nvar hq_str_sz000001="";\nvar hq_str_sz000002="万科A,bad";\n')
+        rep_data = [(['600000', 'sz000001', 'sz000002'], rsp)]
+        eager = self.source.format_quote_response(rep_data)
+        lazy = self.source.format_quote_response(rep_data, lazy=True)
+        self.assertIsInstance(lazy, LazyQuotes)
+        self.assertEqual(list(lazy), list(eager))
+        self.assertNotIn('sz000002', lazy)
+        self.assertEqual(lazy['600000'], eager['600000'])
+        self.assertEqual(lazy.to_dict(), eager)
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
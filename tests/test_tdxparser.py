@@ -0,0 +1,373 @@
+import time
+import zlib
+import random
+import socket
+import struct
+import asyncio
+import tempfile
+import unittest
+import threading
+import socketserver
+import importlib.util
+from unittest.mock import patch
+from stockrt.sources.rtbase import set_cache_dir
+
+HAS_PYTDX = importlib.util.find_spec('pytdx') is not None
+if HAS_PYTDX:
+    from pytdx.parser.get_security_bars import GetSecurityBarsCmd
+    from pytdx.parser.get_security_quotes import GetSecurityQuotesCmd
+    from pytdx.parser.get_transaction_data import GetTransactionData
+    from pytdx.parser.get_history_transaction_data import GetHistoryTransactionData
+    from pytdx.helper import get_volume
+    from stockrt.sources.tdxparser import (
+        SecurityBarsCmd, SecurityQuotesCmd, TransactionCmd, HistoryTransactionCmd, get_volumes,
+        TdxNativeHq_API, AsyncTdxClient)
+    from stockrt.sources.pymtdx import SrcTdx, TdxPool, TdxHosts
+
+
+# pytdx get_security_bars.py 中记录的响应包 (category=9, market=0, code=000001, start=0, count=10)
+RECORDED_BARS = bytes.fromhex(
+    'b1cb74000c01086401002d05aa00aa000a006ec73301b28c011e3254a081ad4816d6984d6fc7330154ae0182024ab0a51d4978090c4e'
+    '70c733015414285e8003bb488b59a64d71c73301140086015ec059274945cb154e74c73301006828724060f648ae0edc4d75c7330100'
+    '0a1e7c40f6da48a37dc24d76c7330100680ad0018052b748ad68a24d77c7330100680072a0f0a448f8b9914d78c733010054285ee0a4'
+    '8b48c294764d7bc733010aa401b8014a001def4874abd44d')
+
+
+def price_bytes(v):
+    ''' pytdx.helper.get_price 的逆运算 '''
+    neg = v < 0
+    v = abs(v)
+    first = (v & 0x3f) | (0x40 if neg else 0)
+    v >>= 6
+    if not v:
+        return bytes([first])
+    out = [first | 0x80]
+    while v:
+        b = v & 0x7f
+        v >>= 7
+        out.append(b | (0x80 if v else 0))
+    return bytes(out)
+
+
+def prices_bytes(*values):
+    return b''.join(price_bytes(v) for v in values)
+
+
+def random_volume_raw(rnd):
+    return (rnd.randrange(0x40, 0x50) << 24) | rnd.randrange(0, 1 << 24)
+
+
+@unittest.skipUnless(HAS_PYTDX, 'pytdx not installed')
+class TestTdxParser(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(7)
+
+    def test_get_volumes(self):
+        raws = [random_volume_raw(self.rnd) for _ in range(5000)] + [0x4a808080, 0x49800000]
+        self.assertEqual(get_volumes(raws).tolist(), [get_volume(r) for r in raws])
+
+    def assert_bars_equal(self, body, category):
+        expected = GetSecurityBarsCmd(None)
+        expected.category = category
+        expected = expected.parseResponse(body)
+        cmd = SecurityBarsCmd(None)
+        cmd.category = category
+        arr = cmd.parseResponse(body)
+        self.assertEqual(len(arr), len(expected))
+        for bar, kl in zip(arr.tolist(), expected):
+            self.assertEqual(bar, (kl['datetime'], kl['open'], kl['close'], kl['high'], kl['low'], kl['vol'], kl['amount']))
+
+    def test_recorded_bars(self):
+        self.assert_bars_equal(RECORDED_BARS[0x10:], 9)
+
+    def test_format_bars(self):
+        body = RECORDED_BARS[0x10:]
+        expected = GetSecurityBarsCmd(None)
+        expected.category = 9
+        expected = expected.parseResponse(body)
+        cmd = SecurityBarsCmd(None)
+        cmd.category = 9
+        arr = cmd.parseResponse(body)
+        src = SrcTdx()
+        for fmt in ('list', 'dict', 'record'):
+            self.assertEqual(src.format_kline_response(arr, ['close'], fmt), src.format_kline_response(expected, ['close'], fmt))
+        native = src.format_kline_response(arr, fmt='np')
+        self.assertEqual(native.dtype, src.format_kline_response(expected, fmt='np').dtype)
+        self.assertTrue((native == src.format_kline_response(expected, fmt='np')).all())
+
+    def test_minute_bars(self):
+        body = struct.pack('<H', 300)
+        for i in range(300):
+            zipday = ((2025 - 2004) << 11) + 12 * 100 + 1
+            body += struct.pack('<HH', zipday, 9 * 60 + 31 + i)
+            body += prices_bytes(self.rnd.randint(-500, 500), *[self.rnd.randint(-2000, 2000) for _ in range(3)])
+            body += struct.pack('<II', random_volume_raw(self.rnd), random_volume_raw(self.rnd))
+        self.assert_bars_equal(body, 8)
+
+    def test_quotes(self):
+        stocks = [(0, '000001'), (1, '600000')]
+        body = struct.pack('<HH', 0, len(stocks))
+        for market, code in stocks:
+            body += struct.pack('<B6sH', market, code.encode(), 0)
+            body += prices_bytes(1234, -10, 5, 20, -15, 14593000, -1234, 123456, 10)
+            body += struct.pack('<I', random_volume_raw(self.rnd))
+            body += prices_bytes(*[self.rnd.randint(-50, 50000) for _ in range(24)])
+            body += struct.pack('<H', 0) + prices_bytes(1, 2, 3, 4) + struct.pack('<hH', 12, 0)
+        native = SecurityQuotesCmd(None).parseResponse(body)
+        expected = SrcTdx().format_quote_response([c for _, c in stocks], GetSecurityQuotesCmd(None).parseResponse(body))
+        self.assertEqual({code: q for _, code, q in native}, expected)
+
+    def test_tline_columns(self):
+        rows = SrcTdx().format_tline_response([{'price': 10.0, 'vol': 2}, {'price': 10.5, 'vol': 2}], fmt='list')
+        self.assertEqual(rows, [['09:31', 10.0, 200, 2000.0, 10.0], ['09:32', 10.5, 200, 2100.0, 10.25]])
+        self.assertEqual(len(rows[0]), len(SrcTdx.tline_cols))
+
+    def test_transactions(self):
+        rows = [(9 * 60 + 30 + i // 20, self.rnd.randint(-5, 5), self.rnd.randint(1, 9999), self.rnd.randint(1, 99), self.rnd.randint(0, 2))
+                for i in range(2000)]
+        rows[0] = (rows[0][0], 1234) + rows[0][2:]
+        body = struct.pack('<H', len(rows))
+        for t, p, v, n, bs in rows:
+            body += struct.pack('<H', t) + prices_bytes(p, v, n, bs, 0)
+        expected = SrcTdx().format_transaction_response(GetTransactionData(None).parseResponse(body))
+        self.assertEqual(TransactionCmd(None).parseResponse(body), expected)
+
+        body = struct.pack('<HI', len(rows), 0)
+        for t, p, v, n, bs in rows:
+            body += struct.pack('<H', t) + prices_bytes(p, v, bs, 0)
+        expected = SrcTdx().format_transaction_response(GetHistoryTransactionData(None).parseResponse(body))
+        self.assertEqual(HistoryTransactionCmd(None).parseResponse(body), expected)
+
+
+class FakeTdxHandler(socketserver.BaseRequestHandler):
+    """ 按顺序回复请求, K线请求返回 count 根K线, 每根K线的开盘价为 start/1000, start 为 corrupt_start 时返回无法解压的数据 """
+    corrupt_start = None
+
+    def recv_exact(self, n):
+        buf = b''
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                raise EOFError
+            buf += chunk
+        return buf
+
+    def handle(self):
+        try:
+            while True:
+                head = self.recv_exact(10)
+                pkg = head + self.recv_exact(struct.unpack_from('<H', head, 6)[0])
+                if len(pkg) == 38 and struct.unpack_from('<H', pkg, 10)[0] == 0x052d:
+                    start, count = struct.unpack_from('<HH', pkg, 24)
+                    if start == self.corrupt_start:
+                        self.request.sendall(struct.pack('<IIIHH', 0, 0, 0, 4, 8) + b'bad!')
+                        continue
+                    body = struct.pack('<H', count)
+                    for i in range(count):
+                        body += struct.pack('<I', 20250101 + i) + prices_bytes(start if i == 0 else 0, 1, 2, -1) + struct.pack('<II', 0x4a000000, 0x4b000000)
+                    zipped = zlib.compress(body)
+                    self.request.sendall(struct.pack('<IIIHH', 0, 0, 0, len(zipped), len(body)) + zipped)
+                else:
+                    self.request.sendall(struct.pack('<IIIHH', 0, 0, 0, 1, 1) + b'\x00')
+        except (EOFError, OSError):
+            pass
+
+
+@unittest.skipUnless(HAS_PYTDX, 'pytdx not installed')
+class TestTdxPipeline(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeTdxHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.port = cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def requests(self):
+        return [(SecurityBarsCmd, (9, 0, '000001', start, 3 + start % 5)) for start in range(0, 4000, 100)]
+
+    def check(self, requests, results):
+        self.assertEqual(len(results), len(requests))
+        for (_, params), arr in zip(requests, results):
+            self.assertEqual(len(arr), params[4])
+            self.assertEqual(arr['open'][0], params[3] / 1000)
+
+    def test_pipeline(self):
+        api = TdxNativeHq_API()
+        with api.connect('127.0.0.1', self.port):
+            requests = self.requests()
+            self.check(requests, api.pipeline(requests, 8))
+            self.check(requests[:3], api.pipeline(requests[:3], 1))
+
+    def test_pipeline_error_reconnects(self):
+        src = SrcTdx()
+        src.native = True
+        src.pipeline_depth = 8
+        src.bars_page_size = 3
+        src._pool = TdxPool(lambda: [['127.0.0.1', self.port]], heartbeat_interval=0)
+        with src.pool.client() as client:
+            # 不使用 pytdx 的重试, 直接返回失败
+            client._tdx.auto_retry = False
+            sock = client._tdx.client
+        # 3页K线一次发送, 第二页的响应出错时第三页的响应还在连接上
+        FakeTdxHandler.corrupt_start = 3
+        try:
+            self.assertEqual(src.klines('000001', 'd', 7), {})
+        finally:
+            FakeTdxHandler.corrupt_start = None
+        with src.pool.client() as client:
+            self.assertIsNotNone(client._tdx.client)
+            self.assertIsNot(client._tdx.client, sock)
+        bars = src.klines('000001', 'd', 7)['000001']
+        self.assertEqual([b[1] for b in bars], [0.006, 0.003, 0.004, 0.005, 0.0, 0.001, 0.002])
+
+    def test_async_client(self):
+        async def run():
+            client = await AsyncTdxClient('127.0.0.1', self.port, depth=8).connect()
+            try:
+                requests = self.requests()
+                results = await asyncio.gather(*(client.call(cmd_cls, *params) for cmd_cls, params in requests))
+                self.check(requests, results)
+            finally:
+                await client.close()
+        asyncio.run(run())
+
+
+@unittest.skipUnless(HAS_PYTDX, 'pytdx not installed')
+class TestTdxPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeTdxHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.host = ['127.0.0.1', cls.server.server_address[1]]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def pool(self, hosts, size_per_host=1):
+        pool = TdxPool(lambda: hosts, size_per_host, heartbeat_interval=0, checkout_timeout=0.2)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_checkout_checkin(self):
+        pool = self.pool([self.host], 2)
+        a = pool.checkout()
+        b = pool.checkout()
+        self.assertIsNot(a, b)
+        self.assertTrue(a.is_connected and b.is_connected)
+        self.assertRaises(TimeoutError, pool.checkout)
+        pool.checkin(a)
+        self.assertIs(pool.checkout(), a)
+
+    def test_connect_failure(self):
+        with socketserver.TCPServer(('127.0.0.1', 0), FakeTdxHandler) as closed:
+            port = closed.server_address[1]
+        pool = self.pool([['127.0.0.1', port]])
+        self.assertRaises(ConnectionError, pool.checkout)
+        # 连接失败的客户端被放回空闲队列
+        self.assertRaises(ConnectionError, pool.checkout)
+
+    def test_broken_client(self):
+        pool = self.pool([self.host])
+        with self.assertRaises(ValueError):
+            with pool.client() as client:
+                sock = client._tdx.client
+                raise ValueError
+        self.assertFalse(client.is_connected)
+        with pool.client() as again:
+            self.assertIs(again, client)
+            self.assertIsNot(again._tdx.client, sock)
+            self.assertEqual(len(again.pipeline([(SecurityBarsCmd, (9, 0, '000001', 0, 3))])[0]), 3)
+
+    def test_heartbeat_skips_busy_clients(self):
+        pool = self.pool([self.host], 2)
+        busy = pool.checkout()
+        idle = pool.checkout()
+        pool.checkin(idle)
+        probed = []
+        for w in (busy, idle):
+            w.heartbeat = lambda w=w: probed.append(w) or True
+        pool._heartbeat()
+        self.assertEqual(probed, [idle])
+        pool.checkin(busy)
+
+    def test_heartbeat_does_not_hold_reconnects(self):
+        pool = self.pool([self.host])
+        client = pool.checkout()
+        pool.checkin(client)
+        connect = client.connect
+
+        def slow_connect(host=None):
+            time.sleep(0.5)
+            return connect(host)
+        client.connect = slow_connect
+        client.heartbeat = lambda: False
+        thread = threading.Thread(target=pool._heartbeat)
+        thread.start()
+        # 心跳失败后只断开连接, checkout 不需要等待重连
+        start = time.time()
+        self.assertIs(pool.checkout(timeout=0.3), client)
+        self.assertTrue(client.is_connected)
+        self.assertGreaterEqual(time.time() - start, 0.5)
+        pool.checkin(client)
+        thread.join()
+
+    def test_failed_heartbeat_is_single_attempt(self):
+        pool = self.pool([self.host])
+        client = pool.checkout()
+        pool.checkin(client)
+        # 对端不再可写, 心跳请求失败
+        client._tdx.client.shutdown(socket.SHUT_RDWR)
+        thread = threading.Thread(target=pool._heartbeat)
+        thread.start()
+        start = time.time()
+        self.assertIs(pool.checkout(timeout=1), client)
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(client.is_connected)
+        self.assertTrue(client._tdx.auto_retry)
+        pool.checkin(client)
+        thread.join()
+
+    def test_heartbeat_moves_demoted_host(self):
+        hosts = [self.host]
+        pool = self.pool(hosts)
+        client = pool.checkout()
+        pool.checkin(client)
+        hosts[:] = [['localhost', self.host[1]]]
+        pool._heartbeat()
+        self.assertEqual(client.host, ('localhost', self.host[1]))
+        self.assertFalse(client.is_connected)
+        self.assertTrue(pool.checkout().is_connected)
+
+
+@unittest.skipUnless(HAS_PYTDX, 'pytdx not installed')
+class TestTdxHosts(unittest.TestCase):
+    def test_cold_cache_waits_for_discovery(self):
+        hosts = [('a', '10.0.0.1', 7709), ('b', '10.0.0.2', 7709), ('c', '10.0.0.3', 7709)]
+
+        def ping(ip, port=7709, market=2, timeout=1):
+            # 第一个服务器立即响应, 其他的稍后响应
+            delay = {'10.0.0.1': 0.01, '10.0.0.2': 0.2, '10.0.0.3': 0.3}[ip]
+            time.sleep(delay)
+            return True, delay, ip, port, 100
+
+        with tempfile.TemporaryDirectory() as tmp:
+            old = set_cache_dir(tmp)
+            try:
+                with patch('stockrt.sources.pymtdx.hq_hosts', hosts), patch.object(SrcTdx, 'ping', staticmethod(ping)):
+                    self.assertEqual(TdxHosts().best(8), [['10.0.0.1', 7709], ['10.0.0.2', 7709], ['10.0.0.3', 7709]])
+                    # 之后直接使用保存的统计数据
+                    self.assertEqual(len(TdxHosts().best(8, wait=0)), 3)
+            finally:
+                set_cache_dir(old)
+
+
+if __name__ == '__main__':
+    unittest.main()
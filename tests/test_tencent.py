@@ -1,5 +1,7 @@
+import json
 import unittest
 from stockrt import rtsource
+from stockrt.sources.rtbase import LazyQuotes
 
 class TestTencentFunctions(unittest.TestCase):
     source = rtsource('qq')
@@ -105,6 +107,29 @@ class TestTencentFunctions(unittest.TestCase):
             self.assertIsInstance(entry[2], int)
             self.assertIsInstance(entry[3], int)
 
+    def test_lazy_quotes_match_eager(self):
+        fields = ['v_sh600000="1', '浦发银行', '600000', '10.10', '9.90', '10.00', '10000']
+        fields += ['5000', '5000'] + ['10.1', '100'] * 10 + ['', '20250102150000', '0.20', '2.02', '10.20', '9.80']
+        fields += ['10.10/10000/10100000', '10000', '1010', '0.5', '6.0', '', '10.20', '9.80', '4.04']
+        fields += ['3000', '3000', '0.5', '10.89', '8.91', '1.2', '-100', '10.05', '5.9', '6.1', '"']
+        rep_data = [(['600000'], '~'.join(fields) + ';\n')]
+        eager = self.source.format_quote_response(rep_data)
+        lazy = self.source.format_quote_response(rep_data, lazy=True)
+        self.assertIsInstance(lazy, LazyQuotes)
+        self.assertIn('600000', lazy)
+        self.assertEqual(lazy['600000'], eager['600000'])
+
+    def test_tline_updates_match_full(self):
+        data = [f'{t // 60:02d}{t % 60:02d} {10 + i / 100:.2f} {100 * (i + 1) * (i + 2)} {1000.0 * (i + 1) * (i + 2):.2f}'
+            for i, t in enumerate(range(570, 600))]
+        rep_data = [('600000', json.dumps({'data': {'sh600000': {'data': {'data': data}}}}))]
+        full = self.source.format_tline_response(rep_data, fmt='list')['600000']
+        for known in (0, 1, 10, 30):
+            updates = self.source.format_tline_updates(rep_data, {'600000': known})['600000']
+            self.assertEqual(updates, full[max(known - 1, 0):])
+        # 新的交易日数据比已有的少时从头开始
+        self.assertEqual(self.source.format_tline_updates(rep_data, {'600000': 100})['600000'], full)
+
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(TestTencentFunctions('test_stock_transactions_start'))
@@ -0,0 +1,67 @@
+import random
+import unittest
+from stockrt.sources.rtbase import NoneSourcePy
+from stockrt.sources.tickbars import TickBars
+
+
+class FakeSource(NoneSourcePy):
+    ''' 返回时间 >= start 的成交, 可以只返回前 limit 笔来模拟盘中 '''
+    def __init__(self, ticks):
+        self.ticks = ticks
+        self.limit = len(ticks)
+        self.starts = []
+
+    def transactions(self, stocks, date=None, start='', fmt=None):
+        self.starts.append(dict(start))
+        cols = ['time', 'price', 'volume', 'bs']
+        return {c: [dict(zip(cols, t)) for t in self.ticks[:self.limit] if t[0] >= start.get(c, '')] for c in stocks}
+
+
+def make_ticks(rnd):
+    ticks = [('09:25:00', 10.0, 5000, 0)]
+    for s in range(9 * 3600 + 30 * 60, 9 * 3600 + 40 * 60, 3):
+        # 同一秒可能有多笔成交
+        for _ in range(rnd.randint(1, 2)):
+            ticks.append((f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}', rnd.randint(990, 1010) / 100, rnd.randint(1, 50) * 100, rnd.randint(0, 2)))
+    return ticks
+
+
+def expected_bars(ticks):
+    bars = {}
+    for t, p, v, bs in ticks:
+        m = max(int(t[:2]) * 60 + int(t[3:5]) + 1, 571)
+        bars.setdefault(f'{m // 60:02d}:{m % 60:02d}', []).append((p, v, bs))
+    return [[t, g[0][0], g[-1][0], max(p for p, _, _ in g), min(p for p, _, _ in g), sum(v for _, v, _ in g),
+             sum(p * v for p, v, _ in g), sum(v for _, v, bs in g if bs == 1), sum(v for _, v, bs in g if bs == 2)]
+            for t, g in bars.items()]
+
+
+class TestTickBars(unittest.TestCase):
+    def assert_bars(self, bars, expected):
+        self.assertEqual(len(bars), len(expected))
+        for bar, exp in zip(bars, expected):
+            self.assertEqual(bar[0][-5:], exp[0])
+            self.assertEqual(bar[1:6] + bar[7:], exp[1:6] + exp[7:])
+            self.assertAlmostEqual(bar[6], exp[6], places=4)
+
+    def test_incremental(self):
+        ticks = make_ticks(random.Random(5))
+        source = FakeSource(ticks)
+        tb = TickBars(source, date='2025-01-02')
+        rnd = random.Random(9)
+        source.limit = 0
+        tb.update('sh600000')
+        while source.limit < len(ticks):
+            source.limit = min(source.limit + rnd.randint(1, 40), len(ticks))
+            tb.update()
+        self.assertEqual(source.starts[1], {'sh600000': ''})
+        self.assert_bars(tb['sh600000'], expected_bars(ticks))
+        self.assertEqual(tb['sh600000'][0][0], '2025-01-02 09:31')
+        # 没有新成交时不改变K线
+        self.assertEqual(tb.update(), {'sh600000': []})
+        self.assert_bars(tb['sh600000'], expected_bars(ticks))
+        self.assertEqual(tb.bars('sh600000', fmt='dict')[0]['buy_volume'], expected_bars(ticks)[0][7])
+
+
+if __name__ == '__main__':
+    unittest.main()
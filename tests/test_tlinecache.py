@@ -0,0 +1,76 @@
+import unittest
+import tempfile
+import importlib.util
+from datetime import datetime
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+if HAS_NUMPY:
+    from stockrt.sources.rtbase import set_cache_dir
+    from stockrt.sources.tlinecache import TLINE_TIMES, cached_tlines, get_tline_cache
+
+
+SESSIONS = ['2026-10-13', '2026-10-14', '2026-10-15', '2026-10-16', '2026-10-19', '2026-10-20']
+
+
+class FakeSource:
+    ''' 每个交易日的分时数据, now 之前的交易日是完整的, now 当天只到 now 的时间 '''
+    def __init__(self):
+        self.now = None
+        self.calls = []
+
+    def rows(self, code, day):
+        times = TLINE_TIMES if day < self.now.date().isoformat() else [t for t in TLINE_TIMES if t <= self.now.strftime('%H:%M')]
+        base = int(code[-1]) * 10 + SESSIONS.index(day)
+        return [[f'{day} {t}', base + i / 100, 100 * (i + 1), 1000.0 * (i + 1), base + i / 200] for i, t in enumerate(times)]
+
+    def fetch(self, codes, n):
+        self.calls.append((list(codes), n))
+        days = [d for d in SESSIONS if d <= self.now.date().isoformat()][-n:]
+        return {c: [r for d in days for r in self.rows(c, d)] for c in codes}
+
+    def expected(self, code, days):
+        return [r for d in [d for d in SESSIONS if d <= self.now.date().isoformat()][-days:] for r in self.rows(code, d)]
+
+
+@unittest.skipUnless(HAS_NUMPY, 'numpy not installed')
+class TestTlineCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_dir = set_cache_dir(self.tmp.name)
+        get_tline_cache().reset()
+        self.source = FakeSource()
+        self.codes = ['sh600001', 'sz000002', 'sz300003']
+
+    def tearDown(self):
+        get_tline_cache().reset()
+        set_cache_dir(self.old_dir)
+        self.tmp.cleanup()
+
+    def run_at(self, now, days=3):
+        self.source.now = now
+        self.source.calls = []
+        result = cached_tlines(self.source.fetch, self.codes, days, now)
+        for c in self.codes:
+            self.assertEqual(result[c], self.source.expected(c, days))
+        return self.source.calls
+
+    def test_incremental(self):
+        # 第一次使用: 一只股票探测日历, 其余请求多日数据
+        self.assertEqual(self.run_at(datetime(2026, 10, 19, 10, 0)), [(self.codes[:1], 3), (self.codes[1:], 3)])
+        # 已收盘的交易日来自缓存, 只请求当天
+        self.assertEqual(self.run_at(datetime(2026, 10, 19, 11, 0)), [(self.codes, 1)])
+        # 第二天: 缺少上一个交易日, 请求两天
+        self.assertEqual(self.run_at(datetime(2026, 10, 20, 9, 45)), [(self.codes, 2)])
+        self.assertEqual(self.run_at(datetime(2026, 10, 20, 10, 0)), [(self.codes, 1)])
+        # 新进程从缓存目录加载
+        get_tline_cache().reset()
+        self.assertEqual(self.run_at(datetime(2026, 10, 20, 10, 30), days=4), [(self.codes, 1)])
+
+    def test_weekend(self):
+        self.run_at(datetime(2026, 10, 16, 16, 0))
+        # 周末请求到的是周五的数据, 已经缓存
+        self.assertEqual(self.run_at(datetime(2026, 10, 18, 12, 0)), [(self.codes, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+import importlib.util
+from urllib.parse import urlsplit, parse_qs
+from stockrt.sources.cailianshe import CailianShe
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+if HAS_NUMPY:
+    import numpy as np
+    from stockrt.sources.tlinematrix import TlineMatrix
+
+
+class FakeCls(CailianShe):
+    ''' 按分组生成财联社批量分时接口的响应, 每只股票 points 个分时点, 只包含 url 中 fields 请求的字段 '''
+    tline_max_num = 2
+
+    def __init__(self):
+        self.points = 0
+        self.groups = []
+
+    def _fetch_concurrently(self, stocks, url_func, format_func, convert_code=True, url_kwargs={}, fmt_kwargs={}):
+        self.groups.append(len(stocks))
+        minutes = [930] + [h * 100 + m for t in list(range(571, 691)) + list(range(781, 901)) for h, m in [divmod(t, 60)]]
+        rep_data = []
+        for codes in stocks:
+            fields = parse_qs(urlsplit(url_func(codes)[0]).query)['fields'][0].split(',')
+            # business_amount 为每分钟的成交量
+            line = [{'minute': m, 'last_px': 10 + i / 100, 'change': 0.01, 'business_amount': 1000 + i}
+                for i, m in enumerate(minutes[:self.points])]
+            data = {c: {'line': [{k: v for k, v in item.items() if k in fields} for item in line]} for c in map(self.get_secucode, codes)}
+            rep_data.append([codes, json.dumps({'data': data})])
+        return format_func(rep_data, **fmt_kwargs)
+
+
+@unittest.skipUnless(HAS_NUMPY, 'numpy not installed')
+class TestTlineMatrix(unittest.TestCase):
+    def test_refresh(self):
+        source = FakeCls()
+        codes = ['sh600000', 'sz000001', 'sh601011', 'bj920000', 'sz300750']
+        matrix = TlineMatrix(codes, source)
+        self.assertEqual(matrix.price.shape, (5, 241))
+        source.points = 121
+        self.assertEqual(matrix.refresh(), 120)
+        self.assertEqual(source.groups, [3])
+        self.assertEqual(matrix.columns()['time'][-1], '11:30')
+        self.assertTrue(np.isnan(matrix.price[:, 121:]).all())
+        # 下午开盘后只写入最后一个已知点之后的数据
+        matrix.price[:, :120] = 0
+        source.points = 125
+        self.assertEqual(matrix.refresh(), 124)
+        self.assertEqual(matrix.times[124], '13:04')
+        self.assertTrue((matrix.price[:, :120] == 0).all())
+        self.assertEqual(matrix.price[matrix.row('sz300750'), 120:125].tolist(), [11.2, 11.21, 11.22, 11.23, 11.24])
+        self.assertEqual(matrix.volume[0, 124], 1124)
+
+    def test_restart(self):
+        source = FakeCls()
+        matrix = TlineMatrix(['sh600000'], source)
+        source.points = 50
+        matrix.refresh()
+        source.points = 3
+        matrix.refresh()
+        self.assertEqual(np.count_nonzero(~np.isnan(matrix.price[0])), 3)
+
+    def test_time_format(self):
+        rows = CailianShe._tline_rows([{'minute': 930, 'last_px': 1, 'change': 0}, {'minute': 1301, 'last_px': 1, 'change': 0}])
+        self.assertEqual([r[0] for r in rows], ['09:30', '13:01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
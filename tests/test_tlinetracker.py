@@ -0,0 +1,44 @@
+import unittest
+from stockrt.sources.rtbase import NoneSourcePy
+from stockrt.sources.tlinetracker import TlineTracker
+
+
+class FakeSource(NoneSourcePy):
+    ''' 只实现 tlines, tline_updates 使用 rtbase 默认的截取 '''
+    tline_cols = ['time', 'price', 'volume']
+
+    def __init__(self):
+        self.points = 0
+        self.offset = 0
+
+    def tlines(self, stocks, fmt=None):
+        rows = [[f'{t // 60:02d}:{t % 60:02d}', 10 + self.offset + i / 100, 100 * i] for i, t in enumerate(range(570, 570 + self.points))]
+        return {c: [list(r) for r in rows] for c in stocks}
+
+
+class TestTlineTracker(unittest.TestCase):
+    def test_incremental(self):
+        source = FakeSource()
+        tracker = TlineTracker(source)
+        source.points = 5
+        self.assertEqual(len(tracker.update(['sh600000', 'sz000001'])['sh600000']), 5)
+        source.points = 8
+        new = tracker.update()
+        self.assertEqual([r[0] for r in new['sz000001']], ['09:34', '09:35', '09:36', '09:37'])
+        self.assertEqual(tracker['sz000001'], source.tlines(['sz000001'])['sz000001'])
+        self.assertEqual(tracker.series('sz000001', fmt='dict')[-1], {'time': '09:37', 'price': 10.07, 'volume': 700})
+
+    def test_restart(self):
+        source = FakeSource()
+        tracker = TlineTracker(source)
+        source.points = 20
+        tracker.update('sh600000')
+        # 数据源从头开始(新的交易日), 点数少于已有的
+        source.points = 3
+        source.offset = 1
+        self.assertEqual(len(tracker.update('sh600000')['sh600000']), 3)
+        self.assertEqual(tracker['sh600000'], source.tlines(['sh600000'])['sh600000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 from stockrt.wrapper import FetchWrapper, rtsource
-from stockrt.sources.rtbase import set_array_format
+import tempfile
+from stockrt.wrapper import set_rate_limits
+from stockrt.sources.rtbase import set_array_format, set_cache_dir, _rate_budgets
 
 class TestWrapper(unittest.TestCase):
 
@@ -26,6 +28,23 @@ class TestWrapper(unittest.TestCase):
         data_source2 = FetchWrapper.get_data_source('sina')
         self.assertEqual(data_source1, data_source2)
 
+    def test_budget_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            old_dir = set_cache_dir(tmp)
+            _rate_budgets.reset()
+            try:
+                wrapper = FetchWrapper('qtapi', 'quotes', ['sina', 'tencent', 'cls'])
+                self.assertEqual(wrapper._by_budget(wrapper.current_source_order), ['sina', 'tencent', 'cls'])
+                set_rate_limits('sina', [(1, 3600)])
+                FetchWrapper.get_data_source('sina').rate_budget.acquire()
+                self.assertEqual(wrapper._by_budget(wrapper.current_source_order), ['tencent', 'cls', 'sina'])
+                set_rate_limits('sina', None)
+                self.assertEqual(wrapper._by_budget(wrapper.current_source_order), ['sina', 'tencent', 'cls'])
+            finally:
+                _rate_budgets.reset()
+                set_cache_dir(old_dir)
+
+
 
 class TestSourcesDataMatch(unittest.TestCase):
     sourcekeys = ['sina', 'qq', 'em', 'xq', 'cls', 'sohu', 'tgb']